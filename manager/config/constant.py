@@ -6,8 +6,10 @@ import os
 import select
 import socket
 import sys
+import threading
 import time
 import timeit
+import weakref
 
 
 class FILE(object):
@@ -73,6 +75,39 @@ class PROTO(object):
     TCP = socket.getprotobyname('tcp')
 
 
+class BUFFER(object):
+    """ socket 接收缓冲区池
+
+    基本思路:
+    - 每个 socket 持有一块预分配的 bytearray, 反复用于 recvfrom_into;
+    - socket 被回收或关闭时, 对应的缓冲区随之释放。
+    """
+    POOL = weakref.WeakKeyDictionary()
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def get(sock, size=4096):
+        """ 获取 sock 专属的接收缓冲区, 容量不足时重新分配 """
+        BUFFER.LOCK.acquire()
+        try:
+            buff = BUFFER.POOL.get(sock)
+            if buff is None or len(buff) < size:
+                buff = bytearray(size)
+                BUFFER.POOL[sock] = buff
+            return buff
+        finally:
+            BUFFER.LOCK.release()
+
+    @staticmethod
+    def free(sock):
+        """ 释放 sock 对应的接收缓冲区 """
+        BUFFER.LOCK.acquire()
+        try:
+            BUFFER.POOL.pop(sock, None)
+        finally:
+            BUFFER.LOCK.release()
+
+
 class SOCKET(object):
 
     @staticmethod
@@ -106,8 +141,16 @@ class SOCKET(object):
             return None
 
     @staticmethod
-    def recvfrom(sock, timeout, size=4096):
-        """ 接收一个报文(0~4096 bytes) """
+    def recvfrom(sock, timeout, size=4096, view=False):
+        """ 接收一个报文(0~size bytes)
+
+        @param view: 返回 socket 缓冲区的 memoryview (仅在下一次接收前有效),
+                     否则返回报文的 bytes 拷贝
+        @type  view: bool
+
+        @return: (接收时间, 报文)
+        @rtype : (double, bytes/memoryview)
+        """
         from config.logger import Logger
         logger = Logger.get()
         logger.debug('The socket recv timeout is %f.' % timeout)
@@ -124,11 +167,12 @@ class SOCKET(object):
             return (-4, None)
 
         # 参考: https://stackoverflow.com/questions/52288283
-        byte_stream = bytearray(size)
+        # 接收到 socket 专属的缓冲区, 避免每次接收都重新分配
+        byte_stream = BUFFER.get(sock, size)
         nbytes = 0
         recv_time = 0
         try:
-            nbytes, addr = sock.recvfrom_into(byte_stream)
+            nbytes, addr = sock.recvfrom_into(byte_stream, size)
             if nbytes <= 0:
                 logger.warning('...the socket abnormal closed...')
                 return (-1, None)
@@ -137,15 +181,14 @@ class SOCKET(object):
         except Exception:
             logger.exception('Failed to receive a packet.')
             return (-3, None)
-        packet = ''
-        for i in range(nbytes):
-            packet = packet + chr(byte_stream[i])
-        return (recv_time, packet)
+        packet = memoryview(byte_stream)[:nbytes]
+        return (recv_time, packet if view else packet.tobytes())
 
     @staticmethod
     def close(sock):
         """ 关闭一个 socket """
         if sock is not None:
+            BUFFER.free(sock)
             sock.close()
         return None
 
@@ -17,13 +17,13 @@ class LOG(object):
     LOWEST = 10
     OPEN_CONS = False
     OPEN_FILE = False
+    LOCK = threading.RLock()
 
     @staticmethod
     def load(filename='base.conf'):
         """ 加载运行日志配置文件 """
         filepath = FILE.conf(filename)
-        lock = threading.Lock()
-        lock.acquire()
+        LOG.LOCK.acquire()
         try:
             LOG.PARSER.read(filepath)
             LOG.CONSOLE = LOG.PARSER.getint('logger', 'console')
@@ -34,7 +34,7 @@ class LOG(object):
         except Exception:
             print 'Please check your logger configure file.'
         finally:
-            lock.release()
+            LOG.LOCK.release()
 
 
 def static_logger(**kwargs):
@@ -108,6 +108,7 @@ class Logger(object):
     # 记录已注册的 tid: client_id
     # 记录已注册的 pid: 进程名称
     RECORDS = {}
+    LOCK = threading.RLock()
 
     @staticmethod
     def sign_up(name, TP=True):
@@ -117,13 +118,12 @@ class Logger(object):
         @type  TP: bool
         """
         Id = thread.get_ident() if TP else os.getpid()
-        lock = threading.Lock()
-        lock.acquire()
+        Logger.LOCK.acquire()
         try:
             if Id not in Logger.RECORDS.keys():
                 Logger.RECORDS[Id] = name
         finally:
-            lock.release()
+            Logger.LOCK.release()
 
     @staticmethod
     def log_out(FIN=False):
@@ -133,14 +133,13 @@ class Logger(object):
         @type  FIN: bool
         """
         tid = thread.get_ident()
-        lock = threading.Lock()
-        lock.acquire()
+        Logger.LOCK.acquire()
         try:
             if tid in Logger.RECORDS.keys():
                 getLogger(Logger.RECORDS[tid], FIN=FIN)
                 Logger.RECORDS.pop(tid)
         finally:
-            lock.release()
+            Logger.LOCK.release()
 
     @staticmethod
     def get():
@@ -151,8 +150,7 @@ class Logger(object):
         - 根据 domain 从 getLogger 获取 logger
         - 若不存在对应的 domain, 则默认返回 MAIN 对应的 logger
         """
-        lock = threading.Lock()
-        lock.acquire()
+        Logger.LOCK.acquire()
         try:
             id_ = thread.get_ident()
             if id_ not in Logger.RECORDS.keys():
@@ -161,4 +159,4 @@ class Logger(object):
                 return getLogger('MAIN')
             return getLogger(Logger.RECORDS[id_])
         finally:
-            lock.release()
+            Logger.LOCK.release()
@@ -4,20 +4,24 @@
 
 import ConfigParser
 import json
+import select
 import threading
 import random
 import SocketServer
 import struct
 import time
 import timeit
+import weakref
 import zlib
-from config.constant import FILE, SOCKET
+from config.constant import FILE
 from config.logger import Logger
+from server.socket.record import RecordCodec
 
 
 class SESSION:
     """ 网络会话 基本配置 """
     PARSER = ConfigParser.ConfigParser()
+    LOCK = threading.RLock()
     SERVER_HOST = '10.8.120.46'     # 服务器IP
     SERVER_PORT = 32256             # 服务器端口
     BUFF_SIZE = 2048                # 接收缓冲区
@@ -35,8 +39,7 @@ class SESSION:
     def load(filename='network.conf'):
         logger = Logger.get()
         filepath = FILE.conf(filename)
-        lock = threading.Lock()
-        lock.acquire()
+        SESSION.LOCK.acquire()
         try:
             logger.info('Start to load the session configure.')
             SESSION.PARSER.read(filepath)
@@ -53,14 +56,13 @@ class SESSION:
             logger.warn('Please check your session configure.')
             logger.exception('Failed to load the session configure.')
         finally:
-            lock.release()
+            SESSION.LOCK.release()
 
     @staticmethod
     def cert(ID):
         """ 身份验证 """
         logger = Logger.get()
-        lock = threading.Lock()
-        lock.acquire()
+        SESSION.LOCK.acquire()
         try:
             if ID not in SESSION.IDS:
                 logger.info('...try to allocate a new client id...')
@@ -74,7 +76,7 @@ class SESSION:
             logger.exception('...failed to allocate a new client id...')
             ID = -1
         finally:
-            lock.release()
+            SESSION.LOCK.release()
         return ID
 
 
@@ -83,10 +85,12 @@ class STAMP:
     # 通信逻辑 (0~127)
     ID = 0                          # 会话 ID
     END = 1                         # 结束会话
+    ACK = 2                         # 确认收到一个监测数据 (按顺序)
     # 消息内容标识 (128~255)
     CLIENT = 128                    # 客户端基本配置
     DNS_RESOLVE = 129               # DNS 解析
     ICMPING = 130                   # ICMPing 结果
+    BATCH = 131                     # 批量数据: {'events': [[消息类型, 数据]]}
 
 
 class TYPE:
@@ -97,6 +101,7 @@ class TYPE:
     INT = 3                         # int
     STRING = 4                      # str
     UNICODE = 5                     # unicode
+    RECORDS = 7                     # 二进制监测数据 (server.socket.record)
     UNKNOWN = 255                   # 未知类型
 
     @staticmethod
@@ -146,14 +151,13 @@ class JPRESS:
     def decompress(data, mode):
         """ 解压 JSON数据 """
         if mode == JPRESS.JZLIB:
-            data = zlib.decompress(data)
-        return json.loads(data)
+            return json.loads(zlib.decompress(data))
+        return json.loads(str(data))
 
 
 class FRAME(object):
     """ 应用层通信框架 """
     HEAD = '!BBBBL'
-    PACKET = ''
 
     @staticmethod
     def construct(stamp, data):
@@ -198,7 +202,7 @@ class FRAME(object):
 
     @staticmethod
     def recv(sock):
-        """ 接收数据
+        """ 接收数据: 每个连接使用各自的 FrameDecoder
 
         @return: stamp, data
         @rtype : STAMP, TYPE.*
@@ -206,52 +210,149 @@ class FRAME(object):
         说明: stamp < 0 表示 recv 异常退出
             - 目前只有 stamp == -1 存在意义, 即 socket 异常关闭
         """
+        return FrameDecoder.get(sock).recv(SESSION.TIMEOUT)
+
+
+class FrameDecoder(object):
+    """ 按连接的应用层数据流解码器
+
+    基本思路:
+    - 每个连接持有一个可增长的 bytearray 和 读/写 偏移量, 以 recv_into
+      直接接收到缓冲区的空闲部分, 不再拼接和切片字符串;
+    - 缓冲区中有完整的通信数据时, 数据段以 buffer 引用缓冲区, 不拷贝,
+      有效至下一次接收;
+    - 缓冲区尾部不足以容纳当前通信数据时, 将未解码的数据移到头部, 仍不足
+      时重新分配更大的缓冲区。
+    """
+    HEAD = struct.Struct(FRAME.HEAD)
+    POOL = weakref.WeakKeyDictionary()
+    LOCK = threading.Lock()
+
+    def __init__(self, sock, size=4096):
+        """ 初始化
+
+        @param size: 初始缓冲区大小(单位: bytes)
+        @type  size: int
+        """
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.start = 0              # 未解码数据的起始偏移量
+        self.end = 0                # 已接收数据的结束偏移量
+        self.need = FrameDecoder.HEAD.size  # 下一个通信数据所需的字节数
+
+    @staticmethod
+    def get(sock):
+        """ 获取 sock 专属的解码器 """
+        FrameDecoder.LOCK.acquire()
+        try:
+            decoder = FrameDecoder.POOL.get(sock)
+            if decoder is None:
+                decoder = FrameDecoder(sock, SESSION.BUFF_SIZE)
+                FrameDecoder.POOL[sock] = decoder
+            return decoder
+        finally:
+            FrameDecoder.LOCK.release()
+
+    @staticmethod
+    def free(sock):
+        """ 释放 sock 对应的解码器 """
+        FrameDecoder.LOCK.acquire()
+        try:
+            FrameDecoder.POOL.pop(sock, None)
+        finally:
+            FrameDecoder.LOCK.release()
+
+    def frame(self):
+        """ 解码一个完整的通信数据
+
+        @return: (stamp, type_, flags, 数据段), 数据不完整时为 None
+        @rtype : (int, int, int, buffer)
+        """
+        available = self.end - self.start
+        if available < FrameDecoder.HEAD.size:
+            self.need = FrameDecoder.HEAD.size
+            return None
+        stamp, type_, flags, _, length = \
+            FrameDecoder.HEAD.unpack_from(self.buffer, self.start)
+        self.need = FrameDecoder.HEAD.size + length
+        if available < self.need:
+            return None
+        offset = self.start + FrameDecoder.HEAD.size
+        payload = buffer(self.buffer, offset, length)
+        self.start = offset + length
+        self.need = FrameDecoder.HEAD.size
+        return (stamp, type_, flags, payload)
+
+    def fill(self, timeout):
+        """ 接收数据到缓冲区的空闲部分
+
+        @return: 接收的字节数; < 0 表示接收失败, 与 SOCKET.recvfrom 一致
+        @rtype : int
+        """
+        logger = Logger.get()
+        if timeout < 0:
+            logger.warning('Waiting for the packet timeout.')
+            return -4
+        self.__reserve()
+        try:
+            readable = select.select([self.sock], [], [], timeout)[0]
+        except Exception:
+            logger.exception('Failed to receive a packet.')
+            return -2
+        if len(readable) == 0:
+            logger.warning('Waiting for the packet timeout.')
+            return -4
+        try:
+            nbytes = self.sock.recv_into(memoryview(self.buffer)[self.end:])
+        except Exception:
+            logger.exception('Failed to receive a packet.')
+            return -3
+        if nbytes <= 0:
+            logger.warning('...the socket abnormal closed...')
+            return -1
+        self.end = self.end + nbytes
+        logger.info('Successfully receive a packet %d bytes.' % nbytes)
+        return nbytes
+
+    def recv(self, timeout):
+        """ 接收并解析一个通信数据
+
+        @param timeout: 超时时间(单位: s)
+        @type  timeout: double
+
+        @return: stamp, data; stamp < 0 表示 recv 异常退出
+        @rtype : STAMP, TYPE.*
+        """
         logger = Logger.get()
-        remain = 0
         logger.info('Start to recveive a application data.')
         start = timeit.default_timer()
-
-        # 接收数据头部
-        logger.info('Waiting for a application data header.')
-        while len(FRAME.PACKET) < 8:
-            remain = SESSION.TIMEOUT - timeit.default_timer() + start
-            recv_, data = SOCKET.recvfrom(sock, remain, size=SESSION.BUFF_SIZE)
-            if recv_ < 0:
-                logger.warn('Failed to get the application data header.')
-                return (recv_, None)
-            FRAME.PACKET = FRAME.PACKET + data
-        logger.info('Succeed to get the application data header.')
-
-        # 解析数据头部
-        stamp, type_, flags, _, length = FRAME.analysis(FRAME.PACKET)
-        FRAME.PACKET = FRAME.PACKET[8:]
-
-        # 接收数据段
-        logger.info('Waiting for the application data fragment.')
-        while length > len(FRAME.PACKET):
-            remain = SESSION.TIMEOUT - timeit.default_timer() + start
-            recv_, data = SOCKET.recvfrom(sock, remain, size=SESSION.BUFF_SIZE)
+        frame = self.frame()
+        while frame is None:
+            remain = timeout - timeit.default_timer() + start
+            recv_ = self.fill(remain)
             if recv_ < 0:
-                logger.warn('Failed to get the application data fragment.')
+                logger.warn('Failed to get the application data.')
                 return (recv_, None)
-            FRAME.PACKET = FRAME.PACKET + data
-        logger.info('Succeed to get the application data fragment.')
-
+            frame = self.frame()
+        logger.info('Succeed to get the application data.')
+        stamp, type_, flags, envelope = frame
         # 解析数据段
-        envelope = FRAME.PACKET[0:length]
-        FRAME.PACKET = FRAME.PACKET[length:]
         message = None
         try:
             if type_ == TYPE.DICT:
                 message = FRAME.analysis(envelope, False, flags & 0x01)
             elif type_ == TYPE.FLOAT:
-                message = float(envelope)
+                message = float(str(envelope))
             elif type_ == TYPE.INT:
-                message = int(envelope)
+                message = int(str(envelope))
             elif type_ == TYPE.STRING:
-                message = envelope
+                message = str(envelope)
             elif type_ == TYPE.UNICODE:
-                message = envelope
+                message = str(envelope)
+            elif type_ == TYPE.RECORDS:
+                if flags & 0x01 == JPRESS.JZLIB:
+                    envelope = zlib.decompress(envelope)
+                message = {'events': RecordCodec.decode(envelope)}
             elif type_ == TYPE.UNKNOWN:
                 logger.warn('Get a unknown data type message and thrown away.')
                 return (-6, None)
@@ -260,11 +361,35 @@ class FRAME(object):
             return (-5, None)
         return (stamp, message)
 
+    def __reserve(self):
+        """ 保证缓冲区尾部能容纳下一个通信数据 """
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buffer) - self.start >= self.need and \
+                self.end < len(self.buffer):
+            return
+        unread = self.end - self.start
+        if len(self.buffer) >= self.need:
+            # 未解码的数据移到头部
+            self.buffer[0:unread] = self.buffer[self.start:self.end]
+        else:
+            # 重新分配: 已返回的数据段仍引用原缓冲区
+            size = max(self.need, len(self.buffer) * 2)
+            buff = bytearray(size)
+            buff[0:unread] = self.buffer[self.start:self.end]
+            self.buffer = buff
+        self.start = 0
+        self.end = unread
+
 
 class Handler(SocketServer.BaseRequestHandler):
     """ 服务器: 封装服务器通信逻辑 """
+    SEQ = 0                         # 数据文件序号, 同一秒内的文件名不重复
+    LOCK = threading.Lock()
+
     def handle(self):
         self.id = -1
+        received = 0                # 本连接已确认的监测数据数
         while True:
             stamp, message = FRAME.recv(self.request)
 
@@ -284,14 +409,42 @@ class Handler(SocketServer.BaseRequestHandler):
                 self.logger.info('...client id: %d exit...' % self.id)
                 break
 
-            if stamp == STAMP.DNS_RESOLVE:
-                self.__temp('dns', message)
-
-            if stamp == STAMP.ICMPING:
-                self.__temp('icmping', message)
+            if stamp == STAMP.BATCH:
+                # 按原顺序拆分批量数据
+                for event in message.get('events', []):
+                    self.__dispatch(event[0], event[1])
+            else:
+                self.__dispatch(stamp, message)
+
+            # 监测数据保存后按顺序确认, 客户端收到确认后才删除缓存的数据;
+            # 无法解析的数据 (-5, -6) 同样确认, 避免客户端反复重发
+            if stamp in (STAMP.BATCH, STAMP.DNS_RESOLVE, STAMP.ICMPING,
+                         -5, -6):
+                received = received + 1
+                FRAME.send(self.request, STAMP.ACK, received)
+        FrameDecoder.free(self.request)
+
+    def __dispatch(self, stamp, message):
+        """ 处理一条客户端监测数据 """
+        if stamp == STAMP.DNS_RESOLVE:
+            self.__temp('dns', message)
+
+        if stamp == STAMP.ICMPING:
+            self.__temp('icmping', message)
 
     def __temp(self, name, data):
-        filepath = FILE.new(str(self.id), 'data', name, 'json')
+        """ 保存一条监测数据, 文件名为 名称_时间_序号.json
+
+        一批数据在同一秒内拆分保存, 以进程内递增的序号区分。
+        """
+        Handler.LOCK.acquire()
+        try:
+            Handler.SEQ = Handler.SEQ + 1
+            seq = Handler.SEQ
+        finally:
+            Handler.LOCK.release()
+        filepath = FILE.new(str(self.id), 'data', name, None)
+        filepath = '%s_%06d.json' % (filepath, seq)
         with open(filepath, 'w') as f:
             json.dump(data, f)
 
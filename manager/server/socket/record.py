@@ -0,0 +1,340 @@
+# coding: utf-8
+
+""" 监测结果的二进制记录格式
+
+基本思路:
+- 一批监测数据 (STAMP.BATCH) 编码为一个二进制数据段, 替代 JSON;
+- 字符串 (域名, CNAME) 和 ip 地址 在一批数据内各自去重, 记录中只保存序号;
+- 时间戳以 整数微秒 的差值保存: 发送时间相对批次基准时间, 接收时间相对
+  发送时间, 解码后精确到微秒; 差值超出 32 位 (约 35 分钟) 时无法编码;
+- 每条结果为固定宽度的 struct 记录, 变长的列表只保存序号数组;
+- 解码结果与 JSON 格式的数据结构相同; 无法编码的数据 (未知的消息类型或
+  字段) 抛出 ValueError, 由调用方改用 JSON。
+
+数据格式 (版本 1, 网络字节序):
+- 头部: 魔数 'PR'(2) 版本(1) 保留(1) 事件数(4) 基准时间(8, 微秒)
+- 字符串表: 个数(2) + [长度(2) + utf-8]
+- ip 表: 个数(2) + [类型(1) + 数据], 类型 4/6 为压缩地址, 0 为 长度(1) + 文本
+- 事件:
+    - DNS 解析: 消息类型(1) 域名(2) 记录数(2) + 记录
+        - 服务器(2) 状态(1) CNAME 数(1) ip 数(1) 发送(4) 接收(4) 延迟(4)
+          + CNAME 序号(2 * n) + ip 序号(2 * n)
+    - ICMPing: 消息类型(1) 域名(2) ip(2) 记录数(2) + 记录
+        - seq(2) ttl(1) 发送大小(2) 接收大小(2) 发送(4) 接收(4) 延迟(4)
+- 时间戳 <= 0 (未发送/未接收, 或 错误码 * 1000) 时差值记为 ERROR - 时间戳,
+  ERROR ~ ERROR + ERRORS 不是有效的差值。
+"""
+
+import socket
+import struct
+
+
+class RecordCodec(object):
+    """ 监测结果的二进制编解码 """
+    MAGIC = 'PR'
+    VERSION = 1
+    # 消息类型, 与 STAMP 一致
+    DNS_RESOLVE = 129
+    ICMPING = 130
+    ERROR = -0x80000000             # 时间戳 <= 0 的差值: ERROR - 时间戳
+    ERRORS = 0xffff                 # 可编码的最小时间戳为 -ERRORS(单位: ms)
+    MAXIMUM = 0x7fffffff
+
+    HEAD = struct.Struct('!2sBBLq')
+    COUNT = struct.Struct('!H')
+    KIND = struct.Struct('!B')
+    DNS_EVENT = struct.Struct('!BHH')
+    DNS_RECORD = struct.Struct('!HBBBlll')
+    ICMPING_EVENT = struct.Struct('!BHHH')
+    ICMPING_RECORD = struct.Struct('!HBHHlll')
+
+    DNS_KEYS = frozenset(['dns_server', 'cname', 'ip', 'status',
+                          'send_timestamp', 'recv_timestamp', 'latency'])
+    ICMPING_KEYS = frozenset(['seq', 'ttl', 'sent_size', 'recv_size',
+                              'sent_timestamp', 'recv_timestamp', 'latency'])
+
+    @staticmethod
+    def size(stamp, data):
+        """ 一条监测数据编码后大小的上限 (不计去重)(单位: bytes) """
+        size = 0
+        for domain, value in data.iteritems():
+            size = size + 2 + len(domain) + RecordCodec.ICMPING_EVENT.size
+            if stamp == RecordCodec.ICMPING and isinstance(value, dict):
+                records = value.get('icmping', [])
+                size = size + 18 + RecordCodec.ICMPING_RECORD.size * \
+                    len(records)
+            elif isinstance(value, list):
+                for record in value:
+                    size = size + RecordCodec.DNS_RECORD.size + 20 + \
+                        sum([20 + len(x) for x in record.get('cname', [])]) + \
+                        19 * len(record.get('ip', []))
+        return size
+
+    @staticmethod
+    def encode(events):
+        """ 编码一批监测数据
+
+        @param events: [(消息类型, 数据)]
+        @type  events: [(int, dict)]
+
+        @return: 二进制数据段
+        @rtype : string
+        """
+        encoder = _Encoder()
+        try:
+            for stamp, data in events:
+                encoder.event(stamp, data)
+            return encoder.dump(len(events))
+        except (struct.error, KeyError, TypeError, AttributeError) as e:
+            raise ValueError('Failed to encode the records: %s' % e)
+
+    @staticmethod
+    def decode(data):
+        """ 解码一批监测数据
+
+        @param data: 二进制数据段
+        @type  data: string/buffer
+
+        @return: [[消息类型, 数据]]
+        @rtype : [[int, dict]]
+        """
+        try:
+            return _Decoder(data).events()
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError('Failed to decode the records: %s' % e)
+
+
+class _Table(object):
+    """ 去重表: 值 -> 序号 """
+    def __init__(self):
+        self.values = []
+        self.indexes = {}
+
+    def intern(self, value):
+        index = self.indexes.get(value)
+        if index is None:
+            index = len(self.values)
+            if index > 0xffff:
+                raise ValueError('Too many distinct values in a batch.')
+            self.indexes[value] = index
+            self.values.append(value)
+        return index
+
+
+class _Encoder(object):
+    """ 一批监测数据的编码状态 """
+    def __init__(self):
+        self.strings = _Table()
+        self.ips = _Table()
+        self.parts = []
+        self.base = None            # 基准时间(单位: 微秒)
+
+    def time(self, value, origin=None):
+        """ 时间戳(单位: ms) -> 与 origin (默认为基准时间) 的差值
+
+        @return: 差值, 时间戳(单位: 微秒); 时间戳 <= 0 时为
+                 ERROR - 时间戳, origin
+        @rtype : (int, int)
+        """
+        if value <= 0:
+            code = int(value)
+            if code != value or code < -RecordCodec.ERRORS:
+                raise ValueError('The error timestamp is out of range.')
+            return RecordCodec.ERROR - code, origin
+        value = int(round(value * 1000))
+        if self.base is None:
+            self.base = value
+        delta = value - (self.base if origin is None else origin)
+        if not RecordCodec.ERROR + RecordCodec.ERRORS < delta <= \
+                RecordCodec.MAXIMUM:
+            raise ValueError('The timestamp is out of range.')
+        return delta, value
+
+    def event(self, stamp, data):
+        if not isinstance(data, dict):
+            raise ValueError('The record is not a dict.')
+        for domain, value in data.iteritems():
+            if stamp == RecordCodec.DNS_RESOLVE:
+                self.__dns(domain, value)
+            elif stamp == RecordCodec.ICMPING:
+                self.__icmping(domain, value)
+            else:
+                raise ValueError('Unsupported message type %s.' % stamp)
+
+    def dump(self, count):
+        head = [RecordCodec.HEAD.pack(RecordCodec.MAGIC, RecordCodec.VERSION,
+                                      0, count, self.base or 0)]
+        head.append(RecordCodec.COUNT.pack(len(self.strings.values)))
+        for value in self.strings.values:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            head.append(RecordCodec.COUNT.pack(len(value)))
+            head.append(value)
+        head.append(RecordCodec.COUNT.pack(len(self.ips.values)))
+        for value in self.ips.values:
+            head.append(_Encoder.__address(value))
+        return ''.join(head + self.parts)
+
+    def __dns(self, domain, records):
+        if not isinstance(records, list):
+            raise ValueError('The dns records is not a list.')
+        self.parts.append(RecordCodec.DNS_EVENT.pack(
+            RecordCodec.DNS_RESOLVE, self.strings.intern(domain),
+            len(records)))
+        for record in records:
+            if RecordCodec.DNS_KEYS.symmetric_difference(record):
+                raise ValueError('Unknown dns record fields.')
+            cnames = [self.strings.intern(x) for x in record['cname']]
+            ips = [self.ips.intern(x) for x in record['ip']]
+            sent, origin = self.time(record['send_timestamp'])
+            recv, _ = self.time(record['recv_timestamp'], origin)
+            self.parts.append(RecordCodec.DNS_RECORD.pack(
+                self.ips.intern(record['dns_server']), record['status'],
+                len(cnames), len(ips), sent, recv,
+                int(round(record['latency'] * 1000))))
+            if len(cnames) + len(ips) > 0:
+                self.parts.append(struct.pack('!%dH' % (len(cnames) +
+                                                        len(ips)),
+                                              *(cnames + ips)))
+
+    def __icmping(self, domain, value):
+        if not isinstance(value, dict) or len(value) != 2:
+            raise ValueError('Unknown icmping result fields.')
+        records = value['icmping']
+        self.parts.append(RecordCodec.ICMPING_EVENT.pack(
+            RecordCodec.ICMPING, self.strings.intern(domain),
+            self.ips.intern(value['ip']), len(records)))
+        pack = RecordCodec.ICMPING_RECORD.pack
+        for record in records:
+            if RecordCodec.ICMPING_KEYS.symmetric_difference(record):
+                raise ValueError('Unknown icmping record fields.')
+            sent, origin = self.time(record['sent_timestamp'])
+            recv, _ = self.time(record['recv_timestamp'], origin)
+            self.parts.append(pack(
+                record['seq'], record['ttl'], record['sent_size'],
+                record['recv_size'], sent, recv,
+                int(round(record['latency'] * 1000))))
+
+    @staticmethod
+    def __address(ip):
+        """ ip 表的一项: 能解析的地址以压缩格式保存 """
+        for kind, family in [(4, socket.AF_INET),
+                             (6, getattr(socket, 'AF_INET6', None))]:
+            try:
+                packed = socket.inet_pton(family, ip)
+                return RecordCodec.KIND.pack(kind) + packed
+            except (AttributeError, TypeError, ValueError, socket.error):
+                continue
+        if isinstance(ip, unicode):
+            ip = ip.encode('utf-8')
+        if len(ip) > 0xff:
+            raise ValueError('The ip is too long.')
+        return RecordCodec.KIND.pack(0) + chr(len(ip)) + ip
+
+
+class _Decoder(object):
+    """ 一批监测数据的解码状态 """
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        self.base = 0
+        self.strings = []
+        self.ips = []
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset = self.offset + fmt.size
+        return values
+
+    def bytes(self, length):
+        value = self.data[self.offset:self.offset + length]
+        if len(value) != length:
+            raise IndexError('The records are truncated.')
+        self.offset = self.offset + length
+        return str(value)
+
+    def time(self, sent, recv):
+        """ 差值 -> 发送, 接收时间戳(单位: ms) """
+        origin = self.base
+        if sent <= RecordCodec.ERROR + RecordCodec.ERRORS:
+            sent = float(RecordCodec.ERROR - sent)
+        else:
+            origin = self.base + sent
+            sent = origin / 1000.0
+        if recv <= RecordCodec.ERROR + RecordCodec.ERRORS:
+            return sent, float(RecordCodec.ERROR - recv)
+        return sent, (origin + recv) / 1000.0
+
+    def events(self):
+        magic, version, _, count, self.base = self.unpack(RecordCodec.HEAD)
+        if magic != RecordCodec.MAGIC or version != RecordCodec.VERSION:
+            raise ValueError('Unsupported record format %r %d.' % (magic,
+                                                                  version))
+        for _ in xrange(self.unpack(RecordCodec.COUNT)[0]):
+            length = self.unpack(RecordCodec.COUNT)[0]
+            self.strings.append(self.bytes(length).decode('utf-8'))
+        for _ in xrange(self.unpack(RecordCodec.COUNT)[0]):
+            self.ips.append(self.__address())
+        events = []
+        for _ in xrange(count):
+            stamp = RecordCodec.KIND.unpack_from(self.data, self.offset)[0]
+            if stamp == RecordCodec.DNS_RESOLVE:
+                events.append([stamp, self.__dns()])
+            elif stamp == RecordCodec.ICMPING:
+                events.append([stamp, self.__icmping()])
+            else:
+                raise ValueError('Unsupported message type %d.' % stamp)
+        return events
+
+    def __dns(self):
+        _, domain, count = self.unpack(RecordCodec.DNS_EVENT)
+        records = []
+        for _ in xrange(count):
+            server, status, cnames, ips, sent, recv, latency = \
+                self.unpack(RecordCodec.DNS_RECORD)
+            indexes = []
+            if cnames + ips > 0:
+                fmt = struct.Struct('!%dH' % (cnames + ips))
+                indexes = self.unpack(fmt)
+            sent, recv = self.time(sent, recv)
+            records.append({
+                'dns_server': self.ips[server],
+                'cname': [self.strings[x] for x in indexes[:cnames]],
+                'ip': [self.ips[x] for x in indexes[cnames:]],
+                'status': status,
+                'send_timestamp': sent,
+                'recv_timestamp': recv,
+                'latency': latency / 1000.0
+            })
+        return {self.strings[domain]: records}
+
+    def __icmping(self):
+        _, domain, ip, count = self.unpack(RecordCodec.ICMPING_EVENT)
+        records = []
+        unpack = RecordCodec.ICMPING_RECORD.unpack_from
+        size = RecordCodec.ICMPING_RECORD.size
+        for _ in xrange(count):
+            seq, ttl, sent_size, recv_size, sent, recv, latency = \
+                unpack(self.data, self.offset)
+            self.offset = self.offset + size
+            sent, recv = self.time(sent, recv)
+            records.append({
+                'seq': seq,
+                'ttl': ttl,
+                'sent_size': sent_size,
+                'recv_size': recv_size,
+                'sent_timestamp': sent,
+                'recv_timestamp': recv,
+                'latency': latency / 1000.0
+            })
+        return {self.strings[domain]: {'ip': self.ips[ip],
+                                       'icmping': records}}
+
+    def __address(self):
+        kind = self.unpack(RecordCodec.KIND)[0]
+        if kind == 4:
+            return unicode(socket.inet_ntoa(self.bytes(4)))
+        if kind == 6:
+            return unicode(socket.inet_ntop(socket.AF_INET6, self.bytes(16)))
+        length = self.unpack(RecordCodec.KIND)[0]
+        return self.bytes(length).decode('utf-8')
@@ -0,0 +1,71 @@
+# coding: utf-8
+
+""" 微基准测试: 网络报文校验和
+
+运行方式 (monitor 目录下): python -m benchmark.checksum
+
+对比:
+- legacy: 原实现, 使用 ord() 每次读取 2 字节逐个累加;
+- array : do_check_sum, 使用 array 一次性划分 16 位片段并求和;
+- batch : do_check_sums, 安装了 NumPy 时批量计算等长报文。
+"""
+
+import logging
+import os
+import timeit
+from core.packet.base import do_check_sum, do_check_sums, numpy
+
+
+SIZES = [8, 64, 512, 1500]     # 报文长度 (bytes)
+
+
+def legacy(packet):
+    """ 原逐字节实现, 作为对照 """
+    packet = packet if len(packet) % 2 == 0 else packet + chr(0)
+    chk_sum = 0
+    location = 0
+    while location < len(packet):
+        value = (ord(packet[location]) << 8) + ord(packet[location + 1])
+        chk_sum = chk_sum + value
+        location = location + 2
+    chk_sum = (chk_sum >> 16) + (chk_sum & 0xffff)
+    chk_sum = (chk_sum >> 16) + chk_sum
+    return ~chk_sum & 0xffff
+
+
+def measure(compute, packets):
+    """ 测量每秒计算的报文数
+
+    @param compute: 计算方法, 参数为报文列表
+    @type  compute: function
+
+    @return: packets/sec
+    @rtype : double
+    """
+    start = timeit.default_timer()
+    compute(packets)
+    return len(packets) / (timeit.default_timer() - start)
+
+
+def main(count=10000):
+    logging.disable(logging.CRITICAL)
+    paths = [
+        ('legacy', lambda packets: [legacy(x) for x in packets]),
+        ('array', lambda packets: [do_check_sum(x) for x in packets]),
+    ]
+    if numpy is not None:
+        paths.append(('batch', do_check_sums))
+    for size in SIZES:
+        packets = [os.urandom(size) for _ in xrange(count)]
+        expect = [legacy(x) for x in packets]
+        base = None
+        for path, compute in paths:
+            assert compute(packets) == expect, path
+            rate = measure(compute, packets)
+            base = rate if base is None else base
+            print '%5d B  %-7s %12.0f packets/sec  x%.2f' % (
+                size, path, rate, rate / base)
+
+
+if __name__ == '__main__':
+    main()
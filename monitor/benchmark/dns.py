@@ -0,0 +1,108 @@
+# coding: utf-8
+
+""" 微基准测试: DNS 回答报文中的域名解码
+
+运行方式 (monitor 目录下): python -m benchmark.dns
+
+以一个含 20 条回答 (1 条 CNAME + 19 条 A, 均使用压缩指针) 的 CDN 回答报文
+为例, 对比:
+- legacy: 原 get_domain, 逐字节解包并拼接, 每个域名都从头解码;
+- codec : DomainCodec, 标签按 memoryview 切片, 按偏移量缓存已解码的域名。
+"""
+
+import logging
+import struct
+import timeit
+from core.packet.dns import DNS, DomainCodec, QueryType
+
+
+def legacy(packet, offset):
+    """ 原逐字节实现 (去掉日志), 作为对照 """
+    length = 0
+    node = 0
+    domain = None
+    point = False
+    first_skip = True
+    while True:
+        if node == 0:
+            if len(packet) <= offset:
+                return (-1, None)
+            if (ord(packet[offset]) | 0x3f) == 0xff:
+                point = True
+                offset = (ord(packet[offset]) & 0x3f << 8) + \
+                    (ord(packet[offset + 1]) & 0xff)
+            node = struct.unpack('!B', packet[offset])[0]
+            if point and first_skip:
+                length = length + 2
+                first_skip = False
+            if not point:
+                length = length + node + 1
+            offset = offset + 1
+            if node == 0:
+                return (length, domain)
+            domain = '' if domain is None else domain + '.'
+        else:
+            if len(packet) <= offset:
+                return (-1, None)
+            domain = domain + struct.unpack('!s', packet[offset])[0]
+            offset = offset + 1
+            node = node - 1
+
+
+def response(count=20):
+    """ 构建 CDN 回答报文
+
+    @return: (报文, 报文中全部域名的偏移量)
+    @rtype : (string, [int])
+    """
+    query = DNS().construct(domain='www.example.com', ID=1, Flag=0x8180,
+                            An=count)
+    cname = DomainCodec.encode('edge.cdn.example.net')
+    packet = query + '\xc0\x0c' + struct.pack(
+        '!HHIH', QueryType.CNAME, 1, 60, len(cname)) + cname
+    offsets = [12, len(query), len(query) + 12]
+    pointer = struct.pack('!H', 0xc000 | (len(query) + 12))
+    for i in xrange(count - 1):
+        offsets.append(len(packet))
+        packet = packet + pointer + struct.pack(
+            '!HHIHBBBB', QueryType.A, 1, 30, 4, 10, 0, 0, i)
+    return packet, offsets
+
+
+def measure(decode, packet, offsets, count):
+    """ 测量每秒解码的报文数
+
+    @param decode: 解码方法, 参数为 (报文, 域名偏移量)
+    @type  decode: function
+
+    @return: packets/sec
+    @rtype : double
+    """
+    start = timeit.default_timer()
+    for _ in xrange(count):
+        decode(packet, offsets)
+    return count / (timeit.default_timer() - start)
+
+
+def main(count=10000):
+    logging.disable(logging.CRITICAL)
+    packet, offsets = response()
+
+    def old(packet, offsets):
+        return [legacy(packet, x) for x in offsets]
+
+    def new(packet, offsets):
+        codec = DomainCodec(packet)
+        return [codec.decode(x) for x in offsets]
+
+    # 原实现的指针偏移量只取了低 8 位, 这里的报文长度小于 256 bytes
+    assert old(packet, offsets) == new(packet, offsets)
+    base = None
+    for path, decode in [('legacy', old), ('codec', new)]:
+        rate = measure(decode, packet, offsets, count)
+        base = rate if base is None else base
+        print '%-7s %12.0f packets/sec  x%.2f' % (path, rate, rate / base)
+
+
+if __name__ == '__main__':
+    main()
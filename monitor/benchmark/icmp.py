@@ -0,0 +1,51 @@
+# coding: utf-8
+
+""" 微基准测试: ICMP 回送请求报文构建
+
+运行方式 (monitor 目录下): python -m benchmark.icmp
+
+对比:
+- construct: ICMP().construct, 每个报文两次打包首部并完整计算检验和;
+- template : EchoTemplate.construct, 只写入序列号并增量更新检验和。
+"""
+
+import logging
+import timeit
+from core.packet.icmp import ICMP, EchoTemplate
+
+
+def measure(build, count):
+    """ 测量每秒构建的报文数
+
+    @param build: 构建方法, 参数为序列号
+    @type  build: function
+
+    @param count: 报文个数
+    @type  count: int
+
+    @return: packets/sec
+    @rtype : double
+    """
+    start = timeit.default_timer()
+    for seq in xrange(count):
+        build(seq & 0xffff)
+    return count / (timeit.default_timer() - start)
+
+
+def main(count=100000):
+    logging.disable(logging.CRITICAL)
+    ID = 0x1234
+    template = EchoTemplate.get(ID)
+    paths = [
+        ('construct', lambda seq: ICMP().construct(ID=ID, Seq=seq)),
+        ('template', template.construct),
+    ]
+    base = None
+    for path, build in paths:
+        rate = measure(build, count)
+        base = rate if base is None else base
+        print '%-10s %12.0f packets/sec  x%.2f' % (path, rate, rate / base)
+
+
+if __name__ == '__main__':
+    main()
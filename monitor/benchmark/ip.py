@@ -0,0 +1,76 @@
+# coding: utf-8
+
+""" 微基准测试: IP 地址分类
+
+运行方式 (monitor 目录下): python -m benchmark.ip
+
+输入为 v4/v6/错误格式 各占 1/3 的混合地址, 对比:
+- regex : 原 IPV.check, 依次匹配 ipv4/ipv6 正则表达式;
+- parse : IPV.check, 整数/inet_pton 解析;
+分别测试 输入全部不同 (cold, 每次都未命中缓存) 和 输入取自 1000 个
+常见地址 (cached) 两种情况。
+"""
+
+import logging
+import random
+import re
+import timeit
+from core.packet.ip import IPV
+
+
+def legacy(ip):
+    """ 原正则表达式实现, 作为对照 """
+    if not isinstance(ip, str):
+        return IPV.ERROR
+    if re.match(IPV.IPV4_REGEX, ip) is not None:
+        return IPV.IPV4
+    if re.match(IPV.IPV6_REGEX, ip) is not None:
+        return IPV.IPV6
+    return IPV.ERROR
+
+
+def address(rand):
+    """ 生成一个随机的 v4/v6/错误格式 地址 """
+    kind = rand.randrange(3)
+    if kind == 0:
+        return '.'.join([str(rand.randrange(256)) for _ in xrange(4)])
+    if kind == 1:
+        return '2001:db8::%x:%x' % (rand.randrange(0x10000),
+                                    rand.randrange(0x10000))
+    return 'host-%d.example.com' % rand.randrange(1 << 30)
+
+
+def measure(check, inputs):
+    """ 测量每秒分类的地址数
+
+    @return: addresses/sec
+    @rtype : double
+    """
+    start = timeit.default_timer()
+    for ip in inputs:
+        check(ip)
+    return len(inputs) / (timeit.default_timer() - start)
+
+
+def main(count=1000000):
+    logging.disable(logging.CRITICAL)
+    rand = random.Random(0)
+    pool = [address(rand) for _ in xrange(1000)]
+    cases = [
+        ('cold', [address(rand) for _ in xrange(count)]),
+        ('cached', [rand.choice(pool) for _ in xrange(count)]),
+    ]
+    for ip in pool:
+        assert legacy(ip) == IPV.check(ip), ip
+    for case, inputs in cases:
+        IPV.RECENT, IPV.OLD = {}, {}
+        base = None
+        for path, check in [('regex', legacy), ('parse', IPV.check)]:
+            rate = measure(check, inputs)
+            base = rate if base is None else base
+            print '%-7s %-6s %12.0f addresses/sec  x%.2f' % (
+                case, path, rate, rate / base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# coding: utf-8
+
+""" 微基准测试: 批量数据的编码格式
+
+运行方式 (monitor 目录下): python -m benchmark.record
+
+以 benchmark.upload 的监测数据为例, 每 200 条一批, 对比:
+- json       : JSON + zlib (FrameBatch 的 json 格式);
+- binary     : 二进制记录 (client.record), 不压缩;
+- binary+zlib: 二进制记录 + zlib (FrameBatch 的 binary 格式)。
+分别统计 每秒编码, 解码的数据条数 和 总字节数。
+"""
+
+import json
+import logging
+import random
+import timeit
+import zlib
+from benchmark.upload import events, same
+from client.record import RecordCodec
+from config.constant import JSON
+
+
+def json_encode(batch):
+    return zlib.compress(json.dumps({'events': batch}, separators=JSON.SEP))
+
+
+def json_decode(data):
+    return json.loads(zlib.decompress(data))['events']
+
+
+def binary_encode(batch):
+    return RecordCodec.encode(batch)
+
+
+def binary_decode(data):
+    return RecordCodec.decode(data)
+
+
+def zbinary_encode(batch):
+    return zlib.compress(RecordCodec.encode(batch))
+
+
+def zbinary_decode(data):
+    return RecordCodec.decode(zlib.decompress(data))
+
+
+def timestamps(items):
+    """ 全部探测记录的 (发送, 接收) 时间戳 """
+    result = []
+    for stamp, data in items:
+        for value in data.values():
+            records = value['icmping'] if isinstance(value, dict) else value
+            for record in records:
+                result.append((record.get('send_timestamp',
+                                          record.get('sent_timestamp')),
+                               record['recv_timestamp']))
+    return result
+
+
+def measure(function, items, repeat=3):
+    """ 最短用时 """
+    best = None
+    for _ in xrange(repeat):
+        start = timeit.default_timer()
+        result = [function(x) for x in items]
+        cost = timeit.default_timer() - start
+        best = cost if best is None else min(best, cost)
+    return result, best
+
+
+def main(count=20000, size=200):
+    logging.disable(logging.CRITICAL)
+    items = events(count, random.Random(0))
+    batches = [items[i:i + size] for i in xrange(0, count, size)]
+    for batch in batches:
+        decoded = RecordCodec.decode(RecordCodec.encode(batch))
+        assert same(batch, decoded)
+        # 超时 和 发送失败 的时间戳 (错误码 * 1000) 原样解码
+        failed = [y for x in timestamps(batch) for y in x if y <= 0]
+        assert len(failed) > 0
+        assert failed == [y for x in timestamps(decoded) for y in x if y <= 0]
+    base = None
+    for path, encode, decode in [('json', json_encode, json_decode),
+                                 ('binary', binary_encode, binary_decode),
+                                 ('binary+zlib', zbinary_encode,
+                                  zbinary_decode)]:
+        frames, encoding = measure(encode, batches)
+        _, decoding = measure(decode, frames)
+        size_ = sum(map(len, frames))
+        base = (encoding, decoding, size_) if base is None else base
+        print '%-11s encode %8.0f events/sec x%.2f  decode %8.0f ' \
+            'events/sec x%.2f  %8d bytes x%.2f' % (
+                path, count / encoding, base[0] / encoding,
+                count / decoding, base[1] / decoding,
+                size_, float(size_) / base[2])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# coding: utf-8
+
+""" 微基准测试: SOCKET.recvfrom 接收路径
+
+运行方式 (monitor 目录下): python -m benchmark.recv
+
+对比:
+- legacy: 每次分配 4096 bytes 缓冲区, 再逐字节拼接报文;
+- bytes : 复用 socket 缓冲区, 一次切片拷贝;
+- view  : 复用 socket 缓冲区, 直接返回 memoryview。
+"""
+
+import logging
+import select
+import socket
+import timeit
+from config.constant import SOCKET
+from config.logger import Logger
+
+
+def legacy_recvfrom(sock, timeout, size=4096):
+    """ 原 SOCKET.recvfrom 的实现 """
+    logger = Logger.get()
+    if timeout < 0:
+        return (-4, None)
+    readable = select.select([sock], [], [], timeout)[0]
+    if len(readable) == 0:
+        return (-4, None)
+    byte_stream = bytearray(size)
+    nbytes, addr = sock.recvfrom_into(byte_stream)
+    recv_time = timeit.default_timer()
+    logger.info('Successfully receive a packet %d bytes.' % nbytes)
+    packet = ''
+    for i in range(nbytes):
+        packet = packet + chr(byte_stream[i])
+    return (recv_time, packet)
+
+
+def measure(recv, size, count):
+    """ 测量每秒接收的报文数
+
+    @param recv: 接收方法
+    @type  recv: function
+
+    @param size: 报文大小(单位: bytes)
+    @type  size: int
+
+    @param count: 报文个数
+    @type  count: int
+
+    @return: packets/sec
+    @rtype : double
+    """
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    payload = b'\xa5' * size
+    try:
+        start = timeit.default_timer()
+        for _ in range(count):
+            sender.send(payload)
+            recv(receiver, 1)
+        return count / (timeit.default_timer() - start)
+    finally:
+        SOCKET.close(sender)
+        SOCKET.close(receiver)
+
+
+def main(count=20000):
+    logging.disable(logging.CRITICAL)
+    cases = [('icmp echo reply', 64), ('dns answer', 512)]
+    paths = [
+        ('legacy', legacy_recvfrom),
+        ('bytes', lambda s, t: SOCKET.recvfrom(s, t)),
+        ('view', lambda s, t: SOCKET.recvfrom(s, t, view=True)),
+    ]
+    for name, size in cases:
+        print '%s (%d bytes):' % (name, size)
+        base = None
+        for path, recv in paths:
+            rate = measure(recv, size, count)
+            base = rate if base is None else base
+            print '    %-8s %12.0f packets/sec  x%.2f' % (path, rate,
+                                                         rate / base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# coding: utf-8
+
+""" 微基准测试: 上传数据的构建
+
+运行方式 (monitor 目录下): python -m benchmark.upload
+
+以 DNS 解析结果 和 ICMPing 结果 各占一半的监测数据为例, 对比:
+- single: 原 FRAME.construct, 每条数据一个通信数据, 各自压缩;
+- batch : FrameBatch, 每 200 条 (或 64 KiB) 数据合并为一个通信数据。
+分别统计 每秒构建的数据条数, 通信数据个数 (即 sendall 次数) 和 总字节数。
+"""
+
+import logging
+import random
+import timeit
+import zlib
+from client.network import FRAME, JPRESS, STAMP, TYPE, FrameBatch
+from client.record import RecordCodec
+from core.packet.dns import DNStatus
+from core.spider.structure import DNSResolverStruct, ICMPingStruct
+
+
+def events(count, rand):
+    """ 生成监测数据, 其中约 10% 的探测超时, 2% 发送失败
+    (时间戳为 错误码 * 1000, 与探测引擎一致)
+
+    @return: [(消息类型, 数据)]
+    @rtype : [(int, dict)]
+    """
+    result = []
+    now = 1.5e12
+    for i in xrange(count):
+        domain = 'www.site%d.example.com' % rand.randrange(500)
+        ip = '10.%d.%d.%d' % (rand.randrange(256), rand.randrange(256),
+                              rand.randrange(256))
+        now = now + rand.uniform(0, 100)
+        if i % 2 == 0:
+            record = DNSResolverStruct()
+            record.dns = '114.114.114.114'
+            record.ips = [ip]
+            record.send_timestamp = now
+            record.recv_timestamp = now + rand.uniform(1, 50)
+            record.latency = record.recv_timestamp - now
+            fate = rand.random()
+            if fate < 0.1:
+                record.recv_timestamp = -4 * 1000
+                record.latency = -1
+                record.status = DNStatus.TIME_OUT
+                record.ips = []
+            elif fate < 0.12:
+                record.send_timestamp = record.recv_timestamp = -1 * 1000
+                record.latency = -1
+                record.status = DNStatus.SOCK_ERROR
+                record.ips = []
+            result.append((STAMP.DNS_RESOLVE, {domain: [record.json()]}))
+            continue
+        records = []
+        for seq in xrange(3):
+            record = ICMPingStruct()
+            record.seq = seq
+            record.ttl = 64
+            record.sent_size = record.recv_size = 64
+            record.sent_timestamp = now + seq * 500
+            record.recv_timestamp = record.sent_timestamp + \
+                rand.uniform(1, 80)
+            record.latency = record.recv_timestamp - record.sent_timestamp
+            fate = rand.random()
+            if fate < 0.1:
+                record.recv_timestamp = -4 * 1000
+                record.latency = -1
+                record.ttl = record.recv_size = 0
+            elif fate < 0.12:
+                record.sent_timestamp = record.recv_timestamp = -1 * 1000
+                record.latency = -1
+                record.ttl = record.sent_size = record.recv_size = 0
+            records.append(record.json())
+        result.append((STAMP.ICMPING, {domain: {'ip': ip,
+                                                'icmping': records}}))
+    return result
+
+
+def same(origin, data):
+    """ 解码后的数据与原数据一致 (时间精确到微秒) """
+    if isinstance(origin, dict):
+        return sorted(origin) == sorted(data) and \
+            all([same(origin[x], data[x]) for x in origin])
+    if isinstance(origin, (list, tuple)):
+        return len(origin) == len(data) and \
+            all([same(x, y) for x, y in zip(origin, data)])
+    if isinstance(origin, float):
+        return abs(origin - data) < 1e-3
+    return origin == data
+
+
+def single(items):
+    return [FRAME.construct(stamp, data) for stamp, data in items]
+
+
+def batch(items, format_=FrameBatch.JSON):
+    frames = []
+    batch = FrameBatch(200, 65536, 3600, format_)
+    for stamp, data in items:
+        batch.add(stamp, data)
+        if batch.ready():
+            frames.append(batch.construct())
+    if len(batch) > 0:
+        frames.append(batch.construct())
+    return frames
+
+
+def main(count=20000):
+    logging.disable(logging.CRITICAL)
+    items = events(count, random.Random(0))
+    # 批量数据按原顺序拆分后与原数据一致
+    decoded = []
+    for frame in batch(items):
+        stamp, _, flags, _, length = FRAME.analysis(frame)
+        assert stamp == STAMP.BATCH and length == len(frame) - 8
+        decoded.extend(JPRESS.decompress(frame[8:], flags & 0x01)['events'])
+    assert decoded == [list(x) for x in items]
+    # 含超时 和 发送失败 记录的批次仍以二进制记录编码, 不退回 json
+    decoded = []
+    for frame in batch(items, FrameBatch.BINARY):
+        _, type_, flags, _, _ = FRAME.analysis(frame)
+        assert type_ == TYPE.RECORDS and flags & 0x01 == JPRESS.JZLIB
+        decoded.extend(RecordCodec.decode(zlib.decompress(frame[8:])))
+    assert same(items, decoded)
+    base = None
+    for path, build in [('single', single), ('batch', batch)]:
+        start = timeit.default_timer()
+        frames = build(items)
+        rate = count / (timeit.default_timer() - start)
+        base = rate if base is None else base
+        print '%-7s %10.0f events/sec  x%.2f  %6d frames  %9d bytes' % (
+            path, rate, rate / base, len(frames), sum(map(len, frames)))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,25 +6,28 @@
 - 数据来源: Spider 结果队列
 - 数据解析: 一个结果队列拥有一个分析器, 一个分析器属于一个线程。
 - 数据同步: 上传队列 和 状态列表
-    - 上传队列: 待经过 通信框架 上传的数据
+    - 上传队列: 待经过 通信框架 上传的数据, 有容量上限, 见 client.channel
     - 状态列表: 用户界面展示内容
 """
 
 import threading
-from Queue import Queue
+from client.channel import BoundedQueue
 from client.network import STAMP
-from client.spider import RESULT
+from client.spider import CONF, RESULT
 from config.logger import Logger
 
 
 class EVENT(object):
-    UPLOAD = Queue()        # 上传队列
+    # 上传队列, 目标为 (消息类型, 结果所属的目标)
+    UPLOAD = BoundedQueue('upload', CONF.QUEUE_UPLOAD_SIZE,
+                          CONF.QUEUE_UPLOAD_POLICY,
+                          lambda x: (x[0], RESULT.target(x[1])))
     STATUS = {}             # 状态列表
 
     @staticmethod
     def end():
-        """ 添加 队列结束符 """
-        EVENT.UPLOAD.put(False)
+        """ 关闭上传队列: 阻塞的分析线程不再等待, 上传线程取完后结束 """
+        EVENT.UPLOAD.close()
 
 
 class Analyzer(object):
@@ -32,6 +35,8 @@ class Analyzer(object):
     def __init__(self):
         self.logger = Logger.get()
         self.dispatchers = []
+        EVENT.UPLOAD.configure(CONF.QUEUE_UPLOAD_SIZE,
+                               CONF.QUEUE_UPLOAD_POLICY)
 
     def __dns(self, dns):
         """ 分析 DNS 结果 """
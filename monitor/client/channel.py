@@ -0,0 +1,187 @@
+# coding: utf-8
+
+""" 有界结果队列
+
+基本思路:
+- 结果队列和上传队列都有容量上限, 服务器长时间不可达时内存占用固定;
+- 队列满时按策略处理新结果:
+    - block   : 阻塞写入方, 压力沿 结果队列 -> 分析线程 -> 调度线程 传递;
+    - drop    : 丢弃最早的结果;
+    - coalesce: 每个目标只保留最新的结果 (原位置替换), 目标数超过容量时
+                丢弃最早的结果;
+- 记录 丢弃 和 合并 的结果数;
+- 关闭后不再阻塞写入方, 读取方取完剩余结果后得到结束符 False。
+"""
+
+import collections
+import threading
+import timeit
+
+
+class POLICY(object):
+    """ 队列满时的策略 """
+    BLOCK = 'block'
+    DROP = 'drop'
+    COALESCE = 'coalesce'
+    ALL = (BLOCK, DROP, COALESCE)
+
+
+class BoundedQueue(object):
+    """ 有界结果队列, 接口与 Queue.Queue 的 put/get/qsize 一致 """
+    def __init__(self, name, size=1024, policy=POLICY.BLOCK, key=None):
+        """ 初始化
+
+        @param name: 队列名称 (用于日志)
+        @type  name: string
+
+        @param size: 容量上限
+        @type  size: int
+
+        @param policy: 队列满时的策略, 见 POLICY
+        @type  policy: string
+
+        @param key: 获取结果所属目标的方法, coalesce 策略使用
+        @type  key: function
+        """
+        self.name = name
+        self.key = key
+        self.size = 1
+        self.policy = POLICY.BLOCK
+        self.entries = collections.deque()  # [目标, 结果]
+        self.targets = {}                   # 目标: 队列中该目标的 entry
+        self.closed = False
+        self.drops = 0                      # 丢弃的结果数
+        self.coalesced = 0                  # 合并的结果数
+        self.blocked = 0.0                  # 写入方阻塞的总时间(单位: s)
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.configure(size, policy)
+
+    def configure(self, size, policy):
+        """ 调整容量和策略, 超出新容量的最早结果被丢弃 """
+        if policy not in POLICY.ALL:
+            raise ValueError('Unknown queue policy: %s' % policy)
+        if policy == POLICY.COALESCE and self.key is None:
+            raise ValueError('The queue %s has no target key.' % self.name)
+        self.lock.acquire()
+        try:
+            self.size = max(size, 1)
+            self.policy = policy
+            if policy != POLICY.COALESCE:
+                self.targets = {}
+            else:
+                self.targets = dict((x[0], x) for x in self.entries)
+            while len(self.entries) > self.size:
+                self.__drop()
+            self.not_full.notify_all()
+        finally:
+            self.lock.release()
+
+    def put(self, item):
+        """ 放入一个结果, False 表示结束符 (等同于 close) """
+        if item is False:
+            self.close()
+            return
+        self.lock.acquire()
+        try:
+            if self.closed:
+                self.drops = self.drops + 1
+                return
+            target = None if self.key is None else self.key(item)
+            if self.policy == POLICY.COALESCE:
+                entry = self.targets.get(target)
+                if entry is not None:
+                    entry[1] = item
+                    self.coalesced = self.coalesced + 1
+                    return
+            if len(self.entries) >= self.size:
+                if self.policy == POLICY.BLOCK:
+                    start = timeit.default_timer()
+                    while len(self.entries) >= self.size and \
+                            self.policy == POLICY.BLOCK and not self.closed:
+                        self.not_full.wait()
+                    self.blocked = self.blocked + \
+                        timeit.default_timer() - start
+                    if self.closed:
+                        self.drops = self.drops + 1
+                        return
+                while len(self.entries) >= self.size:
+                    self.__drop()
+            entry = [target, item]
+            self.entries.append(entry)
+            if self.policy == POLICY.COALESCE:
+                self.targets[target] = entry
+            self.not_empty.notify()
+        finally:
+            self.lock.release()
+
+    def get(self, timeout=None):
+        """ 取出最早的结果
+
+        @param timeout: 最长等待时间(单位: s), None 表示一直等待
+        @type  timeout: double
+
+        @return: 结果; 队列已关闭且为空时为 False, 等待超时为 None
+        """
+        self.lock.acquire()
+        try:
+            if timeout is not None:
+                deadline = timeit.default_timer() + timeout
+            while len(self.entries) == 0 and not self.closed:
+                if timeout is None:
+                    self.not_empty.wait()
+                    continue
+                remain = deadline - timeit.default_timer()
+                if remain <= 0:
+                    return None
+                self.not_empty.wait(remain)
+            if len(self.entries) == 0:
+                return False
+            entry = self.entries.popleft()
+            if self.targets.get(entry[0]) is entry:
+                self.targets.pop(entry[0])
+            self.not_full.notify()
+            return entry[1]
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """ 关闭队列: 唤醒全部阻塞的写入方和读取方 """
+        self.lock.acquire()
+        try:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+        finally:
+            self.lock.release()
+
+    def qsize(self):
+        return len(self.entries)
+
+    def stats(self):
+        """ 获取队列的统计
+
+        @return: 深度, 容量, 策略, 丢弃数, 合并数, 阻塞时间
+        @rtype : dict
+        """
+        self.lock.acquire()
+        try:
+            return {
+                'name': self.name,
+                'depth': len(self.entries),
+                'size': self.size,
+                'policy': self.policy,
+                'drops': self.drops,
+                'coalesced': self.coalesced,
+                'blocked': self.blocked
+            }
+        finally:
+            self.lock.release()
+
+    def __drop(self):
+        """ 丢弃最早的结果 (调用者持有 self.lock) """
+        entry = self.entries.popleft()
+        if self.targets.get(entry[0]) is entry:
+            self.targets.pop(entry[0])
+        self.drops = self.drops + 1
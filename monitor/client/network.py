@@ -22,23 +22,34 @@
 - 目的:
     - 解决应用层接收数据时过多或过少的问题
     - 隐藏数据接收发送的具体逻辑, 上层提供和接收 消息类型 和 待发送的数据
+- 上传: 通信数据先写入磁盘缓存 (client.spool), 连接断开后重新连接,
+  从回放游标处继续上传; 服务器按顺序对每个监测数据回复 STAMP.ACK,
+  收到确认后游标才前进, 已发送未确认的数据在重新连接后重新发送。
+- 批量数据默认编码为二进制记录 (client.record, TYPE.RECORDS), json 格式保留
+  用于调试。
 """
 
 import ConfigParser
 import json
+import select
 import struct
 import threading
 import time
 import timeit
+import weakref
 import zlib
-from config.constant import FILE, PROTO, SOCKET
+from config.constant import FILE, JSON, PROTO, SOCKET
 from config.logger import Logger
 from config.runtime import RUNTIME
+from client.record import RecordCodec
+from client.spool import Spool
+from core.spider.rate import TokenBucket
 
 
 class SESSION:
     """ 网络会话 基本配置 """
     PARSER = ConfigParser.ConfigParser()
+    LOCK = threading.RLock()
     SERVER_HOST = '10.8.120.46'     # 服务器IP
     SERVER_PORT = 32256             # 服务器端口
     BUFF_SIZE = 2048                # 接收缓冲区
@@ -47,13 +58,26 @@ class SESSION:
     # 超时重传次数
     CERT = 1.5                      # 重新认证间隔
     RETRY = 2                       # 最大重传次数
+    # 上传数据的磁盘缓存
+    SPOOL_DIRNAME = 'spool'         # 缓存目录 (相对于主执行文件所在目录)
+    SPOOL_SEGMENT = 4194304         # 段文件大小(单位: bytes)
+    SPOOL_SEGMENTS = 64             # 最多保留的段数
+    SPOOL_SYNC = 64                 # 每写入多少条记录同步一次到磁盘
+    SPOOL_INTERVAL = 1.0            # 最长同步间隔(单位: s)
+    SPOOL_RATE = 200                # 回放速率上限(单位: 帧/s), 0 表示不限制
+    SPOOL_WINDOW = 64               # 最多已发送未确认的通信数据数
+    SPOOL_ACK_TIMEOUT = 30          # 等待确认的最长时间(单位: s), 超时重新连接
+    # 批量上传: 一批数据的 最大条数, 最大字节数(压缩前), 最长等待时间(单位: s)
+    BATCH_COUNT = 200
+    BATCH_BYTES = 65536
+    BATCH_DELAY = 0.5
+    BATCH_FORMAT = 'binary'         # 数据格式: binary, json (便于调试)
 
     @staticmethod
     def load(filename='network.conf'):
         logger = Logger.get()
         filepath = FILE.conf(filename)
-        lock = threading.Lock()
-        lock.acquire()
+        SESSION.LOCK.acquire()
         try:
             logger.info('Start to load the session configure.')
             SESSION.PARSER.read(filepath)
@@ -64,11 +88,26 @@ class SESSION:
             SESSION.CODECS = SESSION.PARSER.get('server', 'codecs')
             SESSION.CERT = SESSION.PARSER.getfloat('server', 'cert')
             SESSION.RETRY = SESSION.PARSER.getint('server', 'retry')
+            SESSION.SPOOL_DIRNAME = SESSION.PARSER.get('spool', 'dirname')
+            SESSION.SPOOL_SEGMENT = SESSION.PARSER.getint('spool', 'segment')
+            SESSION.SPOOL_SEGMENTS = SESSION.PARSER.getint('spool',
+                                                           'segments')
+            SESSION.SPOOL_SYNC = SESSION.PARSER.getint('spool', 'sync')
+            SESSION.SPOOL_INTERVAL = SESSION.PARSER.getfloat('spool',
+                                                             'interval')
+            SESSION.SPOOL_RATE = SESSION.PARSER.getfloat('spool', 'rate')
+            SESSION.SPOOL_WINDOW = SESSION.PARSER.getint('spool', 'window')
+            SESSION.SPOOL_ACK_TIMEOUT = SESSION.PARSER.getfloat(
+                'spool', 'ack_timeout')
+            SESSION.BATCH_COUNT = SESSION.PARSER.getint('batch', 'count')
+            SESSION.BATCH_BYTES = SESSION.PARSER.getint('batch', 'bytes')
+            SESSION.BATCH_DELAY = SESSION.PARSER.getfloat('batch', 'delay')
+            SESSION.BATCH_FORMAT = SESSION.PARSER.get('batch', 'format')
         except Exception:
             logger.warn('Please check your session configure.')
             logger.exception('Failed to load the session configure.')
         finally:
-            lock.release()
+            SESSION.LOCK.release()
 
 
 class STAMP:
@@ -76,10 +115,12 @@ class STAMP:
     # 通信逻辑 (0~127)
     ID = 0                          # 会话 ID
     END = 1                         # 结束会话
+    ACK = 2                         # 确认收到一个监测数据 (按顺序)
     # 消息内容标识 (128~255)
     CLIENT = 128                    # 客户端基本配置
     DNS_RESOLVE = 129               # DNS 解析
     ICMPING = 130                   # ICMPing 结果
+    BATCH = 131                     # 批量数据: {'events': [[消息类型, 数据]]}
 
 
 class TYPE:
@@ -91,6 +132,7 @@ class TYPE:
     STRING = 4                      # str
     UNICODE = 5                     # unicode
     UNKNOWN = 6                     # 未知类型
+    RECORDS = 7                     # 二进制监测数据 (client.record)
 
     @staticmethod
     def type(data):
@@ -139,14 +181,13 @@ class JPRESS:
     def decompress(data, mode):
         """ 解压 JSON数据 """
         if mode == JPRESS.JZLIB:
-            data = zlib.decompress(data)
-        return json.loads(data)
+            return json.loads(zlib.decompress(data))
+        return json.loads(str(data))
 
 
 class FRAME(object):
     """ 应用层通信框架 """
     HEAD = '!BBBBL'
-    PACKET = ''
 
     @staticmethod
     def construct(stamp, data):
@@ -179,8 +220,12 @@ class FRAME(object):
     @staticmethod
     def send(sock, stamp, data=''):
         """ 发送数据 """
+        return FRAME.transmit(sock, FRAME.construct(stamp, data))
+
+    @staticmethod
+    def transmit(sock, envelope):
+        """ 发送已构建的应用层通信数据 """
         logger = Logger.get()
-        envelope = FRAME.construct(stamp, data)
         try:
             sock.sendall(envelope)
             logger.info('Successfully send all the data.')
@@ -191,7 +236,7 @@ class FRAME(object):
 
     @staticmethod
     def recv(sock):
-        """ 接收数据
+        """ 接收数据: 每个连接使用各自的 FrameDecoder
 
         @return: stamp, data
         @rtype : STAMP, TYPE.*
@@ -199,52 +244,149 @@ class FRAME(object):
         说明: stamp < 0 表示 recv 异常退出
             - 目前只有 stamp == -1 存在意义, 即 socket 异常关闭
         """
+        return FrameDecoder.get(sock).recv(SESSION.TIMEOUT)
+
+
+class FrameDecoder(object):
+    """ 按连接的应用层数据流解码器
+
+    基本思路:
+    - 每个连接持有一个可增长的 bytearray 和 读/写 偏移量, 以 recv_into
+      直接接收到缓冲区的空闲部分, 不再拼接和切片字符串;
+    - 缓冲区中有完整的通信数据时, 数据段以 buffer 引用缓冲区, 不拷贝,
+      有效至下一次接收;
+    - 缓冲区尾部不足以容纳当前通信数据时, 将未解码的数据移到头部, 仍不足
+      时重新分配更大的缓冲区。
+    """
+    HEAD = struct.Struct(FRAME.HEAD)
+    POOL = weakref.WeakKeyDictionary()
+    LOCK = threading.Lock()
+
+    def __init__(self, sock, size=4096):
+        """ 初始化
+
+        @param size: 初始缓冲区大小(单位: bytes)
+        @type  size: int
+        """
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.start = 0              # 未解码数据的起始偏移量
+        self.end = 0                # 已接收数据的结束偏移量
+        self.need = FrameDecoder.HEAD.size  # 下一个通信数据所需的字节数
+
+    @staticmethod
+    def get(sock):
+        """ 获取 sock 专属的解码器 """
+        FrameDecoder.LOCK.acquire()
+        try:
+            decoder = FrameDecoder.POOL.get(sock)
+            if decoder is None:
+                decoder = FrameDecoder(sock, SESSION.BUFF_SIZE)
+                FrameDecoder.POOL[sock] = decoder
+            return decoder
+        finally:
+            FrameDecoder.LOCK.release()
+
+    @staticmethod
+    def free(sock):
+        """ 释放 sock 对应的解码器 """
+        FrameDecoder.LOCK.acquire()
+        try:
+            FrameDecoder.POOL.pop(sock, None)
+        finally:
+            FrameDecoder.LOCK.release()
+
+    def frame(self):
+        """ 解码一个完整的通信数据
+
+        @return: (stamp, type_, flags, 数据段), 数据不完整时为 None
+        @rtype : (int, int, int, buffer)
+        """
+        available = self.end - self.start
+        if available < FrameDecoder.HEAD.size:
+            self.need = FrameDecoder.HEAD.size
+            return None
+        stamp, type_, flags, _, length = \
+            FrameDecoder.HEAD.unpack_from(self.buffer, self.start)
+        self.need = FrameDecoder.HEAD.size + length
+        if available < self.need:
+            return None
+        offset = self.start + FrameDecoder.HEAD.size
+        payload = buffer(self.buffer, offset, length)
+        self.start = offset + length
+        self.need = FrameDecoder.HEAD.size
+        return (stamp, type_, flags, payload)
+
+    def fill(self, timeout):
+        """ 接收数据到缓冲区的空闲部分
+
+        @return: 接收的字节数; < 0 表示接收失败, 与 SOCKET.recvfrom 一致
+        @rtype : int
+        """
+        logger = Logger.get()
+        if timeout < 0:
+            logger.warning('Waiting for the packet timeout.')
+            return -4
+        self.__reserve()
+        try:
+            readable = select.select([self.sock], [], [], timeout)[0]
+        except Exception:
+            logger.exception('Failed to receive a packet.')
+            return -2
+        if len(readable) == 0:
+            logger.warning('Waiting for the packet timeout.')
+            return -4
+        try:
+            nbytes = self.sock.recv_into(memoryview(self.buffer)[self.end:])
+        except Exception:
+            logger.exception('Failed to receive a packet.')
+            return -3
+        if nbytes <= 0:
+            logger.warning('...the socket abnormal closed...')
+            return -1
+        self.end = self.end + nbytes
+        logger.info('Successfully receive a packet %d bytes.' % nbytes)
+        return nbytes
+
+    def recv(self, timeout):
+        """ 接收并解析一个通信数据
+
+        @param timeout: 超时时间(单位: s)
+        @type  timeout: double
+
+        @return: stamp, data; stamp < 0 表示 recv 异常退出
+        @rtype : STAMP, TYPE.*
+        """
         logger = Logger.get()
-        remain = 0
         logger.info('Start to recveive a application data.')
         start = timeit.default_timer()
-
-        # 接收数据头部
-        logger.info('Waiting for a application data header.')
-        while len(FRAME.PACKET) < 8:
-            remain = SESSION.TIMEOUT - timeit.default_timer() + start
-            recv_, data = SOCKET.recvfrom(sock, remain, size=SESSION.BUFF_SIZE)
-            if recv_ < 0:
-                logger.warn('Failed to get the application data header.')
-                return (recv_, None)
-            FRAME.PACKET = FRAME.PACKET + data
-        logger.info('Succeed to get the application data header.')
-
-        # 解析数据头部
-        stamp, type_, flags, _, length = FRAME.analysis(FRAME.PACKET)
-        FRAME.PACKET = FRAME.PACKET[8:]
-
-        # 接收数据段
-        logger.info('Waiting for the application data fragment.')
-        while length > len(FRAME.PACKET):
-            remain = SESSION.TIMEOUT - timeit.default_timer() + start
-            recv_, data = SOCKET.recvfrom(sock, remain, size=SESSION.BUFF_SIZE)
+        frame = self.frame()
+        while frame is None:
+            remain = timeout - timeit.default_timer() + start
+            recv_ = self.fill(remain)
             if recv_ < 0:
-                logger.warn('Failed to get the application data fragment.')
+                logger.warn('Failed to get the application data.')
                 return (recv_, None)
-            FRAME.PACKET = FRAME.PACKET + data
-        logger.info('Succeed to get the application data fragment.')
-
-        envelope = FRAME.PACKET[:length]
-        FRAME.PACKET = FRAME.PACKET[length:]
+            frame = self.frame()
+        logger.info('Succeed to get the application data.')
+        stamp, type_, flags, envelope = frame
         # 解析数据段
         message = None
         try:
             if type_ == TYPE.DICT:
                 message = FRAME.analysis(envelope, False, flags & 0x01)
             elif type_ == TYPE.FLOAT:
-                message = float(envelope)
+                message = float(str(envelope))
             elif type_ == TYPE.INT:
-                message = int(envelope)
+                message = int(str(envelope))
             elif type_ == TYPE.STRING:
-                message = envelope
+                message = str(envelope)
             elif type_ == TYPE.UNICODE:
-                message == envelope
+                message = str(envelope)
+            elif type_ == TYPE.RECORDS:
+                if flags & 0x01 == JPRESS.JZLIB:
+                    envelope = zlib.decompress(envelope)
+                message = {'events': RecordCodec.decode(envelope)}
             elif type_ == TYPE.UNKNOWN:
                 logger.warn('Get a unknown data type message and thrown away.')
                 return (-6, None)
@@ -253,6 +395,122 @@ class FRAME(object):
             return (-5, None)
         return (stamp, message)
 
+    def __reserve(self):
+        """ 保证缓冲区尾部能容纳下一个通信数据 """
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buffer) - self.start >= self.need and \
+                self.end < len(self.buffer):
+            return
+        unread = self.end - self.start
+        if len(self.buffer) >= self.need:
+            # 未解码的数据移到头部
+            self.buffer[0:unread] = self.buffer[self.start:self.end]
+        else:
+            # 重新分配: 已返回的数据段仍引用原缓冲区
+            size = max(self.need, len(self.buffer) * 2)
+            buff = bytearray(size)
+            buff[0:unread] = self.buffer[self.start:self.end]
+            self.buffer = buff
+        self.start = 0
+        self.end = unread
+
+
+class FrameBatch(object):
+    """ 批量上传: 多条监测数据合并为一个 STAMP.BATCH 通信数据
+
+    - json  : 每条数据在加入时序列化为 JSON, 构建时直接拼接后整体压缩一次,
+              不再重复序列化;
+    - binary: 构建时整批编码为二进制记录 (TYPE.RECORDS) 后压缩; 无法编码的
+              批次改用 json。
+    """
+    JSON = 'json'
+    BINARY = 'binary'
+
+    def __init__(self, count=200, size=65536, delay=0.5, format_=JSON):
+        """ 初始化
+
+        @param count: 一批数据的最大条数
+        @type  count: int
+
+        @param size: 一批数据压缩前的最大字节数
+        @type  size: int
+
+        @param delay: 第一条数据加入后的最长等待时间(单位: s)
+        @type  delay: double
+
+        @param format_: 数据格式, FrameBatch.JSON 或 FrameBatch.BINARY
+        @type  format_: string
+        """
+        if format_ not in (FrameBatch.JSON, FrameBatch.BINARY):
+            raise ValueError('Unknown batch format: %s' % format_)
+        self.count = max(count, 1)
+        self.size = size
+        self.delay = delay
+        self.format = format_
+        self.parts = []             # json: JSON 字符串; binary: (消息类型, 数据)
+        self.bytes = 0
+        self.start = 0.0
+
+    def add(self, stamp, data):
+        """ 加入一条数据 """
+        if self.format == FrameBatch.BINARY:
+            part = (stamp, data)
+            size = RecordCodec.size(stamp, data)
+        else:
+            part = json.dumps([stamp, data], separators=JSON.SEP)
+            size = len(part) + 1
+        if len(self.parts) == 0:
+            self.start = timeit.default_timer()
+        self.parts.append(part)
+        self.bytes = self.bytes + size
+
+    def remain(self):
+        """ 距离最长等待时间的剩余时间(单位: s), 没有数据时为 None """
+        if len(self.parts) == 0:
+            return None
+        return max(self.start + self.delay - timeit.default_timer(), 0.0)
+
+    def ready(self):
+        """ 达到 条数, 字节数 或 等待时间 的上限 """
+        if len(self.parts) == 0:
+            return False
+        return len(self.parts) >= self.count or self.bytes >= self.size or \
+            self.remain() <= 0
+
+    def construct(self):
+        """ 构建批量通信数据, 并清空当前批次
+
+        @return: 与 FRAME.construct 格式相同的通信数据
+        @rtype : string
+        """
+        parts = self.parts
+        self.parts = []
+        self.bytes = 0
+        type_ = TYPE.DICT
+        if self.format == FrameBatch.BINARY:
+            try:
+                data = RecordCodec.encode(parts)
+                type_ = TYPE.RECORDS
+            except ValueError:
+                Logger.get().exception('Failed to encode the batch records.')
+            if type_ != TYPE.RECORDS:
+                parts = [json.dumps(x, separators=JSON.SEP) for x in parts]
+        if type_ == TYPE.DICT:
+            data = '{"events":[' + ','.join(parts) + ']}'
+        flags = JPRESS.JSON
+        try:
+            data = zlib.compress(data)
+            flags = JPRESS.JZLIB
+        except Exception:
+            Logger.get().exception('Failed to compress data by zlib.')
+        header = struct.pack(FRAME.HEAD, STAMP.BATCH, type_, flags, 0,
+                             len(data))
+        return header + data
+
+    def __len__(self):
+        return len(self.parts)
+
 
 class Reporter(object):
     """ 客户端: 封装客户端通信逻辑 """
@@ -263,6 +521,9 @@ class Reporter(object):
         self.sock = SOCKET.create(SESSION.SERVER_HOST, PROTO.TCP)
         self.addr = (SESSION.SERVER_HOST, SESSION.SERVER_PORT)
         self.id = -1
+        self.spool = None           # 上传数据的磁盘缓存
+        self.acked = 0.0            # 最近一次收到确认 (或开始等待) 的时间
+        self.spooler = None         # 上传队列 -> 磁盘缓存 的线程
 
     def __connect(self):
         """ 建立TCP连接 """
@@ -304,32 +565,138 @@ class Reporter(object):
             self.logger.info('Succeed to identify authenticate %d.')
         return RUNTIME.RUNNING and cert
 
-    def __upload(self, stamp, data):
-        """ 上传 客户端监测数据 """
-        self.logger.info('Start the upload queue data transimission.')
-        FRAME.send(self.sock, stamp, data)
+    def __spool_dispatch(self):
+        """ 上传队列批处理: 监测数据按批次合并后写入磁盘缓存, 由 __replay 上传
 
-    def __upload_dispatch(self):
-        """ 上传队列批处理 """
+        一批数据达到 BATCH_COUNT 条, BATCH_BYTES 字节 或 第一条数据已等待
+        BATCH_DELAY 秒时写入; 没有新数据时至少每 SPOOL_INTERVAL 秒同步一次
+        磁盘缓存的记录和确认。
+        """
         from client.analyzer import EVENT
-        # 数据上传
+        batch = FrameBatch(SESSION.BATCH_COUNT, SESSION.BATCH_BYTES,
+                           SESSION.BATCH_DELAY, SESSION.BATCH_FORMAT)
         while True:
-            event = EVENT.UPLOAD.get()
+            timeout = batch.remain()
+            if SESSION.SPOOL_INTERVAL > 0:
+                timeout = SESSION.SPOOL_INTERVAL if timeout is None else \
+                    min(timeout, SESSION.SPOOL_INTERVAL)
+            event = EVENT.UPLOAD.get(timeout)
             if event is False:
                 break
-            self.__upload(event[0], event[1])
+            if event is not None:
+                batch.add(event[0], event[1])
+            if batch.ready():
+                self.spool.append(batch.construct())
+            self.spool.expire()
+        if len(batch) > 0:
+            self.spool.append(batch.construct())
+        self.spool.flush()
+        self.logger.info('...stop spooling the upload queue...')
+
+    def __acknowledge(self, timeout):
+        """ 接收服务器的确认, 每个确认使磁盘缓存的游标前进一条记录
+
+        @param timeout: 等待第一个确认的最长时间(单位: s)
+        @type  timeout: double
+
+        @return: 连接是否正常
+        @rtype : bool
+        """
+        decoder = FrameDecoder.get(self.sock)
+        while self.spool.outstanding() > 0:
+            frame = decoder.frame()
+            if frame is not None:
+                if frame[0] == STAMP.ACK:
+                    self.spool.ack()
+                    self.acked = timeit.default_timer()
+                continue
+            try:
+                readable = select.select([self.sock], [], [], timeout)[0]
+            except Exception:
+                self.logger.exception('Failed to wait the acknowledgement.')
+                return False
+            if len(readable) == 0:
+                break
+            if decoder.fill(0) < 0:
+                return False
+            timeout = 0
+        waited = timeit.default_timer() - self.acked
+        if self.spool.outstanding() > 0 and \
+                waited > SESSION.SPOOL_ACK_TIMEOUT:
+            self.logger.warn('...waiting for the acknowledgement timeout...')
+            return False
+        return True
+
+    def __replay(self):
+        """ 按回放游标, 以不超过 SPOOL_RATE 的速率上传磁盘缓存中的数据
+
+        最多 SPOOL_WINDOW 个通信数据已发送未确认; 开始时读取位置回到游标处,
+        上一个连接未确认的数据重新发送。
+
+        @return: 上传队列已关闭且缓存已全部确认时为 True, 连接异常时为 False
+        @rtype : bool
+        """
+        bucket = None
+        if SESSION.SPOOL_RATE > 0:
+            bucket = TokenBucket(SESSION.SPOOL_RATE)
+        self.spool.rewind()
+        self.acked = timeit.default_timer()
+        self.logger.info('Start the upload spool data transimission.')
+        while True:
+            # 窗口已满 或 没有新数据时等待确认, 否则只处理已到达的确认
+            full = self.spool.outstanding() >= max(SESSION.SPOOL_WINDOW, 1)
+            if not self.__acknowledge(SESSION.TIMEOUT if full else 0):
+                return False
+            # 上传队列关闭后 __spool_dispatch 已退出, 由这里定时同步确认
+            self.spool.expire()
+            if full:
+                continue
+            if self.spool.outstanding() > 0:
+                envelope = self.spool.read(0)
+                if envelope is None:
+                    if not self.__acknowledge(SESSION.TIMEOUT):
+                        return False
+                    continue
+            else:
+                self.acked = timeit.default_timer()
+                envelope = self.spool.read(SESSION.TIMEOUT)
+                if envelope is None:
+                    if not self.spooler.is_alive() and \
+                            not self.spool.pending():
+                        return True
+                    continue
+            if bucket is not None:
+                delay = bucket.delay(timeit.default_timer())
+                if delay > 0:
+                    # 已读取的记录须在等待后发送
+                    time.sleep(delay)
+                    bucket.delay(timeit.default_timer())
+                bucket.take()
+            if not FRAME.transmit(self.sock, envelope):
+                return False
 
     def __dispatcher(self):
         """ 创建 批处理 线程 """
-        # 尝试建立 TCP 连接
-        if self.__connect() and self.__cert() and RUNTIME.RUNNING:
-            # 上传数据
-            uploader = threading.Thread(target=self.__upload_dispatch)
-            self.dispatchers.append(uploader)
-            uploader.start()
-
-        # 等待数据上传结束
+        self.spool = Spool(FILE.main() + SESSION.SPOOL_DIRNAME,
+                           SESSION.SPOOL_SEGMENT, SESSION.SPOOL_SEGMENTS,
+                           SESSION.SPOOL_SYNC, SESSION.SPOOL_INTERVAL)
+        self.spooler = threading.Thread(target=self.__spool_dispatch)
+        self.dispatchers.append(self.spooler)
+        self.spooler.start()
+
+        # 尝试建立 TCP 连接并上传数据, 连接断开后重新连接, 从游标处继续上传
+        while self.__connect() and self.__cert():
+            if self.__replay():
+                break
+            self.logger.warn('...lost the connection, try to reconnect...')
+            FrameDecoder.free(self.sock)
+            SOCKET.close(self.sock)
+            self.sock = SOCKET.create(SESSION.SERVER_HOST, PROTO.TCP)
+
+        # 等待上传队列全部写入磁盘缓存
         self.__join()
+        self.spool.close()
+        self.logger.info('Upload spool: %s' % self.spool.stats())
         # 向服务器发送 结束报文
         self.logger.info('Send the end packet to server.')
         FRAME.send(self.sock, STAMP.END)
@@ -0,0 +1,203 @@
+# coding: utf-8
+
+""" 按目标调度的定时器
+
+基本思路:
+- 每个目标 (如 域名, (域名, ip)) 维护各自的下一次到期时间, 存放在最小堆中;
+- 同一次加入的目标在一个周期内均匀错开首次到期时间, 避免同时发出全部探测;
+- 到期后按 上一次计划时间 + 周期 重新计划, 调度不会因任务耗时而漂移;
+  每次计划时间加入 [-jitter, +jitter] * 周期 的随机抖动;
+- reschedule (如 按 TTL 重新解析) 只加入 [0, +jitter] * 周期 的抖动, 并补偿
+  TICK, 保证不早于 period 到期;
+- 落后超过一个周期时从当前时间重新计划, 不补发错过的探测;
+- 记录每个目标实际取出时间与计划时间的差 (调度延迟)。
+"""
+
+import heapq
+import random
+import threading
+import timeit
+
+
+class Scheduler(object):
+    """ 最小堆定时器 """
+    TICK = 0.05                     # 调度精度(单位: s), 同一精度内到期的目标一起取出
+
+    def __init__(self, period, jitter=0.0):
+        """ 初始化
+
+        @param period: 默认周期(单位: s)
+        @type  period: double
+
+        @param jitter: 抖动占周期的比例, [0, 0.5]
+        @type  jitter: double
+        """
+        self.period = period
+        self.jitter = min(max(jitter, 0.0), 0.5)
+        self.heap = []              # (到期时间, 序号, 目标)
+        self.entries = {}           # 目标: (到期时间, 序号, 周期)
+        self.counter = 0            # 堆内元素序号, 用于识别已失效的元素
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        self.lags = [0, 0.0, 0.0]   # 调度延迟: 次数, 总和, 最大值
+        self.wakeup = threading.Event()     # 加入新目标时唤醒 pause
+
+    def sync(self, targets, spread=None):
+        """ 使调度的目标与 targets 一致: 加入新目标, 移除不存在的目标
+
+        @param spread: 新目标的首次到期时间在 spread 秒内均匀错开,
+                       None 表示一个周期
+        @type  spread: double
+        """
+        spread = self.period if spread is None else spread
+        targets = set(targets)
+        self.lock.acquire()
+        try:
+            for target in self.entries.keys():
+                if target not in targets:
+                    self.entries.pop(target)
+            news = [x for x in targets if x not in self.entries]
+            self.__spread(news, spread)
+        finally:
+            self.lock.release()
+
+    def update(self, added, removed, spread=None, delay=0.0):
+        """ 按增量加入/移除目标
+
+        新目标的首次到期时间在 delay 秒之后的 spread 秒内均匀错开。
+        """
+        spread = self.period if spread is None else spread
+        self.lock.acquire()
+        try:
+            for target in removed:
+                self.entries.pop(target, None)
+            self.__spread(added, spread, delay)
+        finally:
+            self.lock.release()
+
+    def add(self, target, delay=0.0, period=None):
+        """ 加入或重新计划一个目标, delay 秒后到期 """
+        period = self.period if period is None else period
+        self.lock.acquire()
+        try:
+            self.__push(target, timeit.default_timer() + delay, period)
+        finally:
+            self.lock.release()
+
+    def reschedule(self, target, period):
+        """ 从当前时间开始, 以新的周期重新计划一个目标 (目标不存在时忽略)
+
+        到期时间不早于 period 秒之后 (如 DNS 回答的 TTL 到期之后)。
+        """
+        self.lock.acquire()
+        try:
+            if target not in self.entries:
+                return
+            due = timeit.default_timer() + self.__delay(period) + self.TICK
+            self.__push(target, due, period)
+        finally:
+            self.lock.release()
+
+    def remove(self, target):
+        self.lock.acquire()
+        try:
+            self.entries.pop(target, None)
+        finally:
+            self.lock.release()
+
+    def due(self):
+        """ 取出全部到期 (含 TICK 内即将到期) 的目标, 并计划其下一次到期
+
+        @return: 到期的目标
+        @rtype : []
+        """
+        targets = []
+        self.lock.acquire()
+        try:
+            now = timeit.default_timer()
+            while len(self.heap) > 0 and self.heap[0][0] <= now + self.TICK:
+                due, seq, target = heapq.heappop(self.heap)
+                entry = self.entries.get(target)
+                if entry is None or entry[1] != seq:
+                    # 已移除或已重新计划
+                    continue
+                lag = max(now - due, 0.0)
+                self.lags[0] = self.lags[0] + 1
+                self.lags[1] = self.lags[1] + lag
+                self.lags[2] = max(self.lags[2], lag)
+                period = entry[2]
+                due = due + self.__jitter(period)
+                if due <= now + self.TICK:
+                    # 落后超过一个周期, 从当前时间重新计划
+                    due = now + self.__jitter(period)
+                self.__push(target, due, period)
+                targets.append(target)
+            return targets
+        finally:
+            self.lock.release()
+
+    def wait(self, limit):
+        """ 距离下一个目标到期的时间(单位: s), 最长为 limit """
+        self.lock.acquire()
+        try:
+            while len(self.heap) > 0:
+                due, seq, target = self.heap[0]
+                entry = self.entries.get(target)
+                if entry is not None and entry[1] == seq:
+                    return min(max(due - timeit.default_timer(), 0.0), limit)
+                heapq.heappop(self.heap)
+            return limit
+        finally:
+            self.lock.release()
+
+    def pause(self, limit):
+        """ 休眠到下一个目标到期 (至少 TICK, 最长 limit), 加入新目标时提前返回 """
+        timeout = max(self.wait(limit), self.TICK)
+        self.wakeup.wait(timeout)
+        self.wakeup.clear()
+
+    def lag(self):
+        """ 获取并清空调度延迟的统计
+
+        @return: (次数, 平均延迟, 最大延迟)(单位: s)
+        @rtype : (int, double, double)
+        """
+        self.lock.acquire()
+        try:
+            count, total, peak = self.lags
+            self.lags = [0, 0.0, 0.0]
+            return (count, total / count if count > 0 else 0.0, peak)
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __jitter(self, period):
+        """ 加入随机抖动的周期 """
+        if self.jitter == 0:
+            return period
+        return period * (1 + self.random.uniform(-self.jitter, self.jitter))
+
+    def __delay(self, period):
+        """ 只加入非负抖动的周期 """
+        if self.jitter == 0:
+            return period
+        return period * (1 + self.random.uniform(0, self.jitter))
+
+    def __spread(self, targets, spread, delay=0.0):
+        """ 加入新目标, 首次到期时间在 delay 秒之后的 spread 秒内均匀错开
+        (调用者持有 self.lock)
+        """
+        now = timeit.default_timer() + delay
+        for i, target in enumerate(targets):
+            offset = spread * i / len(targets)
+            self.__push(target, now + offset, self.period)
+        if len(targets) > 0:
+            self.wakeup.set()
+
+    def __push(self, target, due, period):
+        """ 计划目标在 due 时到期 (调用者持有 self.lock) """
+        self.counter = self.counter + 1
+        self.entries[target] = (due, self.counter, period)
+        heapq.heappush(self.heap, (due, self.counter, target))
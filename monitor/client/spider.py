@@ -5,50 +5,73 @@
 
 基本思路:
 - 采用 任务队列与调度器 机制
-    - 每个调度器面向一个任务队列, 调度器内部多线程处理任务;
-    - 不同调度器采取不同的休眠周期, 添加调度器线程为 守护线程;
+    - 每个调度器面向一个任务队列, 由定时器 (Scheduler) 维护每个目标各自的到期
+      时间, 新目标在一个周期内均匀错开, 避免同时发出全部探测;
+    - 到期的目标按 SPIDER_CHUNK 分块提交到共享的常驻线程池, 每块由探测引擎
+      批量处理;
+    - 调度器线程为 守护线程, 休眠到最早到期的目标;
     - 不同调度器之间通过任务队列同步处理信号;
     - 每个调度器维护一个公共的结果队列, 供外部访问。
 """
 
-from Queue import Queue
 import threading
-import time
+import timeit
 import ConfigParser
-from multiprocessing.dummy import Pool as ThreadPool
 from config.constant import FILE
 from config.logger import Logger
 from config.runtime import RUNTIME
-from core.spider.https import DNSResolver
-from core.spider.ping import ICMPing
+from client.channel import BoundedQueue, POLICY
+from client.scheduler import Scheduler
+from client.worker import Admission, WorkerPool
+from core.spider.https import DNSCache, DNSResolver
+from core.spider.ping import ICMPEngine, ICMPing
+from core.spider.rate import RATE
 
 
 class CONF(object):
     """ 数据监测过程配置 """
     # 配置文件解析器
     PARSER = ConfigParser.ConfigParser()
+    LOCK = threading.RLock()
+    # 任务线程准入控制, 全部线程池共享
+    ADMISSION = None
 
     # 运行配置
     SPIDER_MAX_THREADS = 20
     SPIDER_MIN_THREADS = 5
+    SPIDER_CHUNK = 100
+    SPIDER_JITTER = 0.1
+    SPIDER_RATE = 2000
+    SPIDER_DST_RATE = 100
     SPIDER_DNS = 300
     SPIDER_ICMPING = 10
 
+    # 结果队列 及 上传队列: 容量, 队列满时的策略
+    QUEUE_DNS_SIZE = 1024
+    QUEUE_DNS_POLICY = POLICY.COALESCE
+    QUEUE_ICMPING_SIZE = 4096
+    QUEUE_ICMPING_POLICY = POLICY.DROP
+    QUEUE_UPLOAD_SIZE = 4096
+    QUEUE_UPLOAD_POLICY = POLICY.BLOCK
+
     # DNS
     DNS_TIMEOUT = 0.25
     DNS_RETRY = 2
+    DNS_TTL_FLOOR = 5
+    DNS_TTL_CEILING = 300
+    DNS_CACHE_SIZE = 1024
 
     # ICMPing
     ICMPING_INTERVAL = 0.1
     ICMPING_TIMEOUT = 0.5
     ICMPING_RETRY = 5
+    ICMPING_DGRAM = True
 
     @staticmethod
     def load(filename='spider.conf'):
         logger = Logger.get()
         filepath = FILE.conf(filename)
-        lock = threading.Lock()
-        lock.acquire()
+        CONF.LOCK.acquire()
         try:
             logger.info('Start to load the spider configure.')
             CONF.PARSER.read(filepath)
@@ -57,13 +80,41 @@ class CONF(object):
             CONF.SPIDER_ICMPING = CONF.PARSER.getfloat('spider', 'icmping')
             CONF.SPIDER_MAX_THREADS = CONF.PARSER.getint('spider', 'max')
             CONF.SPIDER_MIN_THREADS = CONF.PARSER.getint('spider', 'min')
+            CONF.SPIDER_CHUNK = CONF.PARSER.getint('spider', 'chunk')
+            CONF.SPIDER_JITTER = CONF.PARSER.getfloat('spider', 'jitter')
+            CONF.SPIDER_RATE = CONF.PARSER.getfloat('spider', 'rate')
+            CONF.SPIDER_DST_RATE = CONF.PARSER.getfloat('spider', 'dst_rate')
+            RATE.configure(CONF.SPIDER_RATE, CONF.SPIDER_DST_RATE)
+            # 结果队列 及 上传队列
+            CONF.QUEUE_DNS_SIZE = CONF.PARSER.getint('queue', 'dns_size')
+            CONF.QUEUE_DNS_POLICY = CONF.PARSER.get('queue', 'dns_policy')
+            CONF.QUEUE_ICMPING_SIZE = CONF.PARSER.getint('queue',
+                                                         'icmping_size')
+            CONF.QUEUE_ICMPING_POLICY = CONF.PARSER.get('queue',
+                                                        'icmping_policy')
+            CONF.QUEUE_UPLOAD_SIZE = CONF.PARSER.getint('queue', 'upload_size')
+            CONF.QUEUE_UPLOAD_POLICY = CONF.PARSER.get('queue',
+                                                       'upload_policy')
+            RESULT.DNS.configure(CONF.QUEUE_DNS_SIZE, CONF.QUEUE_DNS_POLICY)
+            RESULT.ICMPING.configure(CONF.QUEUE_ICMPING_SIZE,
+                                     CONF.QUEUE_ICMPING_POLICY)
             # DNS Resolver
             CONF.DNS_TIMEOUT = CONF.PARSER.getfloat('dns_resolver', 'timeout')
             CONF.DNS_RETRY = CONF.PARSER.getint('dns_resolver', 'retry')
+            CONF.DNS_TTL_FLOOR = CONF.PARSER.getfloat('dns_resolver',
+                                                      'ttl_floor')
+            CONF.DNS_TTL_CEILING = CONF.PARSER.getfloat('dns_resolver',
+                                                        'ttl_ceiling')
+            CONF.DNS_CACHE_SIZE = CONF.PARSER.getint('dns_resolver',
+                                                     'cache_size')
+            DNSCache.SIZE = CONF.DNS_CACHE_SIZE
+            DNSCache.LIFETIME = CONF.DNS_TTL_CEILING
             # ICMPing
             CONF.ICMPING_INTERVAL = CONF.PARSER.getfloat('icmping', 'interval')
             CONF.ICMPING_TIMEOUT = CONF.PARSER.getfloat('icmping', 'timeout')
             CONF.ICMPING_RETRY = CONF.PARSER.getint('icmping', 'retry')
+            CONF.ICMPING_DGRAM = CONF.PARSER.getboolean('icmping', 'dgram')
+            ICMPEngine.DGRAM = CONF.ICMPING_DGRAM
             logger.info('Successfully load the spider configure.')
             return True
         except Exception:
@@ -71,14 +122,13 @@ class CONF(object):
             logger.exception('Failed to load the spider configure.')
             return False
         finally:
-            lock.release()
+            CONF.LOCK.release()
 
     @staticmethod
     def update(section, option, value, filename='spider.conf'):
         logger = Logger.get()
         filepath = FILE.module(__file__) + filename
-        lock = threading.Lock()
-        lock.acquire()
+        CONF.LOCK.acquire()
         try:
             logger.info('Start to update the spider configure.')
             CONF.PARSER.read(filepath)
@@ -90,39 +140,37 @@ class CONF(object):
             logger.exception('Failed to update the spider configure.')
             return False
         finally:
-            lock.release()
-
-    @staticmethod
-    def apply(amount):
-        """ 申请可用任务线程数 """
-        lock = threading.Lock()
-        lock.acquire()
-        try:
-            remain = CONF.SPIDER_MAX_THREADS - RUNTIME.THREADS
-            if amount > remain and amount > CONF.SPIDER_MIN_THREADS:
-                amount = CONF.SPIDER_MIN_THREADS
-            RUNTIME.THREADS = RUNTIME.THREADS + amount
-            return amount
-        finally:
-            lock.release()
+            CONF.LOCK.release()
 
     @staticmethod
-    def release(amount):
-        """ 释放任务线程数 """
-        lock = threading.Lock()
-        lock.acquire()
+    def admission():
+        """ 获取任务线程准入控制, 首次调用时按 SPIDER_MAX_THREADS 创建 """
+        CONF.LOCK.acquire()
         try:
-            RUNTIME.THREADS = RUNTIME.THREADS - amount
-            if RUNTIME.THREADS < 0:
-                RUNTIME.THREADS = 0
+            if CONF.ADMISSION is None:
+                CONF.ADMISSION = Admission(CONF.SPIDER_MAX_THREADS)
+            return CONF.ADMISSION
         finally:
-            lock.release()
+            CONF.LOCK.release()
 
 
 class TASK(object):
-    """ 任务队列 """
+    """ 任务登记表
+
+    基本思路:
+    - DNS 为检测域名列表;
+    - 以 域名 和 ip 双向索引 (domain, ip) 任务, 添加/删除均为 O(1);
+    - 域名的 ip 集合在新的解析结果到达时整体替换, 每次变化产生增量
+      (新增任务, 删除任务);
+    - 多个域名可能解析到同一个 ip (如 CDN 节点), 每个 ip 只需探测一次,
+      因此通知订阅者 (如 ICMPing 调度器) 的是 ip 的增量 (新增 ip, 删除 ip):
+      ip 的第一个域名加入时新增, 最后一个域名移除时删除。
+    """
     DNS = RUNTIME.CHECK_LIST
-    IPS = []
+    DOMAINS = {}                    # 域名: set(ip)
+    IPS = {}                        # ip: set(域名)
+    SUBSCRIBERS = []                # 接收 ip 增量的方法, 参数为 (新增, 删除)
+    LOCK = threading.Lock()
 
     @staticmethod
     def load():
@@ -130,169 +178,305 @@ class TASK(object):
         TASK.DNS = RUNTIME.CHECK_LIST
 
     @staticmethod
-    def add(queue, task):
-        """ 向任务队列中添加一个任务
+    def subscribe(callback):
+        """ 订阅 ip 的增量变化
+
+        @param callback: 参数为 (新增的 ip, 删除的 ip)
+        @type  callback: function
+        """
+        TASK.LOCK.acquire()
+        try:
+            TASK.SUBSCRIBERS.append(callback)
+        finally:
+            TASK.LOCK.release()
+
+    @staticmethod
+    def replace(domain, ips):
+        """ 以新的解析结果整体替换域名的 ip 集合
 
-        @param queue: 任务队列
-        @type  queue: []
+        @param ips: 域名的全部 ip
+        @type  ips: [ip]
 
-        @param task: 任务
-        @type  task: 与 任务队列 中的元素类型相同 或 []
+        @return: ip 的增量 (新增的 ip, 删除的 ip), 与通知订阅者的相同
+        @rtype : ([ip], [ip])
         """
-        logger = Logger.get()
-        lock = threading.Lock()
-        lock.acquire()
+        TASK.LOCK.acquire()
         try:
-            def _add(t):
-                if t not in queue:
-                    queue.append(t)
-            if isinstance(task, list):
-                map(_add, task)
+            ips = set(ips)
+            olds = TASK.DOMAINS.get(domain, set())
+            added = [(domain, x) for x in ips - olds]
+            removed = [(domain, x) for x in olds - ips]
+            if len(ips) > 0:
+                TASK.DOMAINS[domain] = ips
             else:
-                _add(task)
-        except Exception:
-            logger.info('map: the type of task is: %s' % type(task))
-            logger.exception('Maybe failed to map the task.')
+                TASK.DOMAINS.pop(domain, None)
+            news = []
+            for _, ip in added:
+                if ip not in TASK.IPS:
+                    TASK.IPS[ip] = set()
+                    news.append(ip)
+                TASK.IPS[ip].add(domain)
+            olds = []
+            for _, ip in removed:
+                domains = TASK.IPS.get(ip)
+                domains.discard(domain)
+                if len(domains) == 0:
+                    TASK.IPS.pop(ip)
+                    olds.append(ip)
+            TASK.__publish(news, olds)
+            return (news, olds)
         finally:
-            lock.release()
+            TASK.LOCK.release()
 
     @staticmethod
-    def die(queue, perk):
-        """ 删除过期的任务
+    def remove(domain):
+        """ 删除域名的全部任务 (域名已不在检测列表中) """
+        return TASK.replace(domain, [])
 
-        @param queue: 任务队列
-        @type  queue: []
+    @staticmethod
+    def domains():
+        """ 已有任务的域名 """
+        TASK.LOCK.acquire()
+        try:
+            return TASK.DOMAINS.keys()
+        finally:
+            TASK.LOCK.release()
 
-        @param perk: 过滤器
-        @type  perk: function
-        """
-        logger = Logger.get()
-        lock = threading.Lock()
-        lock.acquire()
+    @staticmethod
+    def lookup(ip):
+        """ 解析到 ip 的全部域名 """
+        TASK.LOCK.acquire()
         try:
-            queue = filter(perk, queue)
-        except Exception:
-            logger.info('filter: the type of queue is: %s' % type(queue))
-            logger.exception('Failed to filter the task queue.')
+            return list(TASK.IPS.get(ip, []))
         finally:
-            lock.release()
+            TASK.LOCK.release()
+
+    @staticmethod
+    def tasks():
+        """ 全部 (domain, ip) 任务 """
+        TASK.LOCK.acquire()
+        try:
+            return [(d, x) for d, ips in TASK.DOMAINS.iteritems() for x in ips]
+        finally:
+            TASK.LOCK.release()
+
+    @staticmethod
+    def __publish(added, removed):
+        """ 通知订阅者 (调用者持有 TASK.LOCK, 保证增量按顺序到达) """
+        if len(added) == 0 and len(removed) == 0:
+            return
+        for callback in TASK.SUBSCRIBERS:
+            try:
+                callback(added, removed)
+            except Exception:
+                Logger.get().exception('Failed to publish the task changes.')
 
 
 class RESULT(object):
     """ 结果队列 """
-    DNS = Queue()
-    ICMPING = Queue()
+    DNS = BoundedQueue('dns', CONF.QUEUE_DNS_SIZE, CONF.QUEUE_DNS_POLICY,
+                       lambda x: RESULT.target(x))
+    ICMPING = BoundedQueue('icmping', CONF.QUEUE_ICMPING_SIZE,
+                           CONF.QUEUE_ICMPING_POLICY,
+                           lambda x: RESULT.target(x))
+
+    @staticmethod
+    def target(result):
+        """ 结果所属的目标: DNS 结果为 域名, ICMPing 结果为 (域名, ip) """
+        domain, value = result.items()[0]
+        if isinstance(value, dict) and 'ip' in value:
+            return (domain, value['ip'])
+        return domain
 
     @staticmethod
     def end():
-        """ 添加结果队列结束符 """
-        RESULT.DNS.put(False)
-        RESULT.ICMPING.put(False)
+        """ 关闭结果队列: 分析线程取完剩余结果后得到结束符 """
+        RESULT.DNS.close()
+        RESULT.ICMPING.close()
 
 
 class Spider(object):
     """ 数据监测总调度类 """
+    WAKE = 1                        # 调度器最长休眠时间(单位: s)
+    LAG_REPORT = 60                 # 记录调度延迟的间隔(单位: s)
+
     def __init__(self):
         CONF.load()
         TASK.load()
 
         self.logger = Logger.get()
         self.dispatchers = []
-
-    def __dispatch(self, run, tasks):
-        """ 线程池: 分发任务
-
-        @param run: 任务执行方法
-        @type  run: function
-
-        @param tasks: 任务队列
-        @type  tasks: []
-
-        @param threads: 最大线程数
-        @type  threads: int
+        self.pool = WorkerPool(CONF.SPIDER_MIN_THREADS,
+                               CONF.SPIDER_MAX_THREADS, CONF.admission())
+        self.dns = Scheduler(CONF.SPIDER_DNS, CONF.SPIDER_JITTER)
+        self.icmping = Scheduler(CONF.SPIDER_ICMPING, CONF.SPIDER_JITTER)
+        TASK.subscribe(self.__icmping_changes)
+        # 共享的探测引擎写入 MAIN 日志, 须在登记域名日志之前创建
+        ICMPEngine.get()
+
+    def __chunks(self, tasks):
+        """ 将任务按 SPIDER_CHUNK 分块 """
+        size = max(CONF.SPIDER_CHUNK, 1)
+        return [tasks[i:i + size] for i in xrange(0, len(tasks), size)]
+
+    def __dns(self, domains):
+        """ DNS解析执行方法: 一块域名由 DNSEngine 批量解析
+
+        - 解析完成后按 TTL 重新计划每个域名的下一次解析;
+        - 新出现的 ip 不经过 ICMPing 调度器, 直接在当前任务线程内探测,
+          之后再由调度器按 SPIDER_ICMPING 周期探测。
         """
-        lock = threading.Lock()
-        lock.acquire()
-        pool = None
-        amount = 0
-        try:
-            amount = len(tasks)
-            if amount == 0:
-                return
-            amount = CONF.apply(amount)
-            pool = ThreadPool(amount)
-            pool.map(run, tasks)
-        except Exception:
-            self.logger.exception('Failed to dispatch task.')
-        finally:
-            CONF.release(amount)
-            lock.release()
-        if pool is not None:
-            pool.close()
-            pool.join()
-
-    def __dns(self, domain):
-        """ DNS解析执行方法 """
-        Logger.sign_up(domain)
-        logger = Logger.get()
-        resolver = DNSResolver()
-        resolver.config(domain, CONF.DNS_TIMEOUT, CONF.DNS_RETRY)
-        resolver.resolve()
-
-        # 将解析结果导出结果队列
-        result = {domain: resolver.json()}
-        RESULT.DNS.put(result)
-        # 将得到的 ip 导入任务队列
-        try:
-            ips = map(lambda x: (domain, x), resolver.ips())
+        resolvers = DNSResolver.batch(domains, CONF.DNS_TIMEOUT,
+                                      CONF.DNS_RETRY)
+        news = self.__dns_result(resolvers)
+        for resolver in resolvers:
+            # 从解析完成时开始计算, 保证缓存的回答已过期
+            period = self.__dns_period(resolver)
+            self.dns.reschedule(resolver.domain, period)
+        if len(news) > 0:
+            self.__icmping(news)
+
+    def __dns_result(self, resolvers):
+        """ 导出一块 DNS 解析结果, 并更新 ICMPing 任务
+
+        解析失败 (没有得到 ip) 时保留域名原有的任务; 全部来自 DNS 缓存的
+        结果不是新的测量, 不导出。
+
+        @return: 新出现的 ip
+        @rtype : [ip]
+        """
+        news = []
+        for resolver in resolvers:
+            domain = resolver.domain
+            Logger.sign_up(domain)
+            try:
+                # 将解析结果导出结果队列
+                records = resolver.json()
+                if len(records) > 0:
+                    RESULT.DNS.put({domain: records})
+                # 以得到的 ip 替换域名的任务
+                ips = resolver.ips()
+                if len(ips) > 0 and domain in TASK.DNS:
+                    news.extend(TASK.replace(domain, ips)[0])
+            except Exception:
+                error = 'Failed to map the ips to (domain, ip).'
+                Logger.get().exception(error)
+            finally:
+                Logger.log_out()
+        return news
+
+    def __dns_targets(self):
+        """ DNS 调度的目标: 检测域名列表, 同时删除已移出列表的域名的任务 """
+        domains = list(TASK.DNS)
+        for domain in set(TASK.domains()) - set(domains):
+            TASK.remove(domain)
+        return domains
+
+    def __dns_period(self, resolver):
+        """ 域名的重新解析间隔(单位: s)
+
+        取解析结果的最小 TTL, 无 TTL 时取 SPIDER_DNS, 并限定在
+        [DNS_TTL_FLOOR, DNS_TTL_CEILING] 之内。
+        """
+        ttl = resolver.ttl()
+        period = CONF.SPIDER_DNS if ttl <= 0 else ttl
+        return min(max(period, CONF.DNS_TTL_FLOOR), CONF.DNS_TTL_CEILING)
 
-            def perk(ip):
-                return ip not in ips
-            TASK.die(TASK.IPS, perk)
-            TASK.add(TASK.IPS, ips)
-        except Exception:
-            logger.info('map: the type of ips is: %s' % type(resolver.ips()))
-            logger.exception('Failed to map the ips to (domain, ip).')
-        finally:
-            Logger.log_out()
-
-    def __icmping(self, ip):
-        """ ICMPing 执行方法 """
-        domain, ip = ip
-        Logger.sign_up(domain)
-        icmping = ICMPing()
-        icmping.config(ip, CONF.ICMPING_INTERVAL, CONF.DNS_TIMEOUT)
-        for _ in range(CONF.ICMPING_RETRY):
-            icmping.ping()
-        result = {domain: {'ip': ip, 'icmping': icmping.json()}}
-        RESULT.ICMPING.put(result)
-        Logger.log_out()
+    def __icmping(self, ips):
+        """ ICMPing 执行方法: 一块 ip 以突发模式探测
 
-    def __dns_dispatch(self):
-        """ DNS 批处理 """
+        每个 ip 只探测一次, 结果分发给解析到该 ip 的每个域名;
+        等待执行期间已删除的 ip 不再探测。探测过程的日志写入解析到该 ip 的
+        第一个域名的日志, 分发结果时写入各个域名的日志。
+        """
+        icmpings = []
+        for ip in ips:
+            domains = sorted(TASK.lookup(ip))
+            if len(domains) == 0:
+                continue
+            Logger.sign_up(domains[0])
+            try:
+                icmping = ICMPing()
+            finally:
+                Logger.log_out()
+            icmping.config(ip, CONF.ICMPING_INTERVAL, CONF.ICMPING_TIMEOUT)
+            icmpings.append((ip, icmping))
+        ICMPing.bursts([x[1] for x in icmpings], CONF.ICMPING_RETRY)
+        for ip, icmping in icmpings:
+            records = icmping.json()
+            for domain in TASK.lookup(ip):
+                Logger.sign_up(domain)
+                try:
+                    result = {domain: {'ip': ip, 'icmping': records}}
+                    RESULT.ICMPING.put(result)
+                finally:
+                    Logger.log_out()
+
+    def __schedule(self, name, scheduler, targets, spread, execute, queue):
+        """ 调度循环: 按各目标的到期时间分块提交到线程池
+
+        @param name: 调度器名称 (用于日志)
+        @type  name: string
+
+        @param scheduler: 定时器
+        @type  scheduler: Scheduler
+
+        @param targets: 获取当前全部目标的方法, None 表示目标由增量维护
+        @type  targets: function
+
+        @param spread: 新目标首次到期时间的错开范围(单位: s)
+        @type  spread: double
+
+        @param execute: 执行一块目标的方法
+        @type  execute: function
+
+        @param queue: 执行结果放入的结果队列
+        @type  queue: BoundedQueue
+        """
+        report = timeit.default_timer() + Spider.LAG_REPORT
         while RUNTIME.RUNNING:
-            self.__dispatch(self.__dns, TASK.DNS)
-            if not RUNTIME.RUNNING:
-                break
             try:
-                info = 'dns dispatcher: sleeping for %f s.'
-                self.logger.info(info % CONF.SPIDER_DNS)
-                time.sleep(CONF.SPIDER_DNS)
+                if targets is not None:
+                    scheduler.sync(targets(), spread)
+                for chunk in self.__chunks(scheduler.due()):
+                    self.pool.submit(execute, (chunk, ))
             except Exception:
-                self.logger.exception('..dns dispatcher failed to sleep ..')
-
-    def __icmping_dispatch(self):
-        """ ICMPing 批处理 """
-        while RUNTIME.RUNNING:
-            self.__dispatch(self.__icmping, TASK.IPS)
-            if not RUNTIME.RUNNING:
-                break
+                self.logger.exception('%s dispatcher failed.' % name)
+            if timeit.default_timer() >= report:
+                report = timeit.default_timer() + Spider.LAG_REPORT
+                info = '%s dispatcher: %d targets, lag mean %.3f s, max %.3f s'
+                self.logger.info(info % ((name, ) + scheduler.lag()))
+                info = '%(name)s result queue: depth %(depth)d/%(size)d, ' \
+                    'drops %(drops)d, coalesced %(coalesced)d, ' \
+                    'blocked %(blocked).3f s'
+                self.logger.info(info % queue.stats())
+            # 最长休眠 Spider.WAKE 以发现新加入的目标
             try:
-                info = 'icmping dispatcher: sleeping for %f s.'
-                self.logger.info(info % CONF.SPIDER_ICMPING)
-                time.sleep(CONF.SPIDER_ICMPING)
+                scheduler.pause(Spider.WAKE)
             except Exception:
-                self.logger.exception('..icmping dispatcher failed to sleep..')
+                error = '..%s dispatcher failed to sleep..'
+                self.logger.exception(error % name)
+
+    def __dns_dispatch(self):
+        """ DNS 调度: 每个域名在其 TTL 到期时重新解析 """
+        self.__schedule('dns', self.dns, self.__dns_targets,
+                        CONF.DNS_TTL_FLOOR, self.__dns, RESULT.DNS)
+
+    def __icmping_dispatch(self):
+        """ ICMPing 调度: 每个 ip 在 SPIDER_ICMPING 内均匀错开
+
+        目标由 TASK 的 ip 增量维护, 见 __icmping_changes。
+        """
+        self.__schedule('icmping', self.icmping, None,
+                        CONF.SPIDER_ICMPING, self.__icmping, RESULT.ICMPING)
+
+    def __icmping_changes(self, added, removed):
+        """ 将 ip 的增量应用到 ICMPing 调度器
+
+        删除的 ip 立即取消; 新增的 ip 已由 __dns 立即探测, 下一次探测在一个
+        周期之后。
+        """
+        self.icmping.update(added, removed, delay=CONF.SPIDER_ICMPING)
 
     def __dispatcher(self, target, args=()):
         """ 创建调度线程 """
@@ -0,0 +1,397 @@
+# coding: utf-8
+
+""" 上传数据的磁盘缓存
+
+基本思路:
+- 待上传的通信数据先追加写入磁盘缓存, 再由上传线程按回放游标依次发送,
+  服务器不可达时内存占用不随离线时间增长, 进程重启后也不丢失数据;
+- 缓存由多个固定大小的段文件组成, 段文件预先分配并以 mmap 写入, 写满后
+  轮转到下一个段; 每 SYNC 条记录 或 INTERVAL 秒 同步一次到磁盘, 停止写入
+  后由上传线程定时调用 expire 同步剩余的记录和确认;
+- 记录格式: 长度(4 bytes) + CRC32(4 bytes) + 数据, 长度为 0 表示段结束;
+  段尾未写完整的记录 (进程异常退出) 因 CRC 校验失败而被跳过;
+- 读取位置领先于回放游标, 两者之间是已发送未确认的记录; 回放游标
+  (段序号, 偏移量) 只在服务器确认后前进, 同样按批次写入游标文件;
+  连接断开后读取位置回到游标处 (rewind), 未确认的记录重新发送;
+- 游标先写入临时文件并同步, 再改名替换游标文件, 异常退出时游标文件
+  总是完整的;
+- 游标离开的段文件被删除; 段数超过上限时丢弃最早的段;
+- 每次启动都写入一个新的段, 不再追加到上一次运行的段。
+"""
+
+import collections
+import mmap
+import os
+import struct
+import threading
+import timeit
+import zlib
+from config.logger import Logger
+
+
+class Spool(object):
+    """ 以段文件轮转的追加写磁盘缓存 """
+    HEAD = struct.Struct('!LL')     # 记录头部: 长度, CRC32
+    CURSOR = struct.Struct('!QL')   # 游标文件: 段序号, 偏移量
+    SUFFIX = '.seg'
+
+    def __init__(self, dirname, segment=4194304, segments=64,
+                 sync=64, interval=1.0):
+        """ 初始化, 恢复上一次运行的游标和段文件
+
+        @param dirname: 缓存目录
+        @type  dirname: string
+
+        @param segment: 段文件大小(单位: bytes)
+        @type  segment: int
+
+        @param segments: 最多保留的段数
+        @type  segments: int
+
+        @param sync: 每写入 sync 条记录同步一次到磁盘
+        @type  sync: int
+
+        @param interval: 最长同步间隔(单位: s)
+        @type  interval: double
+        """
+        self.logger = Logger.get()
+        self.dirname = dirname
+        self.segment = max(segment, 4096)
+        self.segments = max(segments, 2)
+        self.sync = max(sync, 1)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.readable = threading.Condition(self.lock)
+        # 写入: 当前段序号, 段文件, 映射, 写入偏移量
+        self.index = 0
+        self.file = None
+        self.map = None
+        self.position = 0
+        self.dirty = 0              # 未同步的记录数
+        self.synced = timeit.default_timer()
+        # 回放: 游标, 读取位置, 读取中的段映射, 已读取未确认的记录
+        self.cursor = [0, 0]
+        self.reader = [0, 0]
+        self.reading = None         # (段序号, 段文件, 映射)
+        self.inflight = collections.deque()     # (段序号, 记录结束偏移量)
+        self.acked = 0              # 游标文件未记录的确认数
+        self.saved = timeit.default_timer()
+        # 写入的记录数, 回放的记录数, 丢弃的段数
+        self.counters = {'appended': 0, 'replayed': 0, 'dropped': 0}
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.__recover()
+
+    def append(self, data):
+        """ 追加一条记录
+
+        @param data: 通信数据
+        @type  data: string
+
+        @return: 是否写入成功
+        @rtype : bool
+        """
+        size = Spool.HEAD.size + len(data)
+        if size > self.segment - Spool.HEAD.size:
+            self.logger.error('The record is larger than a spool segment.')
+            return False
+        self.lock.acquire()
+        try:
+            if self.position + size > self.segment - Spool.HEAD.size:
+                self.__rotate()
+            crc = zlib.crc32(data) & 0xffffffff
+            Spool.HEAD.pack_into(self.map, self.position, len(data), crc)
+            start = self.position + Spool.HEAD.size
+            self.map[start:start + len(data)] = data
+            self.position = self.position + size
+            self.dirty = self.dirty + 1
+            self.counters['appended'] = self.counters['appended'] + 1
+            if self.dirty >= self.sync or \
+                    timeit.default_timer() - self.synced >= self.interval:
+                self.__sync()
+            self.readable.notify()
+            return True
+        finally:
+            self.lock.release()
+
+    def read(self, timeout=None):
+        """ 读取下一条记录, 读取位置前进, 游标在 ack 之后才前进
+
+        @param timeout: 没有记录时的最长等待时间(单位: s)
+        @type  timeout: double
+
+        @return: 通信数据, 没有记录时为 None
+        @rtype : string
+        """
+        self.lock.acquire()
+        try:
+            data = self.__read()
+            if data is None and timeout != 0:
+                self.readable.wait(timeout)
+                data = self.__read()
+            return data
+        finally:
+            self.lock.release()
+
+    def ack(self):
+        """ 确认最早一条已读取的记录已被服务器接收, 游标前进 """
+        self.lock.acquire()
+        try:
+            if len(self.inflight) == 0:
+                return
+            index, end = self.inflight.popleft()
+            # 记录所在的段未被丢弃
+            if index >= self.cursor[0]:
+                while self.cursor[0] < index:
+                    self.__advance()
+                self.cursor[1] = max(self.cursor[1], end)
+            self.__settle()
+            self.acked = self.acked + 1
+            self.counters['replayed'] = self.counters['replayed'] + 1
+            if self.acked >= self.sync or \
+                    timeit.default_timer() - self.saved >= self.interval:
+                self.__save()
+        finally:
+            self.lock.release()
+
+    def outstanding(self):
+        """ 已读取未确认的记录数 """
+        self.lock.acquire()
+        try:
+            return len(self.inflight)
+        finally:
+            self.lock.release()
+
+    def rewind(self):
+        """ 放弃全部未确认的记录, 读取位置回到游标处 (重新连接后调用) """
+        self.lock.acquire()
+        try:
+            self.reader = list(self.cursor)
+            self.inflight.clear()
+        finally:
+            self.lock.release()
+
+    def pending(self):
+        """ 是否还有未确认的记录 """
+        self.lock.acquire()
+        try:
+            return self.cursor[0] < self.index or \
+                self.cursor[1] < self.position
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """ 获取缓存的统计
+
+        @return: 段数, 写入的记录数, 回放的记录数, 丢弃的段数
+        @rtype : dict
+        """
+        self.lock.acquire()
+        try:
+            stats = dict(self.counters)
+            stats['segments'] = self.index - self.cursor[0] + 1
+            return stats
+        finally:
+            self.lock.release()
+
+    def expire(self):
+        """ 距上一次同步已超过 interval 时, 同步未同步的记录和确认 """
+        self.lock.acquire()
+        try:
+            now = timeit.default_timer()
+            if self.dirty > 0 and now - self.synced >= self.interval:
+                self.__sync()
+            if self.acked > 0 and now - self.saved >= self.interval:
+                self.__save()
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        """ 立即同步数据和游标到磁盘 """
+        self.lock.acquire()
+        try:
+            self.__sync()
+            self.__save()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """ 同步并关闭全部文件 """
+        self.lock.acquire()
+        try:
+            self.__sync()
+            self.__save()
+            self.__release()
+            self.map.close()
+            self.file.close()
+        finally:
+            self.lock.release()
+
+    def __path(self, index):
+        return os.path.join(self.dirname, '%016d%s' % (index, Spool.SUFFIX))
+
+    def __cursor(self):
+        return os.path.join(self.dirname, 'cursor')
+
+    def __indexes(self):
+        """ 目录中全部段文件的序号, 升序 """
+        indexes = []
+        for name in os.listdir(self.dirname):
+            if name.endswith(Spool.SUFFIX):
+                try:
+                    indexes.append(int(name[:-len(Spool.SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(indexes)
+
+    def __recover(self):
+        """ 读取游标文件, 删除已回放的段, 并创建新的写入段 """
+        indexes = self.__indexes()
+        # 游标文件在替换前被删除 (Windows) 时, 使用已同步的临时文件
+        for path in [self.__cursor(), self.__cursor() + '.tmp']:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    raw = f.read(Spool.CURSOR.size)
+                if len(raw) == Spool.CURSOR.size:
+                    self.cursor = list(Spool.CURSOR.unpack(raw))
+                    break
+        if len(indexes) > 0 and self.cursor[0] < indexes[0]:
+            self.cursor = [indexes[0], 0]
+        for index in indexes:
+            if index < self.cursor[0]:
+                os.remove(self.__path(index))
+        self.index = max(indexes[-1] + 1 if len(indexes) > 0 else 0,
+                         self.cursor[0])
+        if len(indexes) == 0 or self.cursor[0] > indexes[-1]:
+            self.cursor = [self.index, 0]
+        self.reader = list(self.cursor)
+        self.__open()
+        self.__save()
+        info = 'Recover the upload spool: cursor %d:%d, %d old segments.'
+        self.logger.info(info % (self.cursor[0], self.cursor[1],
+                                 self.index - self.cursor[0]))
+
+    def __open(self):
+        """ 创建并映射当前写入段 (调用者持有 self.lock 或 初始化中) """
+        self.file = open(self.__path(self.index), 'w+b')
+        self.file.truncate(self.segment)
+        self.map = mmap.mmap(self.file.fileno(), self.segment)
+        self.position = 0
+
+    def __rotate(self):
+        """ 写入段已满, 轮转到下一个段 (调用者持有 self.lock) """
+        self.__sync()
+        self.map.close()
+        self.file.close()
+        self.index = self.index + 1
+        self.__open()
+        # 段数超过上限, 丢弃最早的段
+        while self.index - self.cursor[0] + 1 > self.segments:
+            self.logger.warn('The upload spool is full, drop a segment.')
+            self.counters['dropped'] = self.counters['dropped'] + 1
+            self.__advance()
+
+    def __advance(self):
+        """ 游标移动到下一个段, 删除已离开的段 (调用者持有 self.lock) """
+        old = self.cursor[0]
+        if self.reading is not None and self.reading[0] == old:
+            self.__release()
+        self.cursor = [old + 1, 0]
+        if self.reader < self.cursor:
+            # 读取位置所在的段被丢弃
+            self.reader = list(self.cursor)
+        try:
+            os.remove(self.__path(old))
+        except OSError:
+            self.logger.exception('Failed to remove a spool segment.')
+        self.__save()
+
+    def __release(self):
+        """ 关闭读取中的段映射 (调用者持有 self.lock) """
+        if self.reading is not None:
+            self.reading[2].close()
+            self.reading[1].close()
+            self.reading = None
+
+    def __settle(self):
+        """ 游标移到最早的未确认记录所在的段, 全部确认时与读取位置一致
+        (调用者持有 self.lock)
+        """
+        if len(self.inflight) > 0:
+            target = self.inflight[0][0]
+        else:
+            target = self.reader[0]
+        while self.cursor[0] < target:
+            self.__advance()
+        if len(self.inflight) == 0 and self.cursor[0] == self.reader[0]:
+            self.cursor[1] = max(self.cursor[1], self.reader[1])
+
+    def __skip(self):
+        """ 读取位置移到下一个段 (调用者持有 self.lock) """
+        index = self.reader[0]
+        if self.reading is not None and self.reading[0] == index:
+            self.__release()
+        self.reader = [index + 1, 0]
+        self.__settle()
+
+    def __mapping(self):
+        """ 读取位置所在段的映射 (调用者持有 self.lock) """
+        index = self.reader[0]
+        if index == self.index:
+            return self.map
+        if self.reading is None or self.reading[0] != index:
+            self.__release()
+            file_ = open(self.__path(index), 'rb')
+            map_ = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+            self.reading = (index, file_, map_)
+        return self.reading[2]
+
+    def __read(self):
+        """ 读取 读取位置 处的记录, 跳过已结束的段 (调用者持有 self.lock) """
+        while True:
+            index, offset = self.reader
+            if index == self.index and offset >= self.position:
+                return None
+            try:
+                map_ = self.__mapping()
+            except (IOError, OSError, ValueError):
+                self.logger.exception('Failed to open a spool segment.')
+                self.__skip()
+                continue
+            end = offset + Spool.HEAD.size
+            if end <= len(map_):
+                length, crc = Spool.HEAD.unpack_from(map_, offset)
+                if length > 0 and end + length <= len(map_):
+                    data = map_[end:end + length]
+                    if zlib.crc32(data) & 0xffffffff == crc:
+                        self.reader = [index, end + length]
+                        self.inflight.append((index, end + length))
+                        return data
+                    self.logger.warn('Skip a broken spool record.')
+            if index == self.index:
+                # 当前写入段内的记录总是完整的
+                return None
+            self.__skip()
+
+    def __sync(self):
+        """ 同步写入段到磁盘 (调用者持有 self.lock) """
+        if self.dirty > 0:
+            self.map.flush()
+            self.dirty = 0
+        self.synced = timeit.default_timer()
+
+    def __save(self):
+        """ 写入游标文件: 写入并同步临时文件后改名替换 (调用者持有 self.lock)
+        """
+        path = self.__cursor()
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(Spool.CURSOR.pack(*self.cursor))
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == 'nt' and os.path.exists(path):
+            # Windows 上改名不能覆盖已存在的文件
+            os.remove(path)
+        os.rename(temp, path)
+        self.acked = 0
+        self.saved = timeit.default_timer()
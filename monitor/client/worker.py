@@ -0,0 +1,172 @@
+# coding: utf-8
+
+""" 常驻任务线程池
+
+基本思路:
+- 线程池在 Spider 启动时创建, 由全部调度器共享, 不再每个周期创建和销毁;
+- 任务逐个提交, 提交后不再跟踪; 任务执行时直接将结果放入结果队列
+  (见 client.spider.RESULT), 每块结果完成即被处理, 不必等待最慢的任务;
+- 没有空闲线程且线程数未达上限时创建新线程; 线程空闲超过 IDLE 秒且线程数
+  多于下限时退出;
+- 上下限可在运行时通过 resize 调整;
+- 创建线程前须通过 Admission 准入, 全部线程池共享同一个线程预算,
+  线程退出时归还。
+"""
+
+import threading
+from Queue import Queue, Empty
+from config.logger import Logger
+
+
+class Admission(object):
+    """ 任务线程准入控制: 以信号量实现的全局线程预算 """
+    def __init__(self, limit):
+        """ 初始化
+
+        @param limit: 同时存在的任务线程数上限
+        @type  limit: int
+        """
+        self.limit = max(limit, 1)
+        self.semaphore = threading.BoundedSemaphore(self.limit)
+
+    def acquire(self, blocking=False):
+        """ 申请一个任务线程
+
+        @param blocking: 预算用尽时是否等待
+        @type  blocking: bool
+
+        @return: 是否申请成功
+        @rtype : bool
+        """
+        return self.semaphore.acquire(blocking)
+
+    def release(self):
+        """ 归还一个任务线程 """
+        self.semaphore.release()
+
+
+class WorkerPool(object):
+    """ 常驻任务线程池 """
+    IDLE = 60                       # 线程最长空闲时间(单位: s)
+
+    def __init__(self, minimum=1, maximum=1, admission=None):
+        """ 初始化, 立即创建 minimum 个任务线程
+
+        @param minimum: 最少任务线程数
+        @type  minimum: int
+
+        @param maximum: 最大任务线程数
+        @type  maximum: int
+
+        @param admission: 线程准入控制, None 表示只受 maximum 限制
+        @type  admission: Admission
+        """
+        self.logger = Logger.get()
+        self.admission = admission
+        self.tasks = Queue()
+        self.lock = threading.Lock()
+        self.minimum = 1
+        self.maximum = 1
+        self.workers = 0            # 任务线程数
+        self.idle = 0               # 空闲任务线程数
+        self.running = True
+        self.resize(minimum, maximum)
+
+    def resize(self, minimum, maximum):
+        """ 调整线程数的上下限, 多余的线程在空闲超时后退出 """
+        self.lock.acquire()
+        try:
+            self.minimum = max(minimum, 1)
+            self.maximum = max(maximum, self.minimum)
+            while self.workers < self.minimum:
+                if not self.__spawn():
+                    self.logger.warn('The thread budget has been used up.')
+                    break
+        finally:
+            self.lock.release()
+
+    def submit(self, target, args=()):
+        """ 提交一个任务
+
+        @param target: 任务方法
+        @type  target: function
+
+        @param args: 任务方法的参数
+        @type  args: tuple
+        """
+        self.lock.acquire()
+        try:
+            if not self.running:
+                raise RuntimeError('The worker pool has been shut down.')
+            # 待处理的任务多于空闲线程时, 在上限内创建新线程
+            if self.tasks.qsize() >= self.idle and \
+                    self.workers < self.maximum:
+                self.__spawn()
+            self.tasks.put((target, args))
+        finally:
+            self.lock.release()
+
+    def shutdown(self):
+        """ 停止接收任务, 任务线程处理完已提交的任务后退出 """
+        self.lock.acquire()
+        try:
+            self.running = False
+            for _ in xrange(self.workers):
+                self.tasks.put(None)
+        finally:
+            self.lock.release()
+
+    def __spawn(self):
+        """ 创建一个任务线程 (调用者持有 self.lock)
+
+        @return: 线程预算用尽时为 False
+        @rtype : bool
+        """
+        if self.admission is not None and not self.admission.acquire():
+            return False
+        self.workers = self.workers + 1
+        self.idle = self.idle + 1
+        worker = threading.Thread(target=self.__work)
+        worker.setDaemon(True)
+        worker.start()
+        return True
+
+    def __work(self):
+        """ 任务线程: 依次执行任务, 空闲超时且多于下限时退出 """
+        while True:
+            try:
+                task = self.tasks.get(timeout=WorkerPool.IDLE)
+            except Empty:
+                self.lock.acquire()
+                try:
+                    if self.workers > self.minimum:
+                        self.workers = self.workers - 1
+                        self.idle = self.idle - 1
+                        self.logger.info('Reap an idle worker thread.')
+                        break
+                finally:
+                    self.lock.release()
+                continue
+            if task is None:
+                self.lock.acquire()
+                try:
+                    self.workers = self.workers - 1
+                    self.idle = self.idle - 1
+                finally:
+                    self.lock.release()
+                break
+            self.__busy(-1)
+            try:
+                task[0](*task[1])
+            except Exception:
+                self.logger.exception('Failed to run a task in the pool.')
+            self.__busy(1)
+        if self.admission is not None:
+            self.admission.release()
+
+    def __busy(self, amount):
+        self.lock.acquire()
+        try:
+            self.idle = self.idle + amount
+        finally:
+            self.lock.release()
@@ -6,8 +6,10 @@ import os
 import select
 import socket
 import sys
+import threading
 import time
 import timeit
+import weakref
 
 
 class FILE(object):
@@ -73,28 +75,79 @@ class PROTO(object):
     TCP = socket.getprotobyname('tcp')
 
 
+class BUFFER(object):
+    """ socket 接收缓冲区池
+
+    基本思路:
+    - 每个 socket 持有一块预分配的 bytearray, 反复用于 recvfrom_into;
+    - socket 被回收或关闭时, 对应的缓冲区随之释放。
+    """
+    POOL = weakref.WeakKeyDictionary()
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def get(sock, size=4096):
+        """ 获取 sock 专属的接收缓冲区, 容量不足时重新分配 """
+        BUFFER.LOCK.acquire()
+        try:
+            buff = BUFFER.POOL.get(sock)
+            if buff is None or len(buff) < size:
+                buff = bytearray(size)
+                BUFFER.POOL[sock] = buff
+            return buff
+        finally:
+            BUFFER.LOCK.release()
+
+    @staticmethod
+    def free(sock):
+        """ 释放 sock 对应的接收缓冲区 """
+        BUFFER.LOCK.acquire()
+        try:
+            BUFFER.POOL.pop(sock, None)
+        finally:
+            BUFFER.LOCK.release()
+
+
 class SOCKET(object):
 
+    # Linux: setsockopt 挂载 BPF 过滤器的选项
+    SO_ATTACH_FILTER = 26
+
     @staticmethod
-    def create(ip, proto):
-        """ 创建一个socket """
+    def create(ip, proto, dgram=False):
+        """ 创建一个socket
+
+        @param dgram: ICMP 优先使用 Linux 的 ICMP 数据报套接字 (ping socket),
+                      不被允许时退回原始套接字
+        @type  dgram: bool
+        """
         try:
             from core.packet.ip import IPV
             from config.logger import Logger
             logger = Logger.get()
             sock = None
-            ipv = IPV.check(ip)
+            address = IPV.parse(ip)
+            ipv = address.version
             if ipv == IPV.ERROR:
                 error = 'Failed to create a socket due to the wrong ip: %s.'
                 logger.error(error % (ip))
                 return sock
-            addrs = socket.AF_INET if ipv == IPV.IPV4 else socket.AF_INET6
+            addrs = address.family
             if proto == PROTO.ICMP:
                 if ipv == IPV.IPV6:
                     error = 'Failed to create a socket due to the wrong ip: %s'
                     logger.error(error % (ip))
                     return None
-                sock = socket.socket(addrs, socket.SOCK_RAW, proto)
+                # ping socket 由 net.ipv4.ping_group_range 控制, 无需 root
+                if dgram and sys.platform.startswith('linux'):
+                    try:
+                        sock = socket.socket(addrs, socket.SOCK_DGRAM, proto)
+                    except socket.error:
+                        warning = 'ICMP datagram socket is not permitted, ' + \
+                                  'fall back to the raw socket.'
+                        logger.warning(warning)
+                if sock is None:
+                    sock = socket.socket(addrs, socket.SOCK_RAW, proto)
             if proto == PROTO.UDP:
                 sock = socket.socket(addrs, socket.SOCK_DGRAM, proto)
             if proto == PROTO.TCP:
@@ -106,45 +159,90 @@ class SOCKET(object):
             return None
 
     @staticmethod
-    def recvfrom(sock, timeout, size=4096):
-        """ 接收一个报文(0~4096 bytes) """
+    def attach(sock, program):
+        """ 给 socket 挂载经典 BPF 过滤器 (仅 Linux)
+
+        @param program: BPF 指令序列
+        @type  program: [(code, jt, jf, k)]
+
+        @return: 过滤器指令缓冲区(需在 socket 关闭前保持引用), 失败时为 None
+        @rtype : ctypes buffer
+        """
+        from config.logger import Logger
+        logger = Logger.get()
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            import ctypes
+            import struct
+            insns = ''.join([struct.pack('HBBI', *x) for x in program])
+            insns = ctypes.create_string_buffer(insns, len(insns))
+            # struct sock_fprog { unsigned short len; sock_filter *filter; }
+            fprog = struct.pack('HL', len(program), ctypes.addressof(insns))
+            sock.setsockopt(socket.SOL_SOCKET, SOCKET.SO_ATTACH_FILTER, fprog)
+            logger.info('Successfully attach a bpf filter.')
+            return insns
+        except Exception:
+            logger.exception('Failed to attach a bpf filter.')
+            return None
+
+    @staticmethod
+    def recvfrom(sock, timeout, size=4096, view=False):
+        """ 接收一个报文(0~size bytes)
+
+        @param view: 返回 socket 缓冲区的 memoryview (仅在下一次接收前有效),
+                     否则返回报文的 bytes 拷贝
+        @type  view: bool
+
+        @return: (接收时间, 报文)
+        @rtype : (double, bytes/memoryview)
+        """
+        return SOCKET.receive(sock, timeout, size, view)[0:2]
+
+    @staticmethod
+    def receive(sock, timeout, size=4096, view=False):
+        """ 接收一个报文(0~size bytes), 同时返回发送方地址
+
+        @return: (接收时间, 报文, 发送方地址)
+        @rtype : (double, bytes/memoryview, tuple)
+        """
         from config.logger import Logger
         logger = Logger.get()
         if timeout < 0:
             logger.warning('Waiting for the packet timeout.')
-            return (-4, None)
+            return (-4, None, None)
         try:
             readable = select.select([sock], [], [], timeout)[0]
         except Exception:
             logger.exception('Failed to receive a packet.')
-            return (-2, None)
+            return (-2, None, None)
         if len(readable) == 0:
             logger.warning('Waiting for the packet timeout.')
-            return (-4, None)
+            return (-4, None, None)
 
         # 参考: https://stackoverflow.com/questions/52288283
-        byte_stream = bytearray(size)
+        # 接收到 socket 专属的缓冲区, 避免每次接收都重新分配
+        byte_stream = BUFFER.get(sock, size)
         nbytes = 0
         recv_time = 0
         try:
-            nbytes, addr = sock.recvfrom_into(byte_stream)
+            nbytes, addr = sock.recvfrom_into(byte_stream, size)
             if nbytes == 0:
                 logger.warning('...the socket abnormal closed...')
-                return (-1, None)
+                return (-1, None, None)
             recv_time = timeit.default_timer()
             logger.info('Successfully receive a packet %d bytes.' % nbytes)
         except Exception:
             logger.exception('Failed to receive a packet.')
-            return (-3, None)
-        packet = ''
-        for i in range(nbytes):
-            packet = packet + chr(byte_stream[i])
-        return (recv_time, packet)
+            return (-3, None, None)
+        packet = memoryview(byte_stream)[:nbytes]
+        return (recv_time, packet if view else packet.tobytes(), addr)
 
     @staticmethod
     def close(sock):
         """ 关闭一个 socket """
         if sock is not None:
+            BUFFER.free(sock)
             sock.close()
         return None
 
@@ -16,13 +16,13 @@ class LOG(object):
     LOWEST = 10
     OPEN_CONS = False
     OPEN_FILE = False
+    LOCK = threading.RLock()
 
     @staticmethod
     def load(filename='base.conf'):
         """ 加载运行日志配置文件 """
         filepath = FILE.conf(filename)
-        lock = threading.Lock()
-        lock.acquire()
+        LOG.LOCK.acquire()
         try:
             LOG.PARSER.read(filepath)
             LOG.CONSOLE = LOG.PARSER.getint('logger', 'console')
@@ -33,7 +33,7 @@ class LOG(object):
         except Exception:
             print 'Please check your logger configure file.'
         finally:
-            lock.release()
+            LOG.LOCK.release()
 
 
 def static_logger(**kwargs):
@@ -105,18 +105,18 @@ def getLogger(name='', FIN=False):
 class Logger(object):
     """ 注册域名 与 获取logger """
     RECORDS = {}    # 记录已注册的 tid: domain
+    LOCK = threading.RLock()
 
     @staticmethod
     def sign_up(domain):
         """ 一个 tid 只能注册一次 """
         tid = thread.get_ident()
-        lock = threading.Lock()
-        lock.acquire()
+        Logger.LOCK.acquire()
         try:
             if tid not in Logger.RECORDS.keys():
                 Logger.RECORDS[tid] = domain
         finally:
-            lock.release()
+            Logger.LOCK.release()
 
     @staticmethod
     def log_out(FIN=False):
@@ -126,14 +126,13 @@ class Logger(object):
         @type  FIN: bool
         """
         tid = thread.get_ident()
-        lock = threading.Lock()
-        lock.acquire()
+        Logger.LOCK.acquire()
         try:
             if tid in Logger.RECORDS.keys():
                 getLogger(Logger.RECORDS[tid], FIN=FIN)
                 Logger.RECORDS.pop(tid)
         finally:
-            lock.release()
+            Logger.LOCK.release()
 
     @staticmethod
     def get():
@@ -143,15 +142,7 @@ class Logger(object):
         - 根据当前的 tid 从 RECORDS 中获取 domain;
         - 根据 domain 从 getLogger 获取 logger
         - 若不存在对应的 domain, 则默认返回 MAIN 对应的 logger
+        - 只读取 RECORDS, 单次 dict 读取是原子的, 无需加锁
         """
-        tid = thread.get_ident()
-        lock = threading.Lock()
-        lock.acquire()
-        try:
-            if tid in Logger.RECORDS.keys():
-                domain = Logger.RECORDS[tid]
-                return getLogger(domain)
-            else:
-                return getLogger('MAIN')
-        finally:
-            lock.release()
+        domain = Logger.RECORDS.get(thread.get_ident(), 'MAIN')
+        return getLogger(domain)
@@ -9,6 +9,7 @@ import re
 import socket
 import threading
 from config.constant import FILE, JSON
+from core.packet.dns import QueryTemplate
 from core.packet.ip import IPV
 
 
@@ -18,27 +19,27 @@ class RUNTIME(object):
     CHECK_LIST = []
     ID = -1
     RUNNING = True                                      # 运行状态
-    THREADS = 0                                         # 活跃任务线程数
+    LOCK = threading.RLock()
 
     @staticmethod
     def load():
         """ 加载运行时数据存储文件 """
-        lock = threading.Lock()
-        lock.acquire()
+        RUNTIME.LOCK.acquire()
         try:
             with open(RUNTIME.FILEPATH, 'r') as f:
                 data = json.load(f)
                 RUNTIME.CHECK_LIST = data.get('default_check_list', [])
                 RUNTIME.CHECK_LIST = map(str, RUNTIME.CHECK_LIST)
                 RUNTIME.ID = data.get('id', -1)
+            # 检测域名列表已重新加载, 清除全部 DNS 查询报文模板
+            QueryTemplate.invalidate()
         finally:
-            lock.release()
+            RUNTIME.LOCK.release()
 
     @staticmethod
     def update():
         """ 更新运行数据存储文件 """
-        lock = threading.Lock()
-        lock.acquire()
+        RUNTIME.LOCK.acquire()
         try:
             with open(RUNTIME.FILEPATH, 'w') as f:
                 data = {
@@ -47,56 +48,54 @@ class RUNTIME(object):
                 }
                 json.dump(data, f, sort_keys=JSON.SORT, indent=JSON.INDENT)
         finally:
-            lock.release()
+            RUNTIME.LOCK.release()
 
     @staticmethod
     def add(domain):
         """ 往 CHECK_LIST 中添加一个域名 """
-        lock = threading.Lock()
-        lock.acquire()
+        RUNTIME.LOCK.acquire()
         try:
             if domain in {None, ''}:
                 return False
             if domain not in RUNTIME.CHECK_LIST:
                 RUNTIME.CHECK_LIST.append(domain)
+                QueryTemplate.invalidate(domain)
                 return True
             return False
         finally:
-            lock.release()
+            RUNTIME.LOCK.release()
 
     @staticmethod
     def delete(domain):
         """ 往 CHECK_LIST 中删除一个域名 """
-        lock = threading.Lock()
-        lock.acquire()
+        RUNTIME.LOCK.acquire()
         try:
             if domain in {None, ''}:
                 return False
             if domain in RUNTIME.CHECK_LIST:
                 RUNTIME.CHECK_LIST.remove(domain)
+                QueryTemplate.invalidate(domain)
                 return True
             return False
         finally:
-            lock.release()
+            RUNTIME.LOCK.release()
 
     @staticmethod
     def id(id_):
         """ 修改 客户端 ID """
-        lock = threading.Lock()
-        lock.acquire()
+        RUNTIME.LOCK.acquire()
         try:
             RUNTIME.ID = id_
         finally:
-            lock.release()
+            RUNTIME.LOCK.release()
 
     @staticmethod
     def running(status):
-        lock = threading.Lock()
-        lock.acquire()
+        RUNTIME.LOCK.acquire()
         try:
             RUNTIME.RUNNING = status
         finally:
-            lock.release()
+            RUNTIME.LOCK.release()
 
     @staticmethod
     def end():
@@ -157,14 +156,14 @@ class CLIENT(object):
     OS = platform.system()
     IP = ip()
     DNS = dns()
+    LOCK = threading.RLock()
 
     @staticmethod
     def update():
-        lock = threading.Lock()
-        lock.acquire()
+        CLIENT.LOCK.acquire()
         try:
             CLIENT.OS = platform.system()
             CLIENT.IP = ip()
             CLIENT.DNS = dns()
         finally:
-            lock.release()
+            CLIENT.LOCK.release()
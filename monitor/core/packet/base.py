@@ -1,19 +1,91 @@
 # coding: utf-8
 """ 网络报文解析常量: 值 和 函数 """
 
+import array
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _fold(chk_sum):
+    """ 将累加和折叠为 16 位反码和 """
+    while chk_sum >> 16:
+        chk_sum = (chk_sum >> 16) + (chk_sum & 0xffff)
+    return chk_sum
+
+
+def _native(chk_sum):
+    """ 主机字节序的 16 位反码和转换为网络字节序
+
+    反码和与字节序无关 (RFC 1071), 按主机字节序一次累加后交换结果即可。
+    """
+    if sys.byteorder == 'little':
+        chk_sum = ((chk_sum >> 8) | (chk_sum << 8)) & 0xffff
+    return chk_sum
+
 
 def do_check_sum(packet):
-    """ 计算网络数据报文的校验和 """
-    if not isinstance(packet, str):
+    """ 计算网络数据报文的校验和 (Internet Checksum, RFC 1071)
+
+    @param packet: 网络数据报文
+    @type  packet: str/bytearray/memoryview
+
+    @return: 校验和, 类型错误时为 0
+    @rtype : int
+    """
+    if isinstance(packet, memoryview):
+        packet = packet.tobytes()
+    elif isinstance(packet, bytearray):
+        packet = str(packet)
+    elif not isinstance(packet, str):
         return 0
-    packet = packet if len(packet) % 2 == 0 else packet + chr(0)
-    chk_sum = 0
-    location = 0
-    while location < len(packet):
-        # 将报文 划分成多个 16 位 的片段
-        value = (ord(packet[location]) << 8) + ord(packet[location + 1])
-        chk_sum = chk_sum + value
-        location = location + 2
-    chk_sum = (chk_sum >> 16) + (chk_sum & 0xffff)
-    chk_sum = (chk_sum >> 16) + chk_sum
-    return ~chk_sum & 0xffff
+    if len(packet) % 2 != 0:
+        packet = packet + '\x00'
+    # 将报文 一次性划分成多个 16 位 的片段
+    words = array.array('H')
+    words.fromstring(packet)
+    return ~_native(_fold(sum(words))) & 0xffff
+
+
+def verify_check_sum(packet):
+    """ 校验接收报文 (如 IP 首部, ICMP 报文) 的校验和
+
+    包含校验和字段在内的整个报文的反码和为 0xffff 时, 校验和正确。
+
+    @rtype : bool
+    """
+    return len(packet) > 0 and do_check_sum(packet) == 0
+
+
+def do_check_sums(packets):
+    """ 批量计算多个报文的校验和
+
+    安装了 NumPy 且报文等长时, 将全部报文排成矩阵一次完成计算;
+    否则逐个调用 do_check_sum。
+
+    @param packets: 网络数据报文
+    @type  packets: [str/bytearray/memoryview]
+
+    @return: 每个报文的校验和
+    @rtype : [int]
+    """
+    lengths = set([len(x) for x in packets])
+    if numpy is None or len(lengths) != 1 or len(packets) < 2:
+        return [do_check_sum(x) for x in packets]
+    length = lengths.pop()
+    data = ''.join([x.tobytes() if isinstance(x, memoryview) else str(x)
+                    for x in packets])
+    if length % 2 != 0:
+        # 逐行补齐一个字节
+        rows = numpy.frombuffer(data, dtype=numpy.uint8)
+        rows = rows.reshape(len(packets), length)
+        pad = numpy.zeros((len(packets), 1), dtype=numpy.uint8)
+        data = numpy.hstack((rows, pad)).tostring()
+        length = length + 1
+    words = numpy.frombuffer(data, dtype='>u2')
+    words = words.reshape(len(packets), length // 2)
+    sums = words.sum(axis=1, dtype=numpy.uint64)
+    return [~_fold(int(x)) & 0xffff for x in sums]
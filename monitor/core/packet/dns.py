@@ -4,14 +4,141 @@
 由于 socket.recvfrom() 方法接收的数据存在问题, 暂停解析 DNS 报文的工作
 """
 
+import socket
 import struct
+import threading
 from config.logger import Logger
 
 
+def ntop6(packed):
+    """ 将 16 字节的 IPv6 地址转换为字符串
+
+    Windows 下的 Python 2 没有 socket.inet_ntop, 此时输出不压缩的形式。
+    """
+    if hasattr(socket, 'inet_ntop'):
+        return socket.inet_ntop(socket.AF_INET6, packed)
+    return ':'.join(['%x' % x for x in struct.unpack('!8H', packed)])
+
+
+class DomainCodec(object):
+    """ DNS 报文中域名的编码/解码
+
+    基本思路:
+    - 以 memoryview 引用整个报文, 每个标签直接按切片取出, 不逐字节拼接;
+    - 以偏移量缓存已解码的域名(后缀), 压缩指针再次指向同一位置时直接复用;
+    - 限制指针跳转次数和域名总长度, 畸形或截断的报文只会解析失败,
+      不会造成死循环。
+    """
+    MAX_HOPS = 32                   # 单个域名允许的最多指针跳转次数
+    MAX_LENGTH = 255                # 域名编码后的最大长度 (RFC 1035)
+
+    def __init__(self, packet):
+        """ 初始化
+
+        @param packet: 完整的 DNS 报文 (压缩指针的偏移量以报文头部为起点)
+        @type  packet: string/memoryview
+        """
+        self.packet = packet if isinstance(packet, memoryview) \
+            else memoryview(packet)
+        self.cache = {}             # 偏移量: 从该偏移量开始的域名
+
+    @staticmethod
+    def encode(domain):
+        """ 将域名编码为 DNS 报文格式 (不压缩)
+
+        @param domain: 域名
+        @type  domain: string
+
+        @return: 二进制域名, 以 0 字节结尾
+        @rtype : string
+        """
+        nodes = [x for x in domain.split('.') if len(x) > 0]
+        return ''.join([chr(len(x)) + x for x in nodes]) + '\x00'
+
+    def decode(self, offset):
+        """ 解码报文中 offset 处的域名
+
+        @param offset: 偏移量
+        @type  offset: int
+
+        @return: (报文中域名占用字节数, 域名), 失败时为 (-1, None);
+                 根域名为 ''
+        @rtype : (int, string)
+        """
+        packet = self.packet
+        size = len(packet)
+        length = -1         # 域名在原位置占用的字节数 (遇到第一个指针时确定)
+        hops = 0            # 指针跳转次数
+        total = 0           # 已解码的编码长度
+        starts = []         # 各标签的起始偏移量
+        labels = []         # 各标签
+        suffix = None       # 从缓存中得到的后缀
+        begin = offset
+        while True:
+            if offset in self.cache:
+                suffix = self.cache[offset]
+                if length == -1:
+                    length = offset - begin
+                    # 缓存命中时仍需确定原位置占用的字节数
+                    length = length + self.skip(offset)
+                break
+            if offset >= size:
+                return (-1, None)
+            node = ord(packet[offset])
+            if node & 0xc0 == 0xc0:
+                # 压缩指针: 高 2 位为 1, 其余 14 位为偏移量
+                if offset + 1 >= size or hops >= DomainCodec.MAX_HOPS:
+                    return (-1, None)
+                if length == -1:
+                    length = offset + 2 - begin
+                hops = hops + 1
+                offset = ((node & 0x3f) << 8) | ord(packet[offset + 1])
+                continue
+            if node & 0xc0 != 0:
+                # 0x40/0x80 为保留的标签类型
+                return (-1, None)
+            if node == 0:
+                if length == -1:
+                    length = offset + 1 - begin
+                suffix = ''
+                break
+            total = total + node + 1
+            if offset + 1 + node > size or total > DomainCodec.MAX_LENGTH:
+                return (-1, None)
+            starts.append(offset)
+            labels.append(packet[offset + 1:offset + 1 + node].tobytes())
+            offset = offset + 1 + node
+        # 缓存每个标签开始的后缀域名
+        for i in xrange(len(labels) - 1, -1, -1):
+            suffix = labels[i] if suffix == '' else labels[i] + '.' + suffix
+            self.cache[starts[i]] = suffix
+        return (length, suffix)
+
+    def skip(self, offset):
+        """ 计算 offset 处的域名在原位置占用的字节数 (不解码, 不跟随指针)
+
+        @return: 占用字节数, 越界时为 -1
+        @rtype : int
+        """
+        packet = self.packet
+        size = len(packet)
+        begin = offset
+        while offset < size:
+            node = ord(packet[offset])
+            if node & 0xc0 == 0xc0:
+                return offset + 2 - begin if offset + 1 < size else -1
+            if node & 0xc0 != 0:
+                return -1
+            if node == 0:
+                return offset + 1 - begin
+            offset = offset + 1 + node
+        return -1
+
+
 def get_domain(packet, offset):
     """ 获取 DNS报文 中问题/资源段的域名
 
-    @param packet: 以问题区域为开始的报文段
+    @param packet: 完整的 DNS 报文
     @type  packet: string
 
     @param offset: 偏移量
@@ -20,60 +147,7 @@ def get_domain(packet, offset):
     @return: (报文中域名占用字节数, 域名)
     @rtype : (int, string)
     """
-    logger = Logger.get()
-    length = 0          # 总长度
-    node = 0            # 每一段的长度
-    domain = None       # 域名
-    point = False       # 是否为指针
-    first_skip = True   # 是否为第一次跳转
-
-    def is_point(byte):
-        """ 识别 偏移指针 """
-        return (ord(byte) | 0x3f) == 0xff
-
-    def skip(location):
-        """ 指针跳转
-
-        @param location: 表示偏移指针的两个字节
-        @type  location: [byte, byte]
-        """
-        return (ord(location[0]) & 0x3f << 8) + (ord(location[1]) & 0xff)
-    while True:
-        if node == 0:
-            if len(packet) <= offset:
-                m_a = 'The offset %d bytes' % (offset)
-                m_b = 'beyonds the packet length %d bytes.' % (len(packet))
-                logger.debug(m_a + m_b)
-                return (-1, None)
-            if is_point(packet[offset]):
-                point = True
-                offset = skip(packet[offset: offset + 2])
-                logger.debug('The pointer jumps to %dth byte.' % (offset))
-            node = struct.unpack('!B', packet[offset])[0]
-            # 当识别为指针时, 则该段实际所占长度为 2 bytes
-            # 可能会存在递归指针跳转, 实际所占长度为第一次跳转时的长度
-            if point and first_skip:
-                length = length + 2
-                first_skip = False
-                logger.debug('The 1th pointer jump occurred.')
-            # 如果不是指针, 则加上每一段的长度
-            if not point:
-                length = length + node + 1
-            offset = offset + 1
-            if node == 0:
-                debug = 'Return —— length: %d, domain: %s' % (length, domain)
-                logger.debug(debug)
-                return (length, domain)
-            domain = '' if domain is None else domain + '.'
-        else:
-            if len(packet) <= offset:
-                m_a = 'The offset %d bytes' % (offset)
-                m_b = 'beyonds the packet length %d bytes.' % (len(packet))
-                logger.debug(m_a + m_b)
-                return (-1, None)
-            domain = domain + struct.unpack('!s', packet[offset])[0]
-            offset = offset + 1
-            node = node - 1
+    return DomainCodec(packet).decode(offset)
 
 
 class DNStatus(object):
@@ -114,8 +188,8 @@ class QueryType(object):
 
 class Question(object):
     """ DNS 报文问题区域 —— Only One Question"""
-    def __init__(self):
-        self.logger = Logger.get()
+    def __init__(self, logger=None):
+        self.logger = Logger.get() if logger is None else logger
         self.domain = None          # 域名(长度不定)
         self.Type = QueryType.A     # 查询类型 (16 bit)
         self.Class = 1              # 查询类 (16 bit)
@@ -143,18 +217,11 @@ class Question(object):
         if self.domain is None:
             return
 
-        def pack(x):
-            if len(x) == 0:
-                return ''
-            f = '!b' + str(len(x)) + 's'
-            return struct.pack(f, len(x), x)
-
-        nodes = map(pack, self.domain.split('.'))
-        p_nodes = reduce(lambda x, y: x + y, nodes)
-        self.packet = p_nodes + struct.pack('!bHH', 0, self.Type, self.Class)
+        self.packet = DomainCodec.encode(self.domain) + \
+            struct.pack('!HH', self.Type, self.Class)
         self.length = len(self.packet)
 
-    def analysis(self, packet, offset):
+    def analysis(self, packet, offset, codec=None):
         """ 解析 DNS 报文问题区域
 
         @param packet: 以问题区域为开始的报文段
@@ -163,14 +230,21 @@ class Question(object):
         @param Offset: 偏移量
         @type  Offset: int
 
+        @param codec: 报文共享的域名解码器
+        @type  codec: DomainCodec
+
         @return: 下一个区域的起始偏移量
         @rtype : int
         """
-        length, self.domain = get_domain(packet, offset)
+        codec = DomainCodec(packet) if codec is None else codec
+        length, self.domain = codec.decode(offset)
         if self.domain is None:
             self.logger.info('Failed to get the domain in the question area.')
             return -1
         offset = offset + length
+        if offset + 4 > len(packet):
+            self.logger.info('The question area is truncated.')
+            return -1
         self.Type, self.Class = struct.unpack('!HH', packet[offset:offset + 4])
         self.length = length + 4
         return offset + 4
@@ -185,19 +259,33 @@ class Question(object):
 
 
 class Resource(object):
-    """ DNS 回答报文资源记录区域 """
+    """ DNS 回答报文资源记录区域
+
+    基本思路:
+    - analysis 只确定记录的边界, 解析定长字段 (类型, 类, TTL, 数据长度);
+    - 域名 domain 和数据 data 在第一次访问时才解码, 之后缓存在对象中;
+    - 数据的解码结果:
+        A/AAAA    => ip 字符串
+        CNAME/NS  => 域名
+        SOA       => dict (mname, rname, serial, refresh, retry, expire,
+                           minimum)
+        其他类型  => None
+    """
+    SOA_FORMAT = struct.Struct('!IIIII')
 
-    def __init__(self):
-        self.logger = Logger.get()
-        self.domain = None
+    def __init__(self, logger=None):
+        self.logger = Logger.get() if logger is None else logger
         self.Type = QueryType.A
         self.Class = 1
         self.ttl = 0
         self.data_length = 0
-        self.data = None
+        self.offset = 0             # 域名的偏移量
+        self.data_offset = 0        # 数据的偏移量
+        self.codec = None           # 报文共享的域名解码器
+        self.cache = {}             # 已解码的 domain/data
 
-    def analysis(self, packet, offset):
-        """ 解析 DNS 回答报文资源记录区域
+    def analysis(self, packet, offset, codec=None):
+        """ 索引 DNS 回答报文资源记录区域
 
         @param packet: 以问题区域为开始的报文段
         @type  packet: string
@@ -205,32 +293,76 @@ class Resource(object):
         @param Offset: 偏移量
         @type  Offset: int
 
+        @param codec: 报文共享的域名解码器
+        @type  codec: DomainCodec
+
         @return: 下一个区域的起始偏移量
         @rtype : int
         """
-        #  解析域名
-
-        length, self.domain = get_domain(packet, offset)
-        if self.domain is None:
+        self.codec = DomainCodec(packet) if codec is None else codec
+        self.cache = {}
+        self.offset = offset
+        #  跳过域名
+        length = self.codec.skip(offset)
+        if length == -1:
             self.logger.warning('Failed to get the domain ' +
                                 'in the resource area.')
             return -1
         offset = offset + length
+        if offset + 10 > len(packet):
+            self.logger.warning('The resource area is truncated.')
+            return -1
         self.Type, self.Class, self.ttl, self.data_length = struct.unpack(
             '!HHIH', packet[offset:offset + 10]
         )
         offset = offset + 10
-        if self.Type == QueryType.A:
-            def pack(x, y):
-                return str(x) + '.' + str(y)
-            self.data = reduce(pack, struct.unpack(
-                '!BBBB', packet[offset:offset + 4]
-            ))
-        elif self.Type == QueryType.CNAME:
-            length, self.data = get_domain(packet, offset)
-
+        if offset + self.data_length > len(packet):
+            self.logger.warning('The resource data is truncated.')
+            return -1
+        self.data_offset = offset
         return offset + self.data_length
 
+    @property
+    def domain(self):
+        if 'domain' not in self.cache:
+            self.cache['domain'] = self.codec.decode(self.offset)[1]
+        return self.cache['domain']
+
+    @property
+    def data(self):
+        if 'data' not in self.cache:
+            self.cache['data'] = self.__decode()
+        return self.cache['data']
+
+    def __decode(self):
+        """ 解码资源数据 """
+        packet = self.codec.packet
+        offset = self.data_offset
+        raw = packet[offset:offset + self.data_length].tobytes()
+        if self.Type == QueryType.A and self.data_length == 4:
+            return socket.inet_ntoa(raw)
+        if self.Type == QueryType.AAAA and self.data_length == 16:
+            return ntop6(raw)
+        if self.Type in {QueryType.CNAME, QueryType.NS}:
+            return self.codec.decode(offset)[1]
+        if self.Type == QueryType.SOA:
+            length, mname = self.codec.decode(offset)
+            if mname is None:
+                return None
+            offset = offset + length
+            length, rname = self.codec.decode(offset)
+            offset = offset + length
+            end = self.data_offset + self.data_length
+            if rname is None or offset + Resource.SOA_FORMAT.size > end:
+                return None
+            values = Resource.SOA_FORMAT.unpack_from(packet, offset)
+            keys = ['serial', 'refresh', 'retry', 'expire', 'minimum']
+            soa = dict(zip(keys, values))
+            soa['mname'] = mname
+            soa['rname'] = rname
+            return soa
+        return None
+
     def json(self):
         return {
             'domain': self.domain,
@@ -254,7 +386,9 @@ class DNS(object):
         self.au = 0             # 权威总数  (16 bit)
         self.ad = 0             # 附加总数  (16 bit)
         self.question = None
-        self.answers = []
+        self.answers = []       # 回答区域
+        self.authorities = []   # 权威区域
+        self.additionals = []   # 附加区域
         self.logger = Logger.get()
 
     def construct(self, domain=None, ID=0, Flag=256, An=0, Au=0, Ad=0):
@@ -298,40 +432,135 @@ class DNS(object):
             self.header_format, packet[0:offset]
         )
         # 解析 问题区域
-        self.question = Question()
-        offset = self.question.analysis(packet, offset)
+        codec = DomainCodec(packet)
+        self.question = Question(self.logger)
+        offset = self.question.analysis(packet, offset, codec)
         if offset == -1:
             self.logger.warning('Failed to analysis the question area.')
             return False
-        # 解析 回答区域
-        self.answers = []
-        for i in range(self.an):
-            answer = Resource()
-            offset = answer.analysis(packet, offset)
+        # 索引 回答/权威/附加区域, 记录的数据在访问时才解码
+        sections = []
+        for name, count in [('answer', self.an), ('authority', self.au),
+                            ('additional', self.ad)]:
+            records = []
+            for i in xrange(count):
+                record = Resource(self.logger)
+                offset = record.analysis(packet, offset, codec)
+                if offset == -1:
+                    warning = 'Failed to analysis the %dth %s area'
+                    self.logger.warning(warning % (i, name))
+                    break
+                records.append(record)
+            sections.append(records)
             if offset == -1:
-                warning = 'Failed to analysis the %dth answer area' % (i)
-                self.logger.warning(warning)
-                return False
-            self.answers.append(answer)
-        # 解析 权威区域
-        # 解析 附加信息
+                break
+        sections = sections + [[] for _ in xrange(3 - len(sections))]
+        self.answers, self.authorities, self.additionals = sections
+        if len(self.answers) != self.an:
+            # 权威/附加区域不完整时, 仍保留已索引的记录
+            return False
         self.logger.info('Successfully analysis the dns response packet.')
         return True
 
     def rcode(self):
         return (self.flag & 0xf)
 
+    def ttl(self):
+        """ 回答区域中最小的 TTL(单位: s), 无回答时为 0 """
+        if len(self.answers) == 0:
+            return 0
+        return min([x.ttl for x in self.answers])
+
+    def records(self):
+        """ 依次迭代 回答/权威/附加区域 的全部资源记录 """
+        for section in [self.answers, self.authorities, self.additionals]:
+            for record in section:
+                yield record
+
     def answer(self, Type):
         """ 获取 回答区域 的数据
         @param Type: 请求类型
         @type  Type: core.packet.dns.QueryType
         """
+        return self.__select(self.answers, Type)
+
+    def authority(self, Type):
+        """ 获取 权威区域 的数据 (如 NS, SOA), 用于诊断域名授权问题 """
+        return self.__select(self.authorities, Type)
+
+    def additional(self, Type):
+        """ 获取 附加区域 的数据 (如 NS 对应的 A/AAAA) """
+        return self.__select(self.additionals, Type)
+
+    def __select(self, records, Type):
+        """ 解码 records 中类型为 Type 的记录数据 """
         result = []
         try:
-            result = filter(lambda x: x.Type == Type, self.answers)
-            result = map(lambda x: x.data, result)
+            result = [x.data for x in records if x.Type == Type]
         except Exception:
-            self.logger.info('The type of answers is: %s' % type(self.answers))
+            self.logger.info('The type of records is: %s' % type(records))
             self.logger.exception('Failed to get answer about %d.' % Type)
         finally:
             return result
+
+
+class QueryTemplate(object):
+    """ DNS 查询报文模板
+
+    基本思路:
+    - 每个 (域名, 查询类型) 只完整构建一次查询报文, 存放在预分配的缓冲区中;
+    - 每次发送只写入新的会话标识 (报文的前 2 个字节);
+    - 检测域名列表变化时调用 invalidate 清除不再需要的模板。
+    """
+    TEMPLATES = {}                  # (域名, 查询类型): QueryTemplate
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def get(domain, Type=QueryType.A):
+        """ 获取 (domain, Type) 对应的报文模板, 不存在时创建 """
+        QueryTemplate.LOCK.acquire()
+        try:
+            key = (domain, Type)
+            template = QueryTemplate.TEMPLATES.get(key)
+            if template is None:
+                template = QueryTemplate(domain, Type)
+                QueryTemplate.TEMPLATES[key] = template
+            return template
+        finally:
+            QueryTemplate.LOCK.release()
+
+    @staticmethod
+    def invalidate(domain=None):
+        """ 清除 domain 的全部模板, domain 为 None 时清除所有模板 """
+        QueryTemplate.LOCK.acquire()
+        try:
+            if domain is None:
+                QueryTemplate.TEMPLATES.clear()
+                return
+            for key in QueryTemplate.TEMPLATES.keys():
+                if key[0] == domain:
+                    del QueryTemplate.TEMPLATES[key]
+        finally:
+            QueryTemplate.LOCK.release()
+
+    def __init__(self, domain, Type=QueryType.A):
+        dns = DNS()
+        header = struct.pack(dns.header_format, 0, dns.flag, dns.qa,
+                             0, 0, 0)
+        question = Question(dns.logger)
+        question.construct(domain, Type)
+        self.packet = bytearray(header + question.packet)
+        self.lock = threading.Lock()
+
+    def construct(self, ID=0):
+        """ 构建会话标识为 ID 的查询报文
+
+        @return: 二进制DNS查询报文
+        @rtype : string
+        """
+        self.lock.acquire()
+        try:
+            struct.pack_into('!H', self.packet, 0, ID & 0xffff)
+            return str(self.packet)
+        finally:
+            self.lock.release()
@@ -1,8 +1,9 @@
 # coding: utf-8
 
 import struct
+import threading
 
-from core.packet.base import do_check_sum
+from core.packet.base import do_check_sum, verify_check_sum
 from config.logger import Logger
 
 
@@ -61,6 +62,25 @@ class ICMP(object):
         self.logger.info('Successfully construct a icmp query packet.')
         return self.icmp
 
+    @staticmethod
+    def bpf(ID):
+        """ 经典 BPF 过滤器: 只接收标识符为 ID 的回送回答报文
+
+        适用于 IPv4 原始套接字, 过滤器看到的报文以 IP 首部开始。
+
+        @return: BPF 指令序列
+        @rtype : [(code, jt, jf, k)]
+        """
+        return [
+            (0xb1, 0, 0, 0x00000000),   # ldxb 4*([0]&0xf)  X = IP首部长度
+            (0x50, 0, 0, 0x00000000),   # ldb  [x+0]        类型
+            (0x15, 0, 3, TYPE.ECHO_REPLY),  # jeq #0        否则丢弃
+            (0x48, 0, 0, 0x00000004),   # ldh  [x+4]        标识符
+            (0x15, 0, 1, ID & 0xffff),  # jeq  #ID          否则丢弃
+            (0x06, 0, 0, 0x0000ffff),   # ret  #65535       接收
+            (0x06, 0, 0, 0x00000000),   # ret  #0           丢弃
+        ]
+
     def analysis(self, icmp):
         """ 解析 ICMP 报文 """
         self.logger.info('Start to analysis the icmp echo reply packet.')
@@ -72,5 +92,65 @@ class ICMP(object):
             self.format, icmp_header
         )
         self.data = icmp[8:]
+        self.icmp = icmp
         self.logger.info('Successfully analysis the icmp echo reply packet.')
         return True
+
+    def verify(self):
+        """ 校验已解析报文的检验和 (覆盖 ICMP 首部和数据) """
+        return verify_check_sum(self.icmp)
+
+
+class EchoTemplate(object):
+    """ ICMP 回送请求报文模板
+
+    基本思路:
+    - 每个 (标识符, 数据) 只完整构建一次回送请求报文, 存放在预分配的缓冲区中;
+    - 每次发送只写入新的序列号, 并按 RFC 1624 增量更新检验和:
+        HC' = ~(~HC + ~m + m')
+      其中 m, m' 分别为修改前后的序列号, 无需重新计算整个报文的检验和。
+    """
+    TEMPLATES = {}                  # (标识符, 数据): EchoTemplate
+    LOCK = threading.Lock()
+
+    @staticmethod
+    def get(ID=0, Data=''):
+        """ 获取 (ID, Data) 对应的报文模板, 不存在时创建 """
+        EchoTemplate.LOCK.acquire()
+        try:
+            key = (ID & 0xffff, Data)
+            template = EchoTemplate.TEMPLATES.get(key)
+            if template is None:
+                template = EchoTemplate(ID, Data)
+                EchoTemplate.TEMPLATES[key] = template
+            return template
+        finally:
+            EchoTemplate.LOCK.release()
+
+    def __init__(self, ID=0, Data=''):
+        icmp = ICMP()
+        icmp.construct(Type=TYPE.ECHO_REQUEST, ID=ID, Seq=0, Data=Data)
+        self.packet = bytearray(icmp.icmp)
+        self.chk_sum = icmp.chk_sum
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def construct(self, Seq=0):
+        """ 构建序列号为 Seq 的回送请求报文
+
+        @return: ICMP 回送请求报文
+        @rtype : string
+        """
+        Seq = Seq & 0xffff
+        self.lock.acquire()
+        try:
+            chk_sum = (~self.chk_sum & 0xffff) + (~self.seq & 0xffff) + Seq
+            chk_sum = (chk_sum >> 16) + (chk_sum & 0xffff)
+            chk_sum = (chk_sum >> 16) + chk_sum
+            self.chk_sum = ~chk_sum & 0xffff
+            self.seq = Seq
+            struct.pack_into('!H', self.packet, 2, self.chk_sum)
+            struct.pack_into('!H', self.packet, 6, self.seq)
+            return str(self.packet)
+        finally:
+            self.lock.release()
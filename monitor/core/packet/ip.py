@@ -2,8 +2,11 @@
 
 """ 定义 IP 数据报 """
 import re
+import socket
 import struct
+import threading
 from config.constant import FILE
+from core.packet.base import verify_check_sum
 
 
 def regex(filename):
@@ -12,6 +15,17 @@ def regex(filename):
         return re.compile(f.readline().strip())
 
 
+class Address(object):
+    """ 解析后的 IP 地址 """
+    __slots__ = ('ip', 'version', 'family', 'packed')
+
+    def __init__(self, ip, version=0, family=None, packed=None):
+        self.ip = ip                # 地址字符串
+        self.version = version      # IPV
+        self.family = family        # socket.AF_INET/socket.AF_INET6
+        self.packed = packed        # 网络字节序的地址 (4/16 bytes)
+
+
 class IPV(object):
     """ IP Version """
     ERROR = 0       # ip 格式错误
@@ -21,6 +35,11 @@ class IPV(object):
     IPV4_REGEX = regex('ipv4.regex')    # ipv4_regex
     IPV6_REGEX = regex('ipv6.regex')    # ipv6_regex
 
+    SIZE = 4096                         # 最多缓存的解析结果数
+    RECENT = {}                         # 最近使用的解析结果 ip: Address
+    OLD = {}                            # 上一代的解析结果 ip: Address
+    LOCK = threading.Lock()
+
     @staticmethod
     def check(ip):
         """ 检查 ip 格式是否正确, 并区分ipv4/ipv6
@@ -31,13 +50,74 @@ class IPV(object):
         @return: ip 的版本
         @rtype : IPV
         """
+        return IPV.parse(ip).version
+
+    @staticmethod
+    def parse(ip):
+        """ 解析 ip
+
+        基本思路:
+        最近的解析结果按两代缓存 (近似 LRU, 总数不超过 IPV.SIZE):
+        - 命中 RECENT 直接返回; 命中 OLD 时移入 RECENT;
+        - RECENT 满 SIZE / 2 时, RECENT 成为 OLD, 原 OLD 整体淘汰。
+
+        @param ip: ip
+        @type  ip: string (ipv4/ipv6)
+
+        @return: 解析结果, 格式错误时 version 为 IPV.ERROR
+        @rtype : Address
+        """
         if not isinstance(ip, str):
-            return IPV.ERROR
-        if re.match(IPV.IPV4_REGEX, ip) is not None:
-            return IPV.IPV4
+            return Address(ip)
+        address = IPV.RECENT.get(ip)
+        if address is not None:
+            return address
+        address = IPV.OLD.get(ip)
+        if address is None:
+            address = IPV.__parse(ip)
+        IPV.LOCK.acquire()
+        try:
+            if len(IPV.RECENT) >= IPV.SIZE // 2:
+                IPV.OLD = IPV.RECENT
+                IPV.RECENT = {}
+            IPV.RECENT[ip] = address
+        finally:
+            IPV.LOCK.release()
+        return address
+
+    @staticmethod
+    def __parse(ip):
+        """ 不使用正则表达式解析 ip """
+        if ':' not in ip:
+            return IPV.__parse4(ip)
+        if hasattr(socket, 'inet_pton'):
+            try:
+                packed = socket.inet_pton(socket.AF_INET6, ip)
+                return Address(ip, IPV.IPV6, socket.AF_INET6, packed)
+            except (socket.error, ValueError):
+                return Address(ip)
+        # Windows 下的 Python 2 没有 socket.inet_pton
         if re.match(IPV.IPV6_REGEX, ip) is not None:
-            return IPV.IPV6
-        return IPV.ERROR
+            return Address(ip, IPV.IPV6, socket.AF_INET6)
+        return Address(ip)
+
+    @staticmethod
+    def __parse4(ip):
+        """ 解析 ipv4: 4 段 0-255 的十进制整数 """
+        if hasattr(socket, 'inet_pton'):
+            try:
+                packed = socket.inet_pton(socket.AF_INET, ip)
+                return Address(ip, IPV.IPV4, socket.AF_INET, packed)
+            except (socket.error, ValueError):
+                return Address(ip)
+        nodes = ip.split('.')
+        if len(nodes) != 4:
+            return Address(ip)
+        for node in nodes:
+            if not node.isdigit() or len(node) > 3 or int(node) > 255:
+                return Address(ip)
+        packed = struct.pack('!BBBB', *[int(x) for x in nodes])
+        return Address(ip, IPV.IPV4, socket.AF_INET, packed)
 
 
 class IPV4(object):
@@ -58,6 +138,7 @@ class IPV4(object):
         self.chksum = 0             # 首部校验和 (16 bit)
         self.src = 0                # 源地址 (32 bit)
         self.dst = 0                # 目的地址 (32 bit)
+        self.header = ''            # 首部原始数据 (含选项)
 
     def analysis(self, ipv4):
         """ 解析ipv4数据报
@@ -81,4 +162,106 @@ class IPV4(object):
         self.chksum = header[7]
         self.src = reduce(lambda x, y: str(x) + '.' + str(y), header[8:12])
         self.dst = reduce(lambda x, y: str(x) + '.' + str(y), header[12:16])
+        self.header = ipv4[0:self.header_length]
         return True
+
+    def verify(self):
+        """ 校验已解析数据报的首部检验和 """
+        return len(self.header) >= 20 and verify_check_sum(self.header)
+
+
+class IPV4View(object):
+    """ IPV4 数据报首部的只读视图
+
+    基本思路:
+    - 直接引用接收缓冲区 (memoryview), 不拷贝报文, 不预先解析任何字段;
+    - 字段在访问时才用预编译的 struct.Struct 从对应偏移处解码;
+    - 源/目的地址以 4 字节的网络字节序形式比较, 只在需要时才转换为点分字符串;
+    - 接收缓冲区会被下一次接收覆盖, 交付给其他线程前需调用 detach 拷贝首部。
+    """
+    __slots__ = ('buffer', 'addr')
+
+    BYTE = struct.Struct('!B')
+    SHORT = struct.Struct('!H')
+
+    def __init__(self, buffer=None, addr=None):
+        """ 初始化
+
+        @param buffer: IP 数据报
+        @type  buffer: memoryview/str
+
+        @param addr: 无 IP 首部时 (如 ICMP 数据报套接字) 的源地址
+        @type  addr: string (ipv4)
+        """
+        self.buffer = buffer
+        self.addr = None if addr is None else IPV.parse(addr).packed
+
+    def valid(self):
+        """ 检查是否为完整的 IPV4 首部 """
+        if self.buffer is None or len(self.buffer) < 20:
+            return False
+        first = IPV4View.BYTE.unpack_from(self.buffer, 0)[0]
+        header_length = (first & 0xf) * 4
+        return first >> 4 == 4 and 20 <= header_length <= len(self.buffer)
+
+    @property
+    def header_length(self):
+        """ 首部长度 (单位: bytes), 无 IP 首部时为 0 """
+        if self.buffer is None:
+            return 0
+        return (IPV4View.BYTE.unpack_from(self.buffer, 0)[0] & 0xf) * 4
+
+    @property
+    def length(self):
+        return IPV4View.SHORT.unpack_from(self.buffer, 2)[0]
+
+    @property
+    def ttl(self):
+        """ 生存时间, 无 IP 首部时为 0 """
+        if self.buffer is None:
+            return 0
+        return IPV4View.BYTE.unpack_from(self.buffer, 8)[0]
+
+    @property
+    def proto(self):
+        return IPV4View.BYTE.unpack_from(self.buffer, 9)[0]
+
+    @property
+    def packed_src(self):
+        """ 源地址 (4 bytes, 网络字节序) """
+        if self.buffer is None:
+            return self.addr
+        return self.buffer[12:16]
+
+    @property
+    def packed_dst(self):
+        """ 目的地址 (4 bytes, 网络字节序) """
+        return self.buffer[16:20]
+
+    @property
+    def src(self):
+        return IPV4View.__ntoa(self.packed_src)
+
+    @property
+    def dst(self):
+        return IPV4View.__ntoa(self.packed_dst)
+
+    @staticmethod
+    def __ntoa(packed):
+        if isinstance(packed, memoryview):
+            packed = packed.tobytes()
+        return socket.inet_ntoa(packed)
+
+    def payload(self):
+        """ 首部之后的数据 (视图, 不拷贝) """
+        return self.buffer[self.header_length:]
+
+    def verify(self):
+        """ 校验首部检验和 """
+        return verify_check_sum(self.buffer[0:self.header_length])
+
+    def detach(self):
+        """ 将首部从接收缓冲区中拷贝出来, 之后视图不再依赖接收缓冲区 """
+        if isinstance(self.buffer, memoryview):
+            self.buffer = self.buffer[0:self.header_length].tobytes()
+        return self
@@ -11,14 +11,420 @@
 主机之间的网络连接。
 
 """
-import os
+import copy
+import heapq
+import random
+import select
+import threading
+import time
 import timeit
+from collections import OrderedDict
+from Queue import Queue, Empty
 
 from config.runtime import CLIENT
 from config.logger import Logger
-from core.packet.dns import QueryType, DNStatus, DNS
+from core.packet.dns import QueryType, QueryTemplate, DNStatus, DNS
 from config.constant import PORT, PROTO, SOCKET
 from core.spider.structure import DNSResolverStruct
+from core.spider.rate import RATE
+
+
+class DNSCache(object):
+    """ DNS 回答缓存
+
+    基本思路:
+    - 以 (域名, DNS 服务器) 为键, 缓存成功的解析结果直到 TTL 到期;
+    - 缓存时间不超过 LIFETIME (调度的最长重新解析间隔), 按 TTL 重新计划的
+      解析总是向服务器查询, 能及时发现 CDN 的变化;
+    - 超过容量时淘汰最久未使用的记录 (LRU);
+    - 命中时返回记录的拷贝, 其 ttl 为剩余有效期, cached 为 True (不是新的
+      测量结果, 不再上传)。
+    """
+    SIZE = 1024                     # 最大缓存记录数
+    LIFETIME = 300                  # 最长缓存时间(单位: s), 0 表示不限制
+
+    def __init__(self):
+        self.records = OrderedDict()    # (域名, 服务器): (到期时间, 记录)
+        self.lock = threading.Lock()
+
+    def get(self, domain, server):
+        """ 获取未过期的解析结果
+
+        @return: 解析结果, 不存在或已过期时为 None
+        @rtype : DNSResolverStruct
+        """
+        now = timeit.default_timer()
+        self.lock.acquire()
+        try:
+            item = self.records.pop((domain, server), None)
+            if item is None or item[0] <= now:
+                return None
+            self.records[(domain, server)] = item
+            record = copy.copy(item[1])
+            record.ttl = item[0] - now
+            record.cached = True
+            return record
+        finally:
+            self.lock.release()
+
+    def put(self, record):
+        """ 缓存一个成功的解析结果 """
+        if record.status != DNStatus.NO_ERROR or record.ttl <= 0:
+            return
+        key = (record.domain, record.dns)
+        # TTL 从收到回答时开始计算
+        lifetime = record.ttl
+        if DNSCache.LIFETIME > 0:
+            lifetime = min(lifetime, DNSCache.LIFETIME)
+        expire = record.recv_timestamp / 1000 + lifetime
+        self.lock.acquire()
+        try:
+            self.records.pop(key, None)
+            self.records[key] = (expire, record)
+            while len(self.records) > DNSCache.SIZE:
+                self.records.popitem(last=False)
+        finally:
+            self.lock.release()
+
+
+class DNSEngine(object):
+    """ 进程级 DNS 查询引擎
+
+    基本思路:
+    - 每个 DNS 服务器维护一个长期存在的 UDP 套接字(connect 到服务器), 避免每次
+      解析都创建和关闭套接字;
+    - 由 ID 分配器为每个在途查询分配同一服务器内唯一的会话标识;
+    - 一个接收线程负责所有套接字, 按 (服务器, ID, 问题域名) 将回答报文分发给
+      等待的解析过程; 问题域名统一为小写并去掉末尾的点, 服务器改变大小写
+      或 检测列表中的域名带末尾的点时仍能匹配;
+    - resolve 一次发送整个解析列表的查询, 超时和重传由最小堆统一计时;
+    - TTL 未到期的 (域名, 服务器) 直接使用 DNSCache 中的结果, 不再发送查询。
+    """
+    INSTANCE = None
+    LOCK = threading.Lock()
+    TIMEOUT = 1                     # 接收线程等待报文的超时时间(单位: s)
+
+    @staticmethod
+    def get():
+        """ 获取进程唯一的 DNSEngine, 首次调用时创建 """
+        DNSEngine.LOCK.acquire()
+        try:
+            if DNSEngine.INSTANCE is None:
+                DNSEngine.INSTANCE = DNSEngine()
+            return DNSEngine.INSTANCE
+        finally:
+            DNSEngine.LOCK.release()
+
+    def __init__(self):
+        self.logger = Logger.get()
+        self.socks = {}             # 服务器: 套接字
+        self.servers = {}           # 套接字: 服务器
+        self.waiters = {}           # (服务器, ID, 域名): Queue
+        self.ids = set()            # 在途的 (服务器, ID)
+        self.cache = DNSCache()
+        self.lock = threading.Lock()
+        # 新增套接字时唤醒接收线程; select 在 Windows 上只接受套接字, 使用
+        # 连接到自身的本地 UDP 套接字, 创建失败时等待 TIMEOUT 后再读取
+        self.wake = self.__wake()
+        reader = threading.Thread(target=self.__read)
+        reader.setDaemon(True)
+        reader.start()
+
+    def __sock(self, server):
+        """ 获取 DNS 服务器对应的套接字, 不存在时创建 """
+        self.lock.acquire()
+        try:
+            sock = self.socks.get(server)
+            if sock is not None:
+                return sock
+            sock = SOCKET.create(server, PROTO.UDP)
+            if sock is None:
+                return None
+            try:
+                sock.connect((server, PORT.DNS))
+            except Exception:
+                self.logger.exception('Failed to connect the dns server.')
+                return SOCKET.close(sock)
+            self.socks[server] = sock
+            self.servers[sock] = server
+        finally:
+            self.lock.release()
+        if self.wake is not None:
+            try:
+                self.wake.send('x')
+            except Exception:
+                self.logger.exception('Failed to wake the dns reader.')
+        return sock
+
+    def __wake(self):
+        """ 创建唤醒接收线程的本地 UDP 套接字 """
+        sock = SOCKET.create('127.0.0.1', PROTO.UDP)
+        if sock is None:
+            return None
+        try:
+            sock.bind(('127.0.0.1', 0))
+            sock.connect(sock.getsockname())
+            sock.setblocking(False)
+        except Exception:
+            self.logger.exception('Failed to create the dns wake socket.')
+            return SOCKET.close(sock)
+        return sock
+
+    @staticmethod
+    def normalize(domain):
+        """ 分发回答报文使用的域名: 小写, 去掉末尾的点 """
+        return domain.rstrip('.').lower()
+
+    def register(self, server, domain, queue):
+        """ 分配一个服务器内空闲的会话 ID, 并登记接收回答报文的队列
+
+        @return: 会话 ID, -1 表示没有空闲的 ID
+        @rtype : int
+        """
+        self.lock.acquire()
+        try:
+            for _ in xrange(0x10000):
+                ID = random.getrandbits(16)
+                if (server, ID) not in self.ids:
+                    self.ids.add((server, ID))
+                    key = (server, ID, DNSEngine.normalize(domain))
+                    self.waiters[key] = queue
+                    return ID
+            self.logger.warning('No free dns transaction id.')
+            return -1
+        finally:
+            self.lock.release()
+
+    def release(self, server, ID, domain):
+        """ 注销会话 ID """
+        self.lock.acquire()
+        try:
+            self.ids.discard((server, ID))
+            self.waiters.pop((server, ID, DNSEngine.normalize(domain)), None)
+        finally:
+            self.lock.release()
+
+    def __dispatch(self, server, recv_time, packet):
+        """ 解析一个回答报文, 分发给等待的解析过程 """
+        response = DNS()
+        if not response.analysis(packet):
+            return
+        domain = response.question.domain
+        if domain is None:
+            return
+        key = (server, response.id, DNSEngine.normalize(domain))
+        self.lock.acquire()
+        try:
+            queue = self.waiters.get(key)
+        finally:
+            self.lock.release()
+        if queue is None:
+            self.logger.warning('Get a unexpected packet.')
+            return
+        queue.put((key, recv_time, response))
+
+    def __read(self):
+        """ 接收线程: 读取全部 DNS 服务器套接字 """
+        while True:
+            self.lock.acquire()
+            socks = self.socks.values()
+            self.lock.release()
+            if self.wake is not None:
+                socks.append(self.wake)
+            if not socks:
+                # Windows 的 select 不接受空列表
+                time.sleep(DNSEngine.TIMEOUT)
+                continue
+            try:
+                readable = select.select(socks, [], [], DNSEngine.TIMEOUT)[0]
+            except Exception:
+                self.logger.exception('Failed to wait dns response packets.')
+                time.sleep(DNSEngine.TIMEOUT)
+                continue
+            for sock in readable:
+                if sock is self.wake:
+                    self.__drain()
+                    continue
+                recv_time, packet = SOCKET.recvfrom(sock, 0)
+                if recv_time < 0:
+                    continue
+                try:
+                    self.__dispatch(self.servers[sock], recv_time, packet)
+                except Exception:
+                    self.logger.exception('Failed to dispatch a dns packet.')
+
+    def __drain(self):
+        """ 读出唤醒套接字中的全部报文 """
+        try:
+            while True:
+                self.wake.recv(64)
+        except Exception:
+            pass
+
+    def __send(self, query, queue):
+        """ 分配会话 ID 并发送DNS请求报文
+
+        @param query: 一个 (域名, DNS 服务器) 的查询状态
+        @type  query: dict
+
+        @return: 发送时间, -1 表示发送失败
+        @rtype : double
+        """
+        query['id'] = self.register(query['dns'], query['domain'], queue)
+        if query['id'] < 0:
+            return -1
+        try:
+            # 构建 dns 查询报文
+            packet = QueryTemplate.get(query['domain']).construct(query['id'])
+            sent_time = timeit.default_timer()
+            query['sock'].send(packet)
+            self.logger.info('Successfully send a dns query packet.')
+            return sent_time
+        except Exception:
+            self.release(query['dns'], query['id'], query['domain'])
+            self.logger.exception('Failed to send a dns query packet.')
+            return -1
+
+    def __record(self, query):
+        """ 整理一个 (域名, DNS 服务器) 的查询结果
+
+        @return: 查询结果
+        @rtype : DNSResolverStruct
+        """
+        record = DNSResolverStruct()
+        sent_time = query['sent']
+        recv_time = query['recv']
+        response = query['response']
+        # 记录 查询过程 参数
+        record.dns = query['dns']
+        record.domain = query['domain']
+        record.send_timestamp = sent_time * 1000
+        record.recv_timestamp = recv_time * 1000
+        latency = (recv_time - sent_time) * 1000
+        record.latency = -1 if latency < 0 else latency
+        # 记录 查询结果
+        if response is None:
+            if query['sock'] is None:
+                record.status = DNStatus.SOCK_ERROR
+            elif recv_time == -4:
+                record.status = DNStatus.TIME_OUT
+            else:
+                record.status = DNStatus.RUN_ERROR
+            record.cnames = []
+            record.ips = []
+        else:
+            record.status = response.rcode()
+            record.cnames = response.answer(QueryType.CNAME)
+            record.ips = response.answer(QueryType.A)
+            record.ttl = response.ttl()
+            if len(record.ips) == 0:
+                record.status = DNStatus.NO_ANSWER
+        return record
+
+    def resolve(self, resolvers):
+        """ 批量进行 DNS 解析
+
+        基本思路:
+        - 一次性向所有 DNS 服务器发送全部域名的查询报文;
+        - 每个查询独立计时, 超时后以新的会话 ID 重传, 直到收到回答或重试次数
+          用尽;
+        - 超时计划存放在最小堆中, 由最早到期的查询决定等待时间;
+        - 发送前申请 RATE 速率限制, 超过限制时推迟发送, 推迟的发送同样
+          存放在最小堆中 (会话 ID 为 -1)。
+
+        @param resolvers: 已配置域名的 DNS 解析器
+        @type  resolvers: [DNSResolver]
+        """
+        queue = Queue()
+        queries = []
+        for resolver in resolvers:
+            for dns in CLIENT.DNS:
+                cached = self.cache.get(resolver.domain, dns)
+                queries.append({
+                    'resolver': resolver,
+                    'domain': resolver.domain,
+                    'name': DNSEngine.normalize(resolver.domain),
+                    'dns': dns,
+                    'cached': cached,
+                    'sock': None if cached else self.__sock(dns),
+                    'id': -1,
+                    'retry': 0,
+                    'sent': 0.0,
+                    'recv': 0.0,
+                    'response': None
+                })
+        timers = []                 # (到期时间, 查询序号, 会话 ID)
+        pending = {}                # (服务器, ID, 规范化的域名): 查询序号
+        deferred = set()            # 推迟发送的查询序号
+
+        def send(index):
+            """ 发送 或 重传 一个查询 """
+            query = queries[index]
+            resolver = query['resolver']
+            if query['retry'] >= resolver.retry:
+                query['recv'] = -4
+                return
+            delay = RATE.reserve(query['dns'])
+            if delay > 0:
+                # 超过发送速率限制, 推迟发送
+                deferred.add(index)
+                due = timeit.default_timer() + delay
+                heapq.heappush(timers, (due, index, -1))
+                return
+            if query['retry'] > 0:
+                self.logger.info('...retry the %dth time...' % query['retry'])
+            query['retry'] = query['retry'] + 1
+            query['sent'] = self.__send(query, queue)
+            if query['sent'] < 0:
+                query['recv'] = -1
+                return
+            pending[(query['dns'], query['id'], query['name'])] = index
+            due = query['sent'] + resolver.timeout
+            heapq.heappush(timers, (due, index, query['id']))
+
+        for index, query in enumerate(queries):
+            if query['cached'] is None and query['sock'] is not None:
+                send(index)
+
+        while len(pending) > 0 or len(deferred) > 0:
+            # 处理全部超时的查询 及 推迟的发送
+            now = timeit.default_timer()
+            while len(timers) > 0 and timers[0][0] <= now:
+                _, index, ID = heapq.heappop(timers)
+                if ID < 0:
+                    deferred.discard(index)
+                    send(index)
+                    continue
+                query = queries[index]
+                key = (query['dns'], ID, query['name'])
+                # 已收到回答的查询不再处理
+                if pending.pop(key, None) is None:
+                    continue
+                self.release(*key)
+                send(index)
+            if len(pending) == 0 and len(deferred) == 0:
+                break
+
+            # 等待回答, 直到下一个查询超时
+            remain = max(timers[0][0] - timeit.default_timer(), 0)
+            try:
+                key, recv_time, response = queue.get(timeout=remain)
+            except Empty:
+                continue
+            index = pending.pop(key, None)
+            if index is None:
+                continue
+            self.release(*key)
+            queries[index]['recv'] = recv_time
+            queries[index]['response'] = response
+
+        for query in queries:
+            record = query['cached']
+            if record is None:
+                record = self.__record(query)
+                self.cache.put(record)
+            query['resolver'].records.append(record)
+        return True
 
 
 class DNSResolver(object):
@@ -27,17 +433,14 @@ class DNSResolver(object):
     基本思路:
     - One dns server, one record.
     - All dns server, one ip set.
+    - 报文收发由 DNSEngine 统一负责, 多个域名可以一次批量解析。
     """
     def __init__(self):
         self.logger = Logger.get()
         self.domain = None
         self.timeout = 0.5
-        self.count = 2
-        self.id = 0
+        self.retry = 2
         self.records = []
-        self.send_timestamp = 0.0
-        self.recv_timestamp = 0.0
-        self.latency = 0
 
     def config(self, domain=None, timeout=0.5, retry=2):
         """ 配置 DNS 解析器
@@ -55,133 +458,56 @@ class DNSResolver(object):
             self.domain = domain
         self.timeout = timeout
         self.retry = retry
-        self.id = os.getpid() & 0xffff
         self.records = []
 
-    def __send(self, sock, dns):
-        """ 发送DNS请求报文
-
-        @param sock: 网络套接字
-        @type  sock: socket
-
-        @param dns_server: dns 服务器
-        @type  dns_server: IPV4/IPV6
-
-        @return: DNS查询报文, 发送时间
-        @rtype : (packet.DNS(), double)
-
-        @raise socket.error: 内部不处理, 交由外部处理
-        """
-        self.logger.info('Start to send a dns query packet.')
-        try:
-            # 构建 dns 查询报文
-            query = DNS()
-            packet = query.construct(domain=self.domain, ID=self.id)
-            sock.sendto(packet, (dns, PORT.DNS))
-            self.logger.info('Successfully send a dns query packet.')
-            return (timeit.default_timer(), query)
-        except Exception:
-            self.logger.exception('Failed to send a dns query packet.')
-            return (-1, None)
-
-    def __recv(self, sock, sent_time):
-        """ 接收 DNS回答报文
-
-        @param sock: 网络套接字
-        @type  sock: socket
-
-        @param sent_time: 发送时间
-        @type  sent_time: double
-
-        @return: 接收时间, DNS回答报文
-        @rtype : (double, packet.DNS)
-
-        @raise socket.error: 内部不处理, 交由外部处理
-        """
-        self.logger.info('Expecting a dns response packet.')
-        remain_time = 0
-        while True:
-            remain_time = self.timeout - timeit.default_timer() + sent_time
-            recv_time, packet = SOCKET.recvfrom(sock, remain_time)
-            if recv_time < 0:
-                return (recv_time, None)
-
-            response = DNS()
-            ok = response.analysis(packet)
-            same = (self.domain == response.question.domain)
-
-            if ok and same and response.id == self.id:
-                self.logger.info('Successfully get a dns response packet.')
-                return (recv_time, response)
-            else:
-                self.logger.warning('Get a unexpected packet.')
-
     def resolve(self):
-        """ 进行 DNS 解析"""
+        """ 进行 DNS 解析 """
         if self.domain in {None, ''}:
             self.logger.error("The client does't exist DNS servers.")
             return False
-        for dns in CLIENT.DNS:
-            # 选择 DNS 服务器
-            info = 'Start to dns resolve the domain: %s by dns server: %s'
-            self.logger.info(info % (self.domain, dns))
-
-            retry = 0
-            record = DNSResolverStruct()
-            sent_time = 0.0
-            recv_time = 0.0
-            response = None
-            sock = SOCKET.create(dns, PROTO.UDP)
-            while retry < self.retry:
-                self.logger.info('...retry the %dth time...' % (retry))
-                if sock is None:
-                    break
-                # 发送 DNS 查询报文
-                sent_time, query = self.__send(sock, dns)
-                # 接收 DNS 回答报文
-                recv_time, response = self.__recv(sock, sent_time)
-                # 超时重传
-                if recv_time - sent_time > 0 and response is not None:
-                    break
-                retry = retry + 1
-                # id + 1
-                self.id = (self.id + 1) & 0xffff
-
-            # 记录 查询过程 参数
-            record.dns = dns
-            record.domain = self.domain
-            record.send_timestamp = sent_time * 1000
-            record.recv_timestamp = recv_time * 1000
-            latency = (recv_time - sent_time) * 1000
-            record.latency = -1 if latency < 0 else latency
-            # 记录 查询结果
-            if response is None:
-                if sock is None:
-                    record.status = DNStatus.SOCK_ERROR
-                elif recv_time == -1:
-                    record.status = DNStatus.TIME_OUT
-                else:
-                    record.status = DNStatus.RUN_ERROR
-                record.cnames = []
-                record.ips = []
-            else:
-                record.status = response.rcode()
-                record.cnames = response.answer(QueryType.CNAME)
-                record.ips = response.answer(QueryType.A)
-                if len(record.ips) == 0:
-                    record.status = DNStatus.NO_ANSWER
-            self.records.append(record)
-            sock = SOCKET.close(sock)
-
-            info = 'End dns resolving the domain: %s by dns server: %s'
-            self.logger.info(info % (self.domain, dns))
+        info = 'Start to dns resolve the domain: %s by dns servers: %s'
+        self.logger.info(info % (self.domain, CLIENT.DNS))
+        DNSEngine.get().resolve([self])
+        info = 'End dns resolving the domain: %s by dns servers: %s'
+        self.logger.info(info % (self.domain, CLIENT.DNS))
         return True
 
+    @staticmethod
+    def batch(domains, timeout=0.5, retry=2):
+        """ 一次批量解析多个域名
+
+        @param domains: 域名列表
+        @type  domains: [string]
+
+        @return: 每个域名一个已完成解析的 DNSResolver
+        @rtype : [DNSResolver]
+        """
+        resolvers = []
+        for domain in domains:
+            if domain in {None, ''}:
+                continue
+            # 每个解析器的日志写入域名各自的日志
+            Logger.sign_up(domain)
+            try:
+                resolver = DNSResolver()
+            finally:
+                Logger.log_out()
+            resolver.config(domain, timeout, retry)
+            resolvers.append(resolver)
+        DNSEngine.get().resolve(resolvers)
+        return resolvers
+
+    def ttl(self):
+        """ 获取 所有成功解析结果中最小的 TTL(单位: s), 无成功结果时为 0 """
+        ttls = [x.ttl for x in self.records
+                if x.status == DNStatus.NO_ERROR and x.ttl > 0]
+        return 0 if len(ttls) == 0 else min(ttls)
+
     def ips(self):
         """ 获取 所有DNS解析得到的 IP """
         ips = []
         try:
-            ips = set(reduce(lambda x, y: x.ips + y.ips, self.records))
+            ips = set(reduce(lambda x, y: x + y.ips, self.records, []))
             ips = [ip for ip in ips]
         except Exception:
             self.logger.info('The type of records is: %s' % type(self.records))
@@ -190,9 +516,10 @@ class DNSResolver(object):
             return ips
 
     def json(self):
+        """ 导出新的解析结果, 来自 DNSCache 的结果不重复导出 """
         records = {}
         try:
-            records = map(lambda x: x.json(), self.records)
+            records = [x.json() for x in self.records if not x.cached]
         except Exception:
             self.logger.info('The type of records is: %s' % type(self.records))
             self.logger.exception('Failed to transfer into json.')
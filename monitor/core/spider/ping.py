@@ -12,16 +12,174 @@
 
 """
 
+import heapq
+import os
 import re
+import socket
 import threading
 import time
 import timeit
+from Queue import Queue, Empty
 
 from config.constant import PROTO, SOCKET
 from config.logger import Logger
 from core.spider.structure import ICMPingStruct
-from core.packet.icmp import ICMP
-from core.packet.ip import IPV4
+from core.packet.icmp import ICMP, TYPE, EchoTemplate
+from core.packet.ip import IPV, IPV4View
+from core.spider.rate import RATE
+
+
+class ICMPEngine(object):
+    """ 进程级 ICMP 收发引擎
+
+    基本思路:
+    - 每个 SOCK_RAW 套接字都会收到主机上所有的 ICMP 报文, N 个并发的 ICMPing
+      各自持有套接字时, 每个回送响应报文会被复制 N 次、解析 N 次;
+    - 整个进程只维护一个原始套接字和一个接收线程, 每个报文只解析一次;
+    - 引擎使用统一的标识符, 为每次探测分配报文序列号, 接收线程按
+      (identifier, sequence) 将回送响应报文分发给等待的探测; 源地址不是探测
+      目的主机的报文 (如迟到或伪造的回答) 不会占用等待的序列号;
+    - DGRAM 为真时在 Linux 上优先使用 ICMP 数据报套接字, 由内核只投递属于本
+      套接字的回送回答(不含 IP 首部, 无法获取 TTL); 否则使用原始套接字, 并
+      挂载只接收本引擎标识符的 BPF 过滤器。
+    """
+    INSTANCE = None
+    LOCK = threading.Lock()
+    DGRAM = True                    # 优先使用 ICMP 数据报套接字
+    TIMEOUT = 1                     # 接收线程等待报文的超时时间(单位: s)
+    RCVBUF = 4 * 1024 * 1024        # 套接字接收缓冲区(单位: bytes)
+
+    @staticmethod
+    def get():
+        """ 获取进程唯一的 ICMPEngine, 首次调用时创建 """
+        ICMPEngine.LOCK.acquire()
+        try:
+            if ICMPEngine.INSTANCE is None:
+                ICMPEngine.INSTANCE = ICMPEngine()
+            return ICMPEngine.INSTANCE
+        finally:
+            ICMPEngine.LOCK.release()
+
+    def __init__(self):
+        self.logger = Logger.get()
+        self.id = os.getpid() & 0xffff
+        self.seq = 0
+        self.waiters = {}           # (identifier, sequence): (Queue, 目的)
+        self.lock = threading.Lock()
+        self.dgram = False
+        self.filter = None
+        self.sock = SOCKET.create('0.0.0.0', PROTO.ICMP, ICMPEngine.DGRAM)
+        if self.sock is not None and self.sock.type == socket.SOCK_DGRAM:
+            # 内核以绑定的端口号作为回送请求报文的标识符
+            try:
+                self.sock.bind(('0.0.0.0', 0))
+                self.id = self.sock.getsockname()[1] & 0xffff
+                self.dgram = True
+                self.logger.info('Use the icmp datagram socket.')
+            except Exception:
+                self.logger.exception('Failed to bind the icmp socket.')
+                self.sock = SOCKET.close(self.sock)
+                self.sock = SOCKET.create('0.0.0.0', PROTO.ICMP)
+        if self.sock is not None and not self.dgram:
+            self.filter = SOCKET.attach(self.sock, ICMP.bpf(self.id))
+        if self.sock is not None:
+            # 大量探测同时在途时, 避免回答在内核缓冲区中被丢弃
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                     ICMPEngine.RCVBUF)
+            except Exception:
+                self.logger.exception('Failed to set the icmp recv buffer.')
+            reader = threading.Thread(target=self.__read)
+            reader.setDaemon(True)
+            reader.start()
+
+    def register(self, queue, packed_dst):
+        """ 分配一个空闲的报文序列号, 并登记接收回送响应报文的队列
+
+        @param queue: 接收 (recv_time, ICMP(), IPV4View()) 的队列
+        @type  queue: Queue
+
+        @param packed_dst: 探测的目的主机 (4 bytes, 网络字节序), 只接收
+                           源地址为该主机的回送响应报文
+        @type  packed_dst: string
+
+        @return: 报文序列号, -1 表示没有空闲的序列号
+        @rtype : int
+        """
+        self.lock.acquire()
+        try:
+            for _ in xrange(0x10000):
+                seq = self.seq
+                self.seq = (self.seq + 1) & 0xffff
+                if (self.id, seq) not in self.waiters:
+                    self.waiters[(self.id, seq)] = (queue, packed_dst)
+                    return seq
+            self.logger.warning('No free icmp sequence number.')
+            return -1
+        finally:
+            self.lock.release()
+
+    def release(self, seq):
+        """ 注销报文序列号 """
+        self.lock.acquire()
+        try:
+            self.waiters.pop((self.id, seq), None)
+        finally:
+            self.lock.release()
+
+    def __dispatch(self, recv_time, packet, addr):
+        """ 解析一个报文, 分发给等待该回送响应报文的探测 """
+        icmp = ICMP()
+        if self.dgram:
+            # ICMP 数据报套接字收到的报文不含 IP 首部
+            ipv4 = IPV4View(addr=addr[0])
+            ok = icmp.analysis(packet)
+        else:
+            ipv4 = IPV4View(packet)
+            ok = ipv4.valid() and ipv4.verify()
+            ok = ok and icmp.analysis(ipv4.payload())
+        if not ok or icmp.type != TYPE.ECHO_REPLY:
+            return
+        if not icmp.verify():
+            self.logger.warning('Drop a icmp packet with bad checksum.')
+            return
+        key = (icmp.id, icmp.seq)
+        self.lock.acquire()
+        try:
+            waiter = self.waiters.get(key)
+            if waiter is None or ipv4.packed_src != waiter[1]:
+                # 保留等待, 之后到达的真正回答仍可匹配
+                return
+            queue = self.waiters.pop(key)[0]
+        finally:
+            self.lock.release()
+        # packet 为接收缓冲区的视图, 交付前拷贝出报文数据
+        icmp.icmp = icmp.icmp.tobytes()
+        icmp.data = icmp.icmp[8:]
+        queue.put((recv_time, icmp, ipv4.detach()))
+
+    def __read(self):
+        """ 接收线程: 读取套接字上的全部 ICMP 报文 """
+        while True:
+            recv_time, packet, addr = SOCKET.receive(
+                self.sock, ICMPEngine.TIMEOUT, view=True
+            )
+            if recv_time == -4:
+                continue
+            if recv_time < 0:
+                self.logger.warning('...icmp engine failed to recv...')
+                time.sleep(ICMPEngine.TIMEOUT)
+                continue
+            try:
+                self.__dispatch(recv_time, packet, addr)
+            except Exception:
+                self.logger.exception('Failed to dispatch a icmp packet.')
+
+
+class BURST(object):
+    """ 突发模式的定时事件 """
+    SEND = 0                        # 发送回送请求报文
+    TIMEOUT = 1                     # 等待回送响应报文超时
 
 
 class ICMPing(object):
@@ -31,7 +189,8 @@ class ICMPing(object):
     - 仅提供 Once ping one time. 的方法, ping 多次交由上层实现;
     - 记录最近 n 次 ping 的结果 和 单独记录最新一次 ping 的结果;
     - 用 config 方法重置 dst 时, 则会清空上述记录, 即使前后 dst 一致;
-    - ping 方法内部不处理异常 socket.error, 打印日志后直接抛出-交由上层处理。
+    - ping 方法内部不处理异常 socket.error, 打印日志后直接抛出-交由上层处理;
+    - 套接字和报文接收由 ICMPEngine 统一负责, ICMPing 只等待属于自己的回答。
 
     """
     def __init__(self):
@@ -41,7 +200,10 @@ class ICMPing(object):
         @type  dst: ipv4/ipv6
         """
         self.logger = Logger.get()
+        self.engine = ICMPEngine.get()
+        self.queue = Queue()
         self.dst = None
+        self.packed_dst = None
         self.sock = None
         self.timeout = 1
         self.interval = 0.0
@@ -75,49 +237,50 @@ class ICMPing(object):
             # 重置 目的 ip 时, 重置record/records
             # 记录最近 n 次ping的结果
             self.records = []
-            # 创建一个新的套接字 self.sock
-            self.sock = SOCKET.close(self.sock)
-            self.sock = SOCKET.create(self.dst, PROTO.ICMP)
+            # 使用 ICMPEngine 共享的套接字 self.sock
+            self.sock = None
+            self.packed_dst = None
+            address = IPV.parse(self.dst)
+            if address.version == IPV.IPV4:
+                self.sock = self.engine.sock
+                self.packed_dst = address.packed
+            else:
+                error = 'Failed to icmping due to the wrong ip: %s.'
+                self.logger.error(error % (self.dst))
 
         self.interval = interval
         self.timeout = timeout
-        self.id = threading.currentThread().ident & 0xffff
+        self.id = self.engine.id
 
     def __send(self, seq):
         """ 发送 ICMP 回送请求报文
 
         @return: (发送时间, ICMP 回送请求报文)
-        @rtype : (double, ICMP())
+        @rtype : (double, string)
         """
         try:
-            # 构建 ICMP 报文
-            sent_icmp = ICMP()
-            sent_icmp.construct(ID=self.id, Seq=seq)
+            # 由报文模板构建 ICMP 报文
+            sent_icmp = EchoTemplate.get(self.id).construct(seq)
             # 发送 ICMP 报文
-            self.sock.sendto(sent_icmp.icmp, (self.dst, 1))
+            # 回答可能在 sendto 返回前就被接收线程读取, 因此先记录发送时间
+            sent_time = timeit.default_timer()
+            self.sock.sendto(sent_icmp, (self.dst, 1))
             self.logger.info('Successfully send a echo request icmp packet.')
-            return (timeit.default_timer(), sent_icmp)
+            return (sent_time, sent_icmp)
         except Exception:
             self.logger.exception('Failed to send a echo request icmp packet.')
             return (-1, None)
 
-    def __recv(self, sent_time):
+    def __recv(self, sent_time, seq):
         """ 接收 ICMP 回送响应报文
 
         基本思路:
-        采用 select.select 监控 socket - Waiting for I/O completion
-        目的 : 用来监控 Ping 是否超时
-        - socket.recvfrom 会一直等待 I/O, 而没有 timeout 机制
-        - 当 select.select 完成时
-          - 未超时: 则通过socket.recvfrom获取数据, 检测是否为回送响应 ICMP 报文
-          - 超时: 则终止循环, 抛出 Timeout Error
-        设置 select.select() 剩余超时时间
-        - 当 socket 中有数据到来时, 不一定是 回送响应 ICMP 报文
-        - 因此, 需要进行多次 select.select()
+        由 ICMPEngine 的接收线程解析报文, 并将 (self.id, seq) 对应的回送响应
+        报文放入 self.queue, 这里只需等待队列:
         - 对于 send - recv 这一过程的总超时时间为 self.timeout 是确定的
-        - 每进行一次循环, select.select() 的超时时间也就要相应的减少
-        - 以保证 总的超时时间为 : self.timeout
-        已知. 发送开始时间 则 select.select 剩余超时时间为 :
+        - 队列中可能残留上一次 ping 超时后才到达的回答, 需要丢弃并继续等待
+        - 每进行一次循环, 等待的超时时间也就要相应的减少
+        已知. 发送开始时间 则剩余超时时间为 :
           self.time_out - timeit.default_timer() + self.sent_time
 
         @return: (recv_time, ICMP 回送响应报文, IP数据报)
@@ -127,35 +290,34 @@ class ICMPing(object):
         remain_time = 0
         while True:
             remain_time = self.timeout - timeit.default_timer() + sent_time
-            recv_time, packet = SOCKET.recvfrom(self.sock, remain_time)
-            if recv_time < 0:
-                return (recv_time, None, None)
+            if remain_time < 0:
+                self.logger.warning('Waiting for the packet timeout.')
+                return (-4, None, None)
+            try:
+                recv_time, icmp, ipv4 = self.queue.get(timeout=remain_time)
+            except Empty:
+                self.logger.warning('Waiting for the packet timeout.')
+                return (-4, None, None)
 
-            ipv4 = IPV4()
-            icmp = ICMP()
-            ok = ipv4.analysis(packet)
-            ok = ok and icmp.analysis(packet[ipv4.header_length:])
-            if ok and icmp.id == self.id and ipv4.src == self.dst:
+            if icmp.seq == seq and ipv4.packed_src == self.packed_dst:
                 info = 'Successfully get a echo response icmp packet.'
                 self.logger.info(info)
                 return (recv_time, icmp, ipv4)
             else:
                 self.logger.warning('Get a unexpected packet.')
 
-    def ping(self, seq=0):
-        """ ping one time. """
-        if self.sock is None:
-            return False
-        self.logger.info('Start to icmping the ip %s' % (self.dst))
-        sent_time, sent_icmp = self.__send(seq)
-        recv_time, recv_icmp, recv_ipv4 = self.__recv(sent_time)
+    def __record(self, seq, sent_time, sent_icmp,
+                 recv_time, recv_icmp, recv_ipv4):
+        """ 整理一次 ping 的记录
 
-        # 整理记录
+        @return: ping 的结果
+        @rtype : ICMPingStruct
+        """
         record = ICMPingStruct()
         record.seq = seq
         record.ttl = 0 if recv_ipv4 is None else recv_ipv4.ttl
         # 记录 ICMP 回送请求报文
-        record.sent_size = 0 if sent_icmp is None else len(sent_icmp.icmp)
+        record.sent_size = 0 if sent_icmp is None else len(sent_icmp)
         record.sent_timestamp = sent_time * 1000
         # 记录 ICMP 回送响应报文
         record.recv_size = 0 if recv_icmp is None else len(recv_icmp.icmp)
@@ -163,6 +325,25 @@ class ICMPing(object):
         # 计算延迟
         latency = (recv_time - sent_time) * 1000
         record.latency = -1 if latency <= 0 else latency
+        return record
+
+    def ping(self, seq=0):
+        """ ping one time. """
+        if self.sock is None:
+            return False
+        self.logger.info('Start to icmping the ip %s' % (self.dst))
+        # 报文序列号由 ICMPEngine 分配, 记录中仍使用 seq
+        wire_seq = self.engine.register(self.queue, self.packed_dst)
+        if wire_seq < 0:
+            return False
+        RATE.wait(self.dst)
+        sent_time, sent_icmp = self.__send(wire_seq)
+        recv_time, recv_icmp, recv_ipv4 = self.__recv(sent_time, wire_seq)
+        self.engine.release(wire_seq)
+
+        # 整理记录
+        record = self.__record(seq, sent_time, sent_icmp,
+                               recv_time, recv_icmp, recv_ipv4)
 
         # 存入历史记录
         self.records.append(record)
@@ -177,6 +358,110 @@ class ICMPing(object):
             return False
         return True
 
+    def burst(self, count):
+        """ 突发模式: ping count 次, 不等待上一个报文的回答 """
+        return ICMPing.bursts([self], count)
+
+    @staticmethod
+    def bursts(icmpings, count):
+        """ 突发模式: 在当前线程内完成多个 ICMPing 的 count 次 ping
+
+        基本思路:
+        - 按计划时间依次发送全部回送请求报文, 不等待上一个报文的回答;
+        - 所有探测共用一个接收队列, 回答到达时按报文序列号匹配;
+        - 发送计划和超时均存放在一个最小堆中, 由最早到期的事件决定等待时间;
+        - 同一目的主机的报文间隔 interval, 不同目的主机的发送时间在
+          interval 内错开, 避免瞬时的报文风暴;
+        - 发送前申请 RATE 速率限制, 超过限制时推迟发送。
+
+        @param icmpings: 已配置目的主机的 ICMPing
+        @type  icmpings: [ICMPing]
+
+        @param count: 每个目的主机的 ping 次数
+        @type  count: int
+        """
+        icmpings = [x for x in icmpings if x.sock is not None]
+        if len(icmpings) == 0 or count <= 0:
+            return False
+        engine = ICMPEngine.get()
+        queue = Queue()
+        timers = []                 # (到期时间, 事件, 参数)
+        pending = {}                # 报文序列号: 等待回答的探测
+        records = [[] for _ in icmpings]
+        unsent = len(icmpings) * count
+
+        start = timeit.default_timer()
+        for index, icmping in enumerate(icmpings):
+            offset = icmping.interval * index / len(icmpings)
+            for seq in range(count):
+                due = start + offset + icmping.interval * seq
+                heapq.heappush(timers, (due, BURST.SEND, (index, seq)))
+
+        def done(probe, recv_time, recv_icmp, recv_ipv4):
+            """ 完成一次探测, 整理记录 """
+            index, seq, sent_time, sent_icmp = probe
+            record = icmpings[index].__record(seq, sent_time, sent_icmp,
+                                              recv_time, recv_icmp, recv_ipv4)
+            records[index].append(record)
+
+        while unsent > 0 or len(pending) > 0:
+            # 处理全部到期的事件
+            now = timeit.default_timer()
+            while len(timers) > 0 and timers[0][0] <= now:
+                _, event, args = heapq.heappop(timers)
+                if event == BURST.SEND:
+                    index, seq = args
+                    delay = RATE.reserve(icmpings[index].dst)
+                    if delay > 0:
+                        # 超过发送速率限制, 推迟发送
+                        heapq.heappush(timers, (now + delay, event, args))
+                        continue
+                    unsent = unsent - 1
+                    wire_seq = engine.register(queue,
+                                               icmpings[index].packed_dst)
+                    if wire_seq < 0:
+                        done((index, seq, -1, None), -4, None, None)
+                        continue
+                    sent_time, sent_icmp = icmpings[index].__send(wire_seq)
+                    probe = (index, seq, sent_time, sent_icmp)
+                    if sent_icmp is None:
+                        engine.release(wire_seq)
+                        done(probe, -4, None, None)
+                        continue
+                    pending[wire_seq] = probe
+                    due = sent_time + icmpings[index].timeout
+                    heapq.heappush(timers, (due, BURST.TIMEOUT,
+                                            (wire_seq, probe)))
+                else:
+                    wire_seq, probe = args
+                    # 序列号可能已被回答释放并重新分配
+                    if pending.get(wire_seq) is probe:
+                        pending.pop(wire_seq)
+                        engine.release(wire_seq)
+                        done(probe, -4, None, None)
+            if len(timers) == 0:
+                break
+
+            # 等待回答, 直到下一个事件到期
+            remain = max(timers[0][0] - timeit.default_timer(), 0)
+            try:
+                recv_time, icmp, ipv4 = queue.get(timeout=remain)
+            except Empty:
+                continue
+            probe = pending.get(icmp.seq)
+            if probe is None or \
+                    ipv4.packed_src != icmpings[probe[0]].packed_dst:
+                icmpings[0].logger.warning('Get a unexpected packet.')
+                continue
+            pending.pop(icmp.seq)
+            engine.release(icmp.seq)
+            done(probe, recv_time, icmp, ipv4)
+
+        for index, icmping in enumerate(icmpings):
+            records[index].sort(key=lambda x: x.seq)
+            icmping.records.extend(records[index])
+        return True
+
     def json(self):
         records = []
         try:
@@ -0,0 +1,135 @@
+# coding: utf-8
+
+""" 探测报文发送速率限制
+
+基本思路:
+- 令牌桶: 以 rate 个/s 的速率补充令牌, 最多积累 burst 个, 每发送一个报文消耗
+  一个令牌;
+- 全部探测引擎共用一个全局令牌桶, 同时每个目的主机各有一个令牌桶;
+- 发送前调用 RATE.reserve: 两个令牌桶都有令牌时消耗并返回 0, 否则不消耗并
+  返回需要等待的时间, 由引擎推迟发送 (不阻塞引擎的事件循环);
+- 速率为 0 表示不限制。
+"""
+
+import threading
+import time
+import timeit
+
+
+class TokenBucket(object):
+    """ 令牌桶 """
+    def __init__(self, rate, burst=None):
+        """ 初始化
+
+        @param rate: 令牌补充速率(单位: 个/s)
+        @type  rate: double
+
+        @param burst: 最多积累的令牌数, 默认为 1s 的令牌数 (至少 1 个)
+        @type  burst: double
+        """
+        self.rate = float(rate)
+        self.burst = max(rate if burst is None else burst, 1.0)
+        self.tokens = self.burst
+        self.stamp = timeit.default_timer()
+
+    def delay(self, now, count=1):
+        """ 补充令牌, 返回拥有 count 个令牌还需等待的时间(单位: s) """
+        self.tokens = min(self.tokens + (now - self.stamp) * self.rate,
+                          self.burst)
+        self.stamp = now
+        if self.tokens >= count:
+            return 0.0
+        return (count - self.tokens) / self.rate
+
+    def take(self, count=1):
+        self.tokens = self.tokens - count
+
+    def full(self):
+        return self.tokens >= self.burst
+
+
+class RATE(object):
+    """ 全局 及 每个目的主机 的发送速率限制 """
+    TOTAL = 0                       # 全部报文的速率上限(单位: 个/s)
+    DESTINATION = 0                 # 每个目的主机的速率上限(单位: 个/s)
+    SIZE = 4096                     # 最多保存的目的主机令牌桶数
+
+    LOCK = threading.Lock()
+    BUCKET = None                   # 全局令牌桶
+    BUCKETS = {}                    # 目的主机: 令牌桶
+
+    @staticmethod
+    def configure(total=0, destination=0):
+        """ 设置速率上限, 并重置全部令牌桶
+
+        @param total: 全部报文的速率上限, 0 表示不限制
+        @type  total: double
+
+        @param destination: 每个目的主机的速率上限, 0 表示不限制
+        @type  destination: double
+        """
+        RATE.LOCK.acquire()
+        try:
+            RATE.TOTAL = total
+            RATE.DESTINATION = destination
+            RATE.BUCKET = TokenBucket(total) if total > 0 else None
+            RATE.BUCKETS = {}
+        finally:
+            RATE.LOCK.release()
+
+    @staticmethod
+    def reserve(dst, count=1):
+        """ 申请发送 count 个报文到 dst
+
+        @return: 0 表示已允许发送; 否则为需要等待的时间(单位: s)
+        @rtype : double
+        """
+        if RATE.TOTAL <= 0 and RATE.DESTINATION <= 0:
+            return 0.0
+        RATE.LOCK.acquire()
+        try:
+            now = timeit.default_timer()
+            buckets = []
+            if RATE.BUCKET is not None:
+                buckets.append(RATE.BUCKET)
+            if RATE.DESTINATION > 0:
+                buckets.append(RATE.__bucket(dst))
+            delay = max([x.delay(now, count) for x in buckets])
+            if delay == 0:
+                for bucket in buckets:
+                    bucket.take(count)
+            return delay
+        finally:
+            RATE.LOCK.release()
+
+    @staticmethod
+    def wait(dst, count=1):
+        """ 阻塞直到允许发送 count 个报文到 dst
+
+        @return: 等待的时间(单位: s)
+        @rtype : double
+        """
+        start = timeit.default_timer()
+        delay = RATE.reserve(dst, count)
+        while delay > 0:
+            time.sleep(delay)
+            delay = RATE.reserve(dst, count)
+        return timeit.default_timer() - start
+
+    @staticmethod
+    def __bucket(dst):
+        """ 获取目的主机的令牌桶 (调用者持有 RATE.LOCK) """
+        bucket = RATE.BUCKETS.get(dst)
+        if bucket is None:
+            if len(RATE.BUCKETS) >= RATE.SIZE:
+                # 令牌已满的令牌桶与新建的没有区别, 可以直接丢弃
+                now = timeit.default_timer()
+                for key in RATE.BUCKETS.keys():
+                    RATE.BUCKETS[key].delay(now)
+                    if RATE.BUCKETS[key].full():
+                        RATE.BUCKETS.pop(key)
+                if len(RATE.BUCKETS) >= RATE.SIZE:
+                    RATE.BUCKETS.clear()
+            bucket = TokenBucket(RATE.DESTINATION)
+            RATE.BUCKETS[dst] = bucket
+        return bucket
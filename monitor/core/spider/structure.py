@@ -40,6 +40,8 @@ class DNSResolverStruct(object):
         self.recv_timestamp = 0.0   # 接收时间戳        (单位 : ms)
         self.latency = 0            # 请求解析延迟      (单位 : ms)
         self.status = 0   # DNS报文的状态码
+        self.ttl = 0                # 回答的剩余有效期  (单位 : s)
+        self.cached = False         # 是否来自 DNS 缓存 (不导出)
 
     def json(self):
         return {